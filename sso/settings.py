@@ -85,6 +85,107 @@ WSGI_APPLICATION = "sso.wsgi.application"
 
 IDENTITY_WEBHOOK_URLS = env.dict("IDENTITY_WEBHOOK_URLS")
 IDENTITY_API_KEYS = env.dict("IDENTITY_API_KEYS")
+# The audiences which accept arrays of identities. The others receive one request per identity.
+IDENTITY_BULK_WEBHOOK_URLS = env.dict("IDENTITY_BULK_WEBHOOK_URLS", default={})
+
+# The identities are sent by `manage.py process_identity_webhooks`.
+IDENTITY_WEBHOOK_SETTINGS = {
+    # A delivery is given up after this number of failed attempts.
+    "MAX_ATTEMPTS": 10,
+    # Delay before the first retry, doubled after each failure.
+    "RETRY_BACKOFF": timedelta(seconds=30),
+    "MAX_RETRY_BACKOFF": timedelta(hours=1),
+    # A delivery claimed by a worker which dies is sent again after this delay.
+    "CLAIM_LEASE": timedelta(minutes=5),
+    # Delivery policy of every audience.
+    "DEFAULT_POLICY": {
+        # Timeouts of the requests, in seconds.
+        "CONNECT_TIMEOUT": 3.05,
+        "READ_TIMEOUT": 10,
+        # The circuit opens after this number of consecutive failures (network errors or 5xx responses)...
+        "FAILURE_THRESHOLD": 5,
+        # ... and lets `HALF_OPEN_MAX_CALLS` requests probe the audience after this delay.
+        "RECOVERY_TIMEOUT": timedelta(seconds=30),
+        "HALF_OPEN_MAX_CALLS": 1,
+        # Maximum number of keep-alive connections to the audience.
+        "POOL_SIZE": 10,
+        # Bulk mode only: number of identities per request, and maximum delay before a partial batch is sent.
+        "BULK_BATCH_SIZE": 200,
+        "BULK_FLUSH_INTERVAL": timedelta(seconds=5),
+    },
+    # Overrides of DEFAULT_POLICY, e.g. `{"portail": {"READ_TIMEOUT": 30}}`.
+    "AUDIENCE_POLICIES": {},
+}
+
+# CSV import of users, by the admin or `manage.py import_users`.
+USER_IMPORT_SETTINGS = {
+    # Number of rows read, validated and inserted at once.
+    "CHUNK_SIZE": 1000,
+    # Number of processes hashing the initial passwords. None uses one process per core.
+    "HASH_WORKERS": env.int("USER_IMPORT_HASH_WORKERS", default=None),
+}
+
+# Cache of the audiences granted to each user, checked on every login.
+AUDIENCE_GRANT_CACHE_SETTINGS = {
+    # Number of users kept in the in-process LRU cache.
+    "MAX_SIZE": 10000,
+    # The in-process cache is only invalidated in the process which changed the grants: this bounds how long
+    # another process may serve a revoked grant.
+    "LOCAL_TIMEOUT": timedelta(seconds=10),
+    # Alias of a Django cache shared by the processes, e.g. Redis or Memcached. None disables the shared cache.
+    "CACHE_ALIAS": env.str("AUDIENCE_GRANT_CACHE_ALIAS", default=None),
+    "TIMEOUT": timedelta(minutes=5),
+}
+
+# Admission control of the password hashes of `login/`, per process, see `sso_server.admission`.
+LOGIN_ADMISSION_SETTINGS = {
+    "MAX_CONCURRENT": env.int("LOGIN_MAX_CONCURRENT_HASHES", default=2),
+    # Number of logins waiting for a slot, and how long they wait before being rejected.
+    "MAX_QUEUE": 8,
+    "QUEUE_TIMEOUT": timedelta(seconds=1),
+    # Value of the `Retry-After` header of the rejections.
+    "RETRY_AFTER": timedelta(seconds=5),
+}
+
+# Rate limits of `login/` and `password/recover/request/`, see `sso_server.ratelimit`.
+RATE_LIMIT_SETTINGS = {
+    "ENABLED": env.bool("RATE_LIMIT_ENABLED", default=True),
+    # Alias of a Django cache shared by the processes, e.g. Redis or Memcached. None keeps the counters in each
+    # process, in an LRU cache of MAX_SIZE counters.
+    "CACHE_ALIAS": env.str("RATE_LIMIT_CACHE_ALIAS", default=None),
+    "MAX_SIZE": 100000,
+    # Behind a reverse proxy, the `request.META` key of the header holding the client IP, e.g. "HTTP_X_FORWARDED_FOR".
+    # None uses REMOTE_ADDR.
+    "CLIENT_IP_HEADER": env.str("RATE_LIMIT_CLIENT_IP_HEADER", default=None),
+    # Number of trusted reverse proxies in front of the SSO. The client IP is the entry of CLIENT_IP_HEADER appended
+    # by the farthest of them, i.e. the NUM_PROXIES-th from the right: the entries on its left are set by the client.
+    "NUM_PROXIES": env.int("RATE_LIMIT_NUM_PROXIES", default=1),
+    # Maximum number of requests per PERIOD, per client IP and per account (username or email).
+    "LIMITS": {
+        "login": {
+            "ip": {"LIMIT": 30, "PERIOD": timedelta(minutes=1)},
+            "account": {"LIMIT": 10, "PERIOD": timedelta(minutes=15)},
+        },
+        "password_recovery": {
+            "ip": {"LIMIT": 10, "PERIOD": timedelta(hours=1)},
+            "account": {"LIMIT": 3, "PERIOD": timedelta(hours=1)},
+        },
+    },
+}
+
+# SSO session, set as a cookie of the SSO domain at login. `session/token/` then issues tokens to the other audiences
+# without asking for the password again.
+SSO_SESSION_SETTINGS = {
+    "ENABLED": env.bool("SSO_SESSION_ENABLED", default=False),
+    "LIFETIME": timedelta(hours=12),
+    # The cookie is signed with SECRET_KEY, and only readable by the SSO.
+    "COOKIE_NAME": "sso_session",
+    "COOKIE_DOMAIN": env.str("SSO_SESSION_COOKIE_DOMAIN", default=None),
+    "COOKIE_SECURE": env.bool("SSO_SESSION_COOKIE_SECURE", default=True),
+    "COOKIE_SAMESITE": "Lax",
+    # Whether `logout/` ends every SSO session of the user, and not only the one of the request.
+    "LOGOUT_ALL_SESSIONS": False,
+}
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
@@ -105,10 +206,59 @@ EMAIL = {
     "PASSWORD": env.str("EMAIL_PASSWORD"),
     "HOST": env.str("EMAIL_HOST"),
     "PORT": env.str("EMAIL_PORT"),
+    # Set EMAIL_USE_SSL=False to use a local debugging server.
+    "USE_SSL": env.bool("EMAIL_USE_SSL", default=True),
+    # Timeout of the SMTP connections, in seconds.
+    "TIMEOUT": 10,
+}
+
+# The emails are sent by `manage.py send_queued_emails`.
+EMAIL_QUEUE_SETTINGS = {
+    # An email is given up after this number of failed attempts.
+    "MAX_ATTEMPTS": 5,
+    # Delay before the first retry, doubled after each failure.
+    "RETRY_BACKOFF": timedelta(seconds=30),
+    "MAX_RETRY_BACKOFF": timedelta(hours=1),
+    # An email claimed by a worker which dies is sent again after this delay.
+    "CLAIM_LEASE": timedelta(minutes=5),
+    # Number of SMTP connections kept open by a worker, and number of emails sent concurrently.
+    "POOL_SIZE": 2,
+    # An idle connection is closed after this delay.
+    "CONNECTION_MAX_IDLE": timedelta(minutes=1),
 }
 
 FRONTEND_HOST = env.str("SSO_URL")
 
+# Invitations of the imported users, sent by the admin or `manage.py invite_users`, see `sso_server.invitations`.
+INVITATION_SETTINGS = {
+    # Number of invitations created and rendered at once.
+    "BATCH_SIZE": 200,
+    # Maximum number of emails sent per second, to stay within the limits of the SMTP server.
+    "RATE": 5,
+}
+
+# Password hashers
+# https://docs.djangoproject.com/en/2.2/topics/auth/passwords/
+
+# The defaults of Django, with the work factors below. The first hasher hashes the new passwords.
+PASSWORD_HASHERS = [
+    "sso_server.hashers.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    # Requires the `argon2-cffi` package.
+    "sso_server.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+]
+
+# Work factors of the password hashers, for the hash of a password to take about the target login latency on the
+# production machines: see `manage.py calibrate_hasher`.
+PASSWORD_HASHER_SETTINGS = {
+    "PBKDF2_ITERATIONS": env.int("PBKDF2_ITERATIONS", default=150000),
+    "ARGON2_TIME_COST": env.int("ARGON2_TIME_COST", default=2),
+    # In KiB.
+    "ARGON2_MEMORY_COST": env.int("ARGON2_MEMORY_COST", default=512),
+    "ARGON2_PARALLELISM": env.int("ARGON2_PARALLELISM", default=2),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -120,7 +270,8 @@ AUTH_PASSWORD_VALIDATORS = [
         "NAME": "django.contrib.auth.password_validation.MinimumLengthValidator",
         "OPTIONS": {"min_length": 12},
     },
-    {"NAME": "django.contrib.auth.password_validation.CommonPasswordValidator"},
+    # Reads the list of common passwords once per process.
+    {"NAME": "sso_server.password_validation.CommonPasswordValidator"},
     {"NAME": "django.contrib.auth.password_validation.NumericPasswordValidator"},
 ]
 
@@ -147,18 +298,40 @@ STATIC_URL = "/static/"
 # JWT authentication settings.
 
 JWT_AUTH_SETTINGS = {
-    # Algorithm.
-    # The keys can be generated by following the instructions at
-    # https://rietta.com/blog/openssl-generating-rsa-key-from-command/.
-    "ALGORITHM": "RS256",
+    # Algorithm: RS256, ES256 or EdDSA, see `sso_server.algorithms` and `manage.py benchmark_signing`.
+    # The RSA keys can be generated by following the instructions at
+    # https://rietta.com/blog/openssl-generating-rsa-key-from-command/. For ES256, use
+    # `openssl ecparam -name prime256v1 -genkey -noout | openssl pkcs8 -topk8 -nocrypt` and, for EdDSA,
+    # `openssl genpkey -algorithm ed25519`.
+    "ALGORITHM": env.str("JWT_ALGORITHM", default="RS256"),
     "PRIVATE_KEY": env.str("PRIVATE_KEY", multiline=True),
     "PUBLIC_KEY": env.str("PUBLIC_KEY", multiline=True),
-    # Life time.
-    "ACCESS_TOKEN_LIFETIME": timedelta(days=7),
+    # How long the audiences may cache the JSON Web Key Set published at `.well-known/jwks.json`.
+    "JWKS_MAX_AGE": timedelta(days=1),
+    # How often each process reads the key ring, see `manage.py signing_keys`. A retired key stops verifying the
+    # tokens, including the verifications cached below, within this delay.
+    "KEY_RING_REFRESH_INTERVAL": timedelta(seconds=30),
+    # Cache of the verified tokens, see `sso_server.verification`.
+    "VERIFICATION_CACHE_SIZE": 10000,
+    "VERIFICATION_CACHE_MAX_TTL": timedelta(minutes=5),
+    # Maximum number of tokens accepted by `verify/batch/`.
+    "VERIFY_BATCH_MAX_SIZE": 100,
+    # Life time. The access tokens are short-lived: the audiences renew them with the refresh tokens.
+    "ACCESS_TOKEN_LIFETIME": timedelta(minutes=15),
+    # The refresh tokens are exchanged at `token/refresh/` for new access tokens, without the password.
+    "REFRESH_TOKEN_LIFETIME": timedelta(days=30),
+    # The redirect URL of a login only carries a refresh code, a refresh token which the audience has to exchange at
+    # `token/refresh/` within this delay. A URL ends up in the browser history, the logs and the Referer headers.
+    "REFRESH_CODE_LIFETIME": timedelta(minutes=1),
+    # How often each process reads the new token revocations.
+    "REVOCATION_REFRESH_INTERVAL": timedelta(seconds=5),
+    # How often each process deletes the revocations of the expired tokens, at most.
+    "REVOCATION_PURGE_INTERVAL": timedelta(hours=1),
     # Claims.
     "ISSUER": "sso_server",
     "USER_ID_CLAIM_NAME": "user",
     # Redirect URLs. The allowed audiences are automatically generated from this dict.
     "REDIRECT_URLS": env.dict("REDIRECT_URLS"),
     "GET_PARAMETER": "access",
+    "REFRESH_CODE_GET_PARAMETER": "code",
 }
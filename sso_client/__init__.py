@@ -0,0 +1,13 @@
+"""
+Verification of the tokens of the SSO by the audiences, without a request to the SSO per token.
+
+    from sso_client import TokenVerifier
+
+    verifier = TokenVerifier("https://sso.mines-paristech.fr", audience="portail")
+    payload = verifier.verify(token)
+
+Django backends can use `sso_client.middleware.SSOTokenMiddleware` instead.
+"""
+
+from sso_client.jwks import JWKSCache, JWKSUnavailableError
+from sso_client.verifier import TokenVerifier
@@ -0,0 +1,88 @@
+"""
+Public keys of the JSON Web Key Set and EdDSA support for PyJWT.
+
+PyJWT 1.7 neither implements EdDSA nor parses EC and OKP JWKs: both are done here.
+"""
+
+import base64
+import json
+
+import jwt
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from cryptography.hazmat.primitives.serialization import (
+    load_pem_private_key,
+    load_pem_public_key,
+)
+from jwt.algorithms import Algorithm, RSAAlgorithm
+
+
+ED25519_KEY_TYPES = (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)
+
+
+class EdDSAAlgorithm(Algorithm):
+    """Sign and verify the tokens with Ed25519 keys (RFC 8037)."""
+
+    def prepare_key(self, key):
+        if isinstance(key, ED25519_KEY_TYPES):
+            return key
+
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        if not isinstance(key, bytes):
+            raise TypeError("Expecting a PEM-formatted key.")
+
+        try:
+            key = load_pem_public_key(key, backend=default_backend())
+        except ValueError:
+            key = load_pem_private_key(key, password=None, backend=default_backend())
+
+        if not isinstance(key, ED25519_KEY_TYPES):
+            raise jwt.InvalidKeyError("Expecting an Ed25519 key.")
+        return key
+
+    def sign(self, msg, key):
+        return key.sign(msg)
+
+    def verify(self, msg, key, sig):
+        if isinstance(key, ed25519.Ed25519PrivateKey):
+            key = key.public_key()
+
+        try:
+            key.verify(sig, msg)
+            return True
+        except InvalidSignature:
+            return False
+
+
+def register_algorithms():
+    try:
+        jwt.register_algorithm("EdDSA", EdDSAAlgorithm())
+    except ValueError:
+        # Already registered, e.g. by a version of PyJWT which implements it.
+        pass
+
+
+def _b64url_decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def load_jwk(jwk: dict):
+    """Return the public key object of an RSA, EC P-256 or Ed25519 JWK. Raise ValueError for another key."""
+
+    if jwk.get("kty") == "RSA":
+        return RSAAlgorithm.from_jwk(json.dumps(jwk))
+    if jwk.get("kty") == "EC" and jwk.get("crv") == "P-256":
+        return ec.EllipticCurvePublicNumbers(
+            int.from_bytes(_b64url_decode(jwk["x"]), "big"),
+            int.from_bytes(_b64url_decode(jwk["y"]), "big"),
+            ec.SECP256R1(),
+        ).public_key(default_backend())
+    if jwk.get("kty") == "OKP" and jwk.get("crv") == "Ed25519":
+        return ed25519.Ed25519PublicKey.from_public_bytes(_b64url_decode(jwk["x"]))
+
+    raise ValueError(f"Unsupported JWK {jwk.get('kty')} {jwk.get('crv', '')}.")
+
+
+register_algorithms()
@@ -0,0 +1,51 @@
+"""
+Compare the local verification of a token with a request to the `verify/` endpoint of the SSO.
+
+    python -m sso_client.benchmark http://localhost:8001 portail <token> --iterations 1000
+"""
+
+import argparse
+import time
+
+import requests
+
+from sso_client.verifier import TokenVerifier
+
+
+def measure(function, iterations: int) -> float:
+    """Return the number of calls per second."""
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return iterations / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sso_url")
+    parser.add_argument("audience")
+    parser.add_argument("token")
+    parser.add_argument("--iterations", type=int, default=1000)
+    options = parser.parse_args(argv)
+
+    verifier = TokenVerifier(options.sso_url, audience=options.audience)
+    # Fetch the keys before measuring.
+    verifier.verify(options.token)
+
+    session = requests.Session()
+    verify_url = options.sso_url.rstrip("/") + "/api/v1/verify/"
+
+    def verify_remotely():
+        session.post(verify_url, json={"token": options.token}).raise_for_status()
+
+    local = measure(lambda: verifier.verify(options.token), options.iterations)
+    remote = measure(verify_remotely, options.iterations)
+
+    print(f"{'Local verification':<22}{local:>10.0f}/s{1e6 / local:>10.0f} µs")
+    print(f"{'POST /api/v1/verify/':<22}{remote:>10.0f}/s{1e6 / remote:>10.0f} µs")
+    print(f"Local verification is {local / remote:.0f} times faster.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import threading
+import time
+
+import jwt
+import requests
+
+from sso_client.algorithms import load_jwk
+
+
+class JWKSUnavailableError(jwt.InvalidTokenError):
+    """The keys could not be fetched from the SSO, and none is cached."""
+
+
+class JWKSCache:
+    """
+    Cache of the public keys published by the SSO at `.well-known/jwks.json`, indexed by `kid`.
+
+    The keys are fetched on first use. Once they are older than `ttl` seconds, they are still used while a background
+    thread fetches them again, with the ETag of the previous response. A token signed by an unknown key causes a
+    synchronous fetch, at most once per `min_refresh_interval` seconds.
+
+    If the SSO cannot be reached, the cached keys are used. Without cached keys, `JWKSUnavailableError`, a
+    `jwt.InvalidTokenError`, is raised, and the fetch is attempted again after `min_refresh_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        ttl: float = 300,
+        timeout: float = 5,
+        min_refresh_interval: float = 10,
+        session: requests.Session = None,
+        clock=time.monotonic,
+    ):
+        self.url = url
+        self.ttl = ttl
+        self.timeout = timeout
+        self.min_refresh_interval = min_refresh_interval
+        self.session = session or requests.Session()
+        self.clock = clock
+
+        # kid -> (algorithm, public key).
+        self._keys = {}
+        # The kid of the key which verifies the tokens without a `kid` header.
+        self._default_kid = None
+        self._etag = None
+        self._fetched_at = None
+        self._last_attempt_at = None
+        self._lock = threading.Lock()
+        self._background_fetch = None
+
+    def fetch(self):
+        """Fetch the keys now. Raise `requests.RequestException` if they cannot be fetched."""
+
+        with self._lock:
+            self._last_attempt_at = self.clock()
+            headers = {"If-None-Match": self._etag} if self._etag else {}
+
+            response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+            if response.status_code != 304:
+                response.raise_for_status()
+
+                document = response.json()
+                keys = {}
+                for jwk in document["keys"]:
+                    try:
+                        keys[jwk["kid"]] = (jwk["alg"], load_jwk(jwk))
+                    except (KeyError, ValueError):
+                        # A key this client cannot use.
+                        continue
+
+                self._keys = keys
+                self._default_kid = document.get("default_kid")
+                self._etag = response.headers.get("ETag")
+
+            self._fetched_at = self.clock()
+
+    def _fetch_in_background(self):
+        try:
+            self.fetch()
+        except requests.RequestException:
+            # The cached keys are used until the next attempt.
+            pass
+
+    def _can_fetch_now(self) -> bool:
+        return (
+            self._last_attempt_at is None
+            or self.clock() - self._last_attempt_at >= self.min_refresh_interval
+        )
+
+    def refresh_if_stale(self):
+        if self._fetched_at is None:
+            if not self._can_fetch_now():
+                raise JWKSUnavailableError("The keys of the SSO cannot be fetched.")
+
+            try:
+                self.fetch()
+            except requests.RequestException as e:
+                raise JWKSUnavailableError(
+                    f"The keys of the SSO cannot be fetched: {e}"
+                ) from e
+            return
+
+        if self.clock() - self._fetched_at < self.ttl:
+            return
+
+        if self._background_fetch is None or not self._background_fetch.is_alive():
+            self._background_fetch = threading.Thread(
+                target=self._fetch_in_background, daemon=True
+            )
+            self._background_fetch.start()
+
+    def get_key(self, kid: str):
+        """Return `(algorithm, public key)` of the key identified by `kid`, or None if the SSO does not publish it."""
+
+        self.refresh_if_stale()
+
+        key = self._keys.get(kid)
+        if key is None and self._can_fetch_now():
+            # E.g. a key staged since the last fetch.
+            try:
+                self.fetch()
+            except requests.RequestException:
+                # The cached keys are used until the next attempt.
+                return None
+            key = self._keys.get(kid)
+
+        return key
+
+    def get_default_key(self):
+        """
+        Return the key named by the `default_kid` of the key set, which verifies the tokens without a `kid` header, or
+        None if the SSO does not publish it.
+        """
+
+        self.refresh_if_stale()
+        return self._keys.get(self._default_kid) if self._default_kid else None
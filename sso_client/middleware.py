@@ -0,0 +1,66 @@
+from functools import lru_cache
+
+import jwt
+from django.conf import settings
+
+from sso_client.verifier import TokenVerifier
+
+
+@lru_cache(maxsize=None)
+def get_verifier() -> TokenVerifier:
+    """Return the verifier configured by `settings.SSO_CLIENT`, built once per process."""
+
+    options = settings.SSO_CLIENT
+    return TokenVerifier(
+        options["SSO_URL"],
+        audience=options["AUDIENCE"],
+        issuer=options.get("ISSUER", "sso_server"),
+        ttl=options.get("JWKS_TTL", 300),
+    )
+
+
+class SSOTokenMiddleware:
+    """
+    Verify the token of the request, found in the `Authorization: Bearer` header or in the cookie
+    `SSO_CLIENT["COOKIE_NAME"]`, and set:
+
+        * `request.sso_claims` to its payload, or to None if there is no valid token;
+        * `request.sso_error` to the `jwt.InvalidTokenError` raised by an invalid token, or to None. It is a
+          `JWKSUnavailableError` if the keys of the SSO cannot be fetched and none is cached.
+
+    Settings:
+        SSO_CLIENT = {
+            "SSO_URL": "https://…",
+            "AUDIENCE": "portail",
+            "ISSUER": "sso_server",  (optional)
+            "JWKS_TTL": 300,  (optional, in seconds)
+            "COOKIE_NAME": "",  (optional)
+        }
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cookie_name = settings.SSO_CLIENT.get("COOKIE_NAME")
+
+    def get_token(self, request):
+        authorization = request.META.get("HTTP_AUTHORIZATION", "")
+        if authorization.startswith("Bearer "):
+            return authorization[len("Bearer ") :]
+
+        if self.cookie_name:
+            return request.COOKIES.get(self.cookie_name)
+
+        return None
+
+    def __call__(self, request):
+        request.sso_claims = None
+        request.sso_error = None
+
+        token = self.get_token(request)
+        if token:
+            try:
+                request.sso_claims = get_verifier().verify(token)
+            except jwt.InvalidTokenError as e:
+                request.sso_error = e
+
+        return self.get_response(request)
@@ -0,0 +1,50 @@
+import jwt
+
+from sso_client.jwks import JWKSCache
+
+
+class TokenVerifier:
+    """
+    Verify the tokens of the SSO locally: the signature, with the public keys published by the SSO, and the claims
+    `exp`, `iss` and `aud`, which are required.
+
+    The verification costs one signature verification, without any request to the SSO once the keys are cached. The
+    tokens revoked before their expiration are not detected: the audiences which need it use `verify/`.
+    """
+
+    def __init__(
+        self,
+        sso_url: str,
+        audience: str,
+        issuer: str = "sso_server",
+        leeway: float = 0,
+        jwks: JWKSCache = None,
+        **jwks_options,
+    ):
+        self.audience = audience
+        self.issuer = issuer
+        self.leeway = leeway
+        self.jwks = jwks or JWKSCache(
+            sso_url.rstrip("/") + "/api/v1/.well-known/jwks.json", **jwks_options
+        )
+
+    def verify(self, token: str) -> dict:
+        """Return the payload of the token. Raise a subclass of `jwt.InvalidTokenError` if it is not valid."""
+
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self.jwks.get_key(kid) if kid else self.jwks.get_default_key()
+        if key is None:
+            raise jwt.InvalidSignatureError("The token is not signed by a known key.")
+
+        # The algorithm is the one published with the key, not the one of the token header.
+        algorithm, public_key = key
+
+        return jwt.decode(
+            token,
+            key=public_key,
+            algorithms=[algorithm],
+            audience=self.audience,
+            issuer=self.issuer,
+            leeway=self.leeway,
+            options={"require_exp": True},
+        )
@@ -1,8 +1,26 @@
 from django.contrib import admin
 
+from sso_server.admin.identity_webhook_delivery import IdentityWebhookDeliveryAdmin
+from sso_server.admin.queued_email import QueuedEmailAdmin
+from sso_server.admin.refresh_token import RefreshTokenAdmin
+from sso_server.admin.sso_session import SSOSessionAdmin
 from sso_server.admin.user import UserAdmin
-from sso_server.models import Access, PasswordRecovery, User
+from sso_server.models import (
+    Access,
+    IdentityWebhookDelivery,
+    PasswordRecovery,
+    QueuedEmail,
+    RefreshToken,
+    SSOSession,
+    TokenRevocation,
+    User,
+)
 
 admin.site.register(User, UserAdmin)
 admin.site.register(Access)
+admin.site.register(IdentityWebhookDelivery, IdentityWebhookDeliveryAdmin)
 admin.site.register(PasswordRecovery)
+admin.site.register(QueuedEmail, QueuedEmailAdmin)
+admin.site.register(RefreshToken, RefreshTokenAdmin)
+admin.site.register(SSOSession, SSOSessionAdmin)
+admin.site.register(TokenRevocation)
@@ -0,0 +1,29 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from sso_server.models import IdentityWebhookDelivery
+
+
+class IdentityWebhookDeliveryAdmin(admin.ModelAdmin):
+    list_display = (
+        "user",
+        "audience",
+        "status",
+        "attempts",
+        "created_at",
+        "next_attempt_at",
+        "delivered_at",
+        "last_error",
+    )
+    list_filter = ("status", "audience")
+    search_fields = ("user__username",)
+    readonly_fields = ("created_at", "delivered_at", "last_error")
+    actions = ["retry_now"]
+
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=IdentityWebhookDelivery.DELIVERED).update(
+            status=IdentityWebhookDelivery.PENDING, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"{updated} deliveries will be sent again.")
+
+    retry_now.short_description = "Send again now"
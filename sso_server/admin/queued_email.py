@@ -0,0 +1,31 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from sso_server.models import QueuedEmail
+
+
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = (
+        "to",
+        "subject",
+        "status",
+        "attempts",
+        "created_at",
+        "next_attempt_at",
+        "sent_at",
+        "last_error",
+    )
+    list_filter = ("status",)
+    search_fields = ("to",)
+    # The text and the context may contain secrets, e.g. password recovery links.
+    exclude = ("text", "context")
+    readonly_fields = ("created_at", "sent_at", "last_error")
+    actions = ["retry_now"]
+
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=QueuedEmail.SENT).update(
+            status=QueuedEmail.PENDING, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"{updated} emails will be sent again.")
+
+    retry_now.short_description = "Send again now"
@@ -0,0 +1,27 @@
+from django.contrib import admin
+
+from sso_server.models import RefreshToken
+
+
+class RefreshTokenAdmin(admin.ModelAdmin):
+    list_display = (
+        "user",
+        "audience",
+        "family",
+        "created_at",
+        "expires_at",
+        "used_at",
+        "revoked",
+    )
+    list_filter = ("audience", "revoked")
+    search_fields = ("user__username",)
+    # The hash is useless to the administrators.
+    exclude = ("token_hash",)
+    readonly_fields = ("user", "audience", "family", "created_at", "used_at")
+    actions = ["revoke"]
+
+    def revoke(self, request, queryset):
+        updated = queryset.update(revoked=True)
+        self.message_user(request, f"{updated} refresh tokens revoked.")
+
+    revoke.short_description = "Revoke"
@@ -0,0 +1,19 @@
+from django.contrib import admin
+
+from sso_server.models import SSOSession
+
+
+class SSOSessionAdmin(admin.ModelAdmin):
+    list_display = ("user", "created_at", "expires_at", "revoked")
+    list_filter = ("revoked",)
+    search_fields = ("user__username",)
+    # The hash is useless to the administrators.
+    exclude = ("key_hash",)
+    readonly_fields = ("user", "created_at")
+    actions = ["revoke"]
+
+    def revoke(self, request, queryset):
+        updated = queryset.update(revoked=True)
+        self.message_user(request, f"{updated} SSO sessions revoked.")
+
+    revoke.short_description = "Revoke"
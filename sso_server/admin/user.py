@@ -1,13 +1,12 @@
-import ast
-import pandas as pd
 from django import forms, urls
 from django.contrib import admin, messages
-from django.http import HttpRequest
+from django.http import HttpRequest, HttpResponse
 from django.shortcuts import redirect, render
 from django.urls import path
 
-from sso_server.models import Access, User
-from django.db import transaction
+from sso_server.invitations import get_users_to_invite, queue_invitations
+from sso_server.models import Access
+from sso_server import user_import
 
 
 class AccessInline(admin.TabularInline):
@@ -25,6 +24,7 @@ class UserAdmin(admin.ModelAdmin):
     inlines = [
         AccessInline,
     ]
+    actions = ["invite"]
 
     def get_urls(self):
         urls = super().get_urls()
@@ -33,15 +33,49 @@ class UserAdmin(admin.ModelAdmin):
         ]
         return my_urls + urls
 
+    def invite(self, request, queryset):
+        # Only the active users without a password, e.g. imported, can be invited.
+        users = get_users_to_invite(resend=True).filter(pk__in=queryset.values("pk"))
+        # Sending them here would take too long for a large selection: they are sent by `send_queued_emails`.
+        count = queue_invitations(users)
+
+        self.message_user(
+            request,
+            f"{count} invitations queued. The other selected users have a password or are inactive.",
+            level=messages.SUCCESS,
+        )
+
+    invite.short_description = "Send an invitation to choose their password"
+
     def import_csv(self, request: HttpRequest):
         if request.method == "POST":
             csv_file = request.FILES["csv_file"]
 
             try:
-                df = pd.read_csv(csv_file, converters={"audience": ast.literal_eval})
-                self.insert_users(df)
+                validation_report = user_import.validate_csv(csv_file.file)
+
+                if not validation_report.is_valid:
+                    self.message_user(
+                        request,
+                        f"Nothing has been imported: {validation_report} See the downloaded report.",
+                        level=messages.ERROR,
+                    )
+                    response = HttpResponse(
+                        validation_report.to_csv(), content_type="text/csv"
+                    )
+                    response[
+                        "Content-Disposition"
+                    ] = f'attachment; filename="errors_{csv_file.name}"'
+                    return response
 
-                self.message_user(request, "Your csv file has been imported!")
+                csv_file.seek(0)
+                report = user_import.import_csv(csv_file.file)
+
+                self.message_user(
+                    request,
+                    f"Your csv file has been imported! {report}",
+                    level=messages.WARNING if report.failed else messages.SUCCESS,
+                )
                 return redirect(urls.reverse("admin:sso_server_user_changelist"))
             except Exception as e:
                 print(e)
@@ -55,27 +89,3 @@ class UserAdmin(admin.ModelAdmin):
         form = CsvImportForm()
         payload = {"form": form}
         return render(request, "admin/csv_form.html", payload)
-
-    def insert_users(self, df: pd.DataFrame):
-        with transaction.atomic():
-            User.objects.bulk_create(
-                User(**vals)
-                for vals in df.loc[:, df.columns != "audience"].to_dict("records")
-            )
-            # Bulk create does not trigger signals: https://docs.djangoproject.com/en/1.8/ref/models/querysets/#bulk-create
-            # TODO: use this method when a bulk post identity route will be created on the portal side
-            # Access.objects.bulk_create(
-            #     Access(
-            #         user=User.objects.get(username=user["username"]),
-            #         audience=audience,
-            #     )
-            #     for user in df.to_dict("records")
-            #     for audience in user["audience"]
-            # )
-            for user in df.to_dict("records"):
-                for audience in user["audience"]:
-                    access = Access(
-                        user=User.objects.get(username=user["username"]),
-                        audience=audience,
-                    )
-                    access.save()
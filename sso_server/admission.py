@@ -0,0 +1,88 @@
+"""
+Admission control of the password hashes.
+
+A password hash keeps a CPU busy for tens of milliseconds. Under a burst of logins, unbounded hashes would saturate
+the workers, and starve `verify/` and the other endpoints. Each process runs at most
+`LOGIN_ADMISSION_SETTINGS["MAX_CONCURRENT"]` hashes at once; up to `MAX_QUEUE` other logins wait at most
+`QUEUE_TIMEOUT` for their turn, and the next ones are rejected at once, without hashing, with a 503 response and a
+`Retry-After` header.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+class LoginOverloadedError(Exception):
+    def __init__(self, retry_after: int):
+        super(LoginOverloadedError, self).__init__("LOGIN_OVERLOADED")
+        self.retry_after = retry_after
+
+
+class LoginAdmissionControl:
+    SETTINGS: dict = settings.LOGIN_ADMISSION_SETTINGS
+
+    _condition = threading.Condition()
+    in_flight = 0
+    waiting = 0
+
+    admitted = 0
+    # Rejected because the queue was full, or after waiting for `QUEUE_TIMEOUT`.
+    rejected = 0
+    timed_out = 0
+
+    @classmethod
+    def _reject(cls):
+        raise LoginOverloadedError(int(cls.SETTINGS["RETRY_AFTER"].total_seconds()))
+
+    @classmethod
+    @contextmanager
+    def admit(cls):
+        """Wait for a slot to hash a password. Raise `LoginOverloadedError` if there is no slot soon enough."""
+
+        with cls._condition:
+            if cls.in_flight >= cls.SETTINGS["MAX_CONCURRENT"]:
+                if cls.waiting >= cls.SETTINGS["MAX_QUEUE"]:
+                    cls.rejected += 1
+                    cls._reject()
+
+                cls.waiting += 1
+                try:
+                    has_slot = cls._condition.wait_for(
+                        lambda: cls.in_flight < cls.SETTINGS["MAX_CONCURRENT"],
+                        timeout=cls.SETTINGS["QUEUE_TIMEOUT"].total_seconds(),
+                    )
+                finally:
+                    cls.waiting -= 1
+
+                if not has_slot:
+                    cls.timed_out += 1
+                    cls._reject()
+
+            cls.in_flight += 1
+            cls.admitted += 1
+
+        try:
+            yield
+        finally:
+            with cls._condition:
+                cls.in_flight -= 1
+                cls._condition.notify()
+
+    @classmethod
+    def clear(cls):
+        """Reset the statistics. The logins in progress are not affected."""
+
+        with cls._condition:
+            cls.admitted = cls.rejected = cls.timed_out = 0
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        return {
+            "in_flight": cls.in_flight,
+            "queue_depth": cls.waiting,
+            "admitted": cls.admitted,
+            "rejected": cls.rejected,
+            "timed_out": cls.timed_out,
+        }
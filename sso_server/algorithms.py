@@ -0,0 +1,58 @@
+"""
+Signing algorithms of the tokens, selected by `JWT_AUTH_SETTINGS["ALGORITHM"]`.
+
+    * RS256: RSA PKCS#1 v1.5 with SHA-256. Signing is slow, verifying is fast, the signatures are 256 bytes long.
+    * ES256: ECDSA on the P-256 curve with SHA-256. Signing is fast, the signatures are 64 bytes long.
+    * EdDSA: Ed25519 (RFC 8037). Signing is fast, the signatures are 64 bytes long.
+
+PyJWT 1.7 does not implement EdDSA: it is registered by `sso_client.algorithms`, shared with the audiences.
+"""
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+# Registers EdDSA.
+import sso_client.algorithms  # noqa: F401
+
+
+# Algorithm -> (private key class, public key class).
+KEY_TYPES = {
+    "RS256": (rsa.RSAPrivateKey, rsa.RSAPublicKey),
+    "ES256": (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey),
+    "EdDSA": (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey),
+}
+
+
+def check_key_pair(algorithm: str, private_key, public_key):
+    """Raise ValueError if the keys cannot be used with the algorithm."""
+
+    if algorithm not in KEY_TYPES:
+        raise ValueError(
+            f"Unsupported algorithm {algorithm}, expected one of {', '.join(KEY_TYPES)}."
+        )
+
+    private_key_type, public_key_type = KEY_TYPES[algorithm]
+    if not isinstance(private_key, private_key_type) or not isinstance(
+        public_key, public_key_type
+    ):
+        raise ValueError(
+            f"{algorithm} cannot be used with a {type(public_key).__name__}."
+        )
+
+    if algorithm == "ES256" and not isinstance(public_key.curve, ec.SECP256R1):
+        raise ValueError("ES256 requires a key on the P-256 curve.")
+
+
+def generate_private_key(algorithm: str):
+    """Return a new private key for the algorithm."""
+
+    if algorithm == "RS256":
+        return rsa.generate_private_key(
+            public_exponent=65537, key_size=2048, backend=default_backend()
+        )
+    if algorithm == "ES256":
+        return ec.generate_private_key(ec.SECP256R1(), backend=default_backend())
+    if algorithm == "EdDSA":
+        return ed25519.Ed25519PrivateKey.generate()
+
+    raise ValueError(f"Unsupported algorithm {algorithm}.")
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class SsoServerConfig(AppConfig):
     name = "sso_server"
+
+    def ready(self):
+        from sso_server.keys import load_keys
+
+        # Parse and check the JWT keys once, at startup.
+        load_keys()
@@ -0,0 +1,141 @@
+"""
+Cache of the audiences granted to each user, read on every login.
+
+The audiences of a user are cached in an in-process LRU cache and, if `AUDIENCE_GRANT_CACHE_SETTINGS["CACHE_ALIAS"]` is
+set, in a Django cache shared by the processes. The entries of a user are invalidated when one of their accesses is
+saved or deleted and when the user is saved, e.g. deactivated.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from sso_server.models import Access
+
+
+class AudienceGrantCache:
+    SETTINGS: dict = settings.AUDIENCE_GRANT_CACHE_SETTINGS
+
+    # user id -> (audiences, expiration time), the least recently used first.
+    _local: OrderedDict = OrderedDict()
+    _lock = threading.Lock()
+
+    hits = 0
+    shared_hits = 0
+    misses = 0
+
+    @classmethod
+    def get_shared_cache(cls):
+        alias = cls.SETTINGS["CACHE_ALIAS"]
+        return caches[alias] if alias else None
+
+    @staticmethod
+    def get_key(user_id) -> str:
+        return f"sso:audience_grants:{user_id}"
+
+    @classmethod
+    def get_local(cls, user_id):
+        with cls._lock:
+            entry = cls._local.get(user_id)
+            if entry is None:
+                return None
+
+            audiences, expires_at = entry
+            if expires_at <= time.monotonic():
+                del cls._local[user_id]
+                return None
+
+            cls._local.move_to_end(user_id)
+            return audiences
+
+    @classmethod
+    def set_local(cls, user_id, audiences):
+        expires_at = time.monotonic() + cls.SETTINGS["LOCAL_TIMEOUT"].total_seconds()
+
+        with cls._lock:
+            cls._local[user_id] = (audiences, expires_at)
+            cls._local.move_to_end(user_id)
+            while len(cls._local) > cls.SETTINGS["MAX_SIZE"]:
+                cls._local.popitem(last=False)
+
+    @classmethod
+    def load(cls, user) -> frozenset:
+        if not user.is_active:
+            return frozenset()
+
+        return frozenset(
+            Access.objects.filter(user_id=user.pk).values_list("audience", flat=True)
+        )
+
+    @classmethod
+    def get_audiences(cls, user) -> frozenset:
+        """Return the audiences the user is allowed to access. An inactive user has no access."""
+
+        audiences = cls.get_local(user.pk)
+        if audiences is not None:
+            cls.hits += 1
+            return audiences
+
+        shared_cache = cls.get_shared_cache()
+        if shared_cache is not None:
+            cached = shared_cache.get(cls.get_key(user.pk))
+            if cached is not None:
+                cls.shared_hits += 1
+                audiences = frozenset(cached)
+                cls.set_local(user.pk, audiences)
+                return audiences
+
+        cls.misses += 1
+        audiences = cls.load(user)
+        cls.set_local(user.pk, audiences)
+        if shared_cache is not None:
+            shared_cache.set(
+                cls.get_key(user.pk),
+                list(audiences),
+                cls.SETTINGS["TIMEOUT"].total_seconds(),
+            )
+
+        return audiences
+
+    @classmethod
+    def has_access(cls, user, audience) -> bool:
+        return audience in cls.get_audiences(user)
+
+    @classmethod
+    def _invalidate(cls, user_ids):
+        with cls._lock:
+            for user_id in user_ids:
+                cls._local.pop(user_id, None)
+
+        shared_cache = cls.get_shared_cache()
+        if shared_cache is not None:
+            shared_cache.delete_many([cls.get_key(user_id) for user_id in user_ids])
+
+    @classmethod
+    def invalidate(cls, *user_ids):
+        """
+        Forget the audiences of the users. The entries are dropped at once and again when the transaction is
+        committed, so that a login concurrent with the change cannot cache the grants of before the change.
+        """
+
+        user_ids = set(user_ids)
+        cls._invalidate(user_ids)
+        transaction.on_commit(lambda: cls._invalidate(user_ids))
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._local.clear()
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        return {
+            "size": len(cls._local),
+            "hits": cls.hits,
+            "shared_hits": cls.shared_hits,
+            "misses": cls.misses,
+        }
@@ -0,0 +1,19 @@
+"""
+Password hashers of Django, with the work factors of `PASSWORD_HASHER_SETTINGS`, see `manage.py calibrate_hasher`.
+
+When the work factors change, the hashes stored with the previous ones are updated at the next successful login, by
+`User.check_password`: the hashers tell Django that these hashes must be updated.
+"""
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    iterations = settings.PASSWORD_HASHER_SETTINGS["PBKDF2_ITERATIONS"]
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    time_cost = settings.PASSWORD_HASHER_SETTINGS["ARGON2_TIME_COST"]
+    memory_cost = settings.PASSWORD_HASHER_SETTINGS["ARGON2_MEMORY_COST"]
+    parallelism = settings.PASSWORD_HASHER_SETTINGS["ARGON2_PARALLELISM"]
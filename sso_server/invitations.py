@@ -0,0 +1,224 @@
+"""
+Invitations of the imported users, whose password is blank, to choose their password.
+
+An invitation is a `PasswordRecovery` which lasts `PasswordRecovery.INVITATION_LIFETIME`. The users are invited by
+batches of `INVITATION_SETTINGS["BATCH_SIZE"]`: the invitations of a batch are bulk created, and the email template is
+rendered once per batch, with placeholders replaced for each user. The emails are sent through a single SMTP
+connection, at most `INVITATION_SETTINGS["RATE"]` per second. The invitations whose email could not be sent are
+cancelled, so that the next run invites their users again.
+
+During an HTTP request, e.g. from the admin, the invitations are queued with `queue_invitations` instead, and sent by
+the `send_queued_emails` command.
+"""
+
+import json
+import smtplib
+import time
+from dataclasses import dataclass, field
+from html import escape
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from sso_server.mail import EmailSender, get_template_registry, open_smtp_connection
+from sso_server.models import PasswordRecovery, QueuedEmail, User
+
+# Replaced by the values of each user in the rendered template. They are not changed by the HTML escaping.
+NAME_PLACEHOLDER = "%%NAME%%"
+LINK_PLACEHOLDER = "%%LINK%%"
+
+
+@dataclass
+class InvitationReport:
+    sent: int = 0
+    # (email, error) of the invitations which could not be sent.
+    errors: list = field(default_factory=list)
+
+    @property
+    def failed(self) -> int:
+        return len(self.errors)
+
+    def __str__(self):
+        return f"{self.sent} invitations sent, {self.failed} failed."
+
+
+def get_users_to_invite(resend: bool = False):
+    """Return the active users without a password and, unless `resend`, without a valid invitation."""
+
+    users = User.objects.filter(is_active=True, password="")
+
+    if not resend:
+        # The password recoveries reference the users by email.
+        users = users.exclude(
+            email__in=PasswordRecovery.objects.filter(
+                is_invitation=True,
+                used=False,
+                created_at__gt=timezone.now() - PasswordRecovery.INVITATION_LIFETIME,
+            ).values("user_id")
+        )
+
+    return users
+
+
+def create_invitations(users) -> list:
+    """Create an invitation for each user, with a single insert. The previous password recoveries are cancelled."""
+
+    with transaction.atomic():
+        PasswordRecovery.objects.filter(user__in=users, used=False).update(used=True)
+
+        return PasswordRecovery.objects.bulk_create(
+            PasswordRecovery(user=user, is_invitation=True) for user in users
+        )
+
+
+def get_invitation_link(invitation) -> str:
+    return f"{settings.FRONTEND_HOST}/mot-de-passe/nouveau/{invitation.id}"
+
+
+def queue_invitations(users, batch_size: int = None) -> int:
+    """
+    Create an invitation for each user and queue its email, to be sent by the `send_queued_emails` command. Return the
+    number of queued invitations.
+    """
+
+    batch_size = batch_size or settings.INVITATION_SETTINGS["BATCH_SIZE"]
+    users = list(users)
+
+    for start in range(0, len(users), batch_size):
+        batch = users[start : start + batch_size]
+
+        with transaction.atomic():
+            invitations = create_invitations(batch)
+            QueuedEmail.objects.bulk_create(
+                QueuedEmail(
+                    sender_name="Rezal",
+                    to=user.email,
+                    subject="Bienvenue",
+                    text=get_invitation_link(invitation),
+                    template_name="invitation",
+                    context=json.dumps(
+                        {
+                            "name": f"{user.first_name} {user.last_name}",
+                            "link": get_invitation_link(invitation),
+                            "days": PasswordRecovery.INVITATION_LIFETIME.days,
+                        }
+                    ),
+                )
+                for user, invitation in zip(batch, invitations)
+            )
+
+    return len(users)
+
+
+class InvitationSender:
+    """
+    Invite users through one SMTP connection, opened by `connect`, `open_smtp_connection` by default. `sleep` and
+    `clock` are those of `time` by default, and can be replaced in the tests.
+    """
+
+    def __init__(
+        self,
+        rate: float = None,
+        batch_size: int = None,
+        connect=None,
+        sleep=None,
+        clock=None,
+    ):
+        self.rate = rate or settings.INVITATION_SETTINGS["RATE"]
+        self.batch_size = batch_size or settings.INVITATION_SETTINGS["BATCH_SIZE"]
+        self.connect = connect or open_smtp_connection
+        self.sleep = sleep or time.sleep
+        self.clock = clock or time.monotonic
+
+        self._smtp = None
+        self._next_send_at = None
+
+    def _throttle(self):
+        now = self.clock()
+        if self._next_send_at is not None and now < self._next_send_at:
+            self.sleep(self._next_send_at - now)
+            now = self._next_send_at
+        self._next_send_at = now + 1 / self.rate
+
+    def _send(self, **kwargs):
+        if self._smtp is None:
+            self._smtp = self.connect()
+
+        try:
+            EmailSender("Rezal", smtp=self._smtp).sendemail(**kwargs)
+        except smtplib.SMTPServerDisconnected:
+            # E.g. the server closed an idle connection: reconnect once.
+            self._smtp = self.connect()
+            EmailSender("Rezal", smtp=self._smtp).sendemail(**kwargs)
+
+    def send_batch(self, users, report: InvitationReport):
+        invitations = create_invitations(users)
+
+        text, html = get_template_registry().render(
+            "invitation",
+            name=NAME_PLACEHOLDER,
+            link=LINK_PLACEHOLDER,
+            days=PasswordRecovery.INVITATION_LIFETIME.days,
+        )
+
+        # The invitations whose email could not be sent.
+        failed = []
+
+        for user, invitation in zip(users, invitations):
+            name = f"{user.first_name} {user.last_name}"
+            link = get_invitation_link(invitation)
+
+            self._throttle()
+            try:
+                self._send(
+                    to=user.email,
+                    subject="Bienvenue",
+                    text=text.replace(NAME_PLACEHOLDER, name).replace(
+                        LINK_PLACEHOLDER, link
+                    ),
+                    html=html.replace(NAME_PLACEHOLDER, escape(name)).replace(
+                        LINK_PLACEHOLDER, escape(link)
+                    ),
+                )
+                report.sent += 1
+            except smtplib.SMTPRecipientsRefused as e:
+                # The user can still use the password recovery.
+                report.errors.append((user.email, f"{e.__class__.__name__}: {e}"))
+                failed.append(invitation.id)
+            except (smtplib.SMTPException, OSError) as e:
+                report.errors.append((user.email, f"{e.__class__.__name__}: {e}"))
+                failed.append(invitation.id)
+                # The connection may be broken: the next user gets a new one.
+                self.close()
+
+        if failed:
+            # Otherwise, the users would not be invited again until the invitations expire.
+            PasswordRecovery.objects.filter(id__in=failed).update(used=True)
+
+    def send(self, users, progress=None) -> InvitationReport:
+        """
+        Invite `users`, an iterable of `User`. `progress`, if provided, is called with the report so far after each
+        batch.
+        """
+
+        report = InvitationReport()
+        users = list(users)
+
+        try:
+            for start in range(0, len(users), self.batch_size):
+                self.send_batch(users[start : start + self.batch_size], report)
+                if progress is not None:
+                    progress(report)
+        finally:
+            self.close()
+
+        return report
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
@@ -0,0 +1,384 @@
+"""
+Key material used to sign and verify the JWTs.
+
+The PEM strings of `settings.JWT_AUTH_SETTINGS` are parsed once per process and the resulting key objects are reused
+for every signature and verification. They are RSA, ECDSA P-256 or Ed25519 keys, depending on the algorithm, see
+`sso_server.algorithms`. Other keys can be staged, promoted and retired in the `KeyRing` without downtime: each token
+names its key in its `kid` header. The public keys are also published as a JSON Web Key Set (RFC 7517), so that the
+audiences can verify the tokens locally.
+"""
+
+import base64
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import lru_cache
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.hazmat.primitives.serialization import (
+    Encoding,
+    NoEncryption,
+    PrivateFormat,
+    PublicFormat,
+    load_pem_private_key,
+    load_pem_public_key,
+)
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from sso_server.algorithms import check_key_pair, generate_private_key
+from sso_server.models import SigningKey
+from sso_server.verification import VerificationCache
+
+
+def _to_bytes(pem) -> bytes:
+    return pem.encode("utf-8") if isinstance(pem, str) else pem
+
+
+def _b64url_uint(value: int) -> str:
+    """Encode a positive integer as a base64url string without padding (RFC 7518, section 2)."""
+
+    length = max(1, (value.bit_length() + 7) // 8)
+    return _b64url(value.to_bytes(length, "big"))
+
+
+def _b64url(value: bytes) -> str:
+    return base64.urlsafe_b64encode(value).rstrip(b"=").decode()
+
+
+@lru_cache(maxsize=None)
+def get_private_key():
+    """Return the key object used to sign the tokens."""
+
+    try:
+        return load_pem_private_key(
+            _to_bytes(settings.JWT_AUTH_SETTINGS["PRIVATE_KEY"]),
+            password=None,
+            backend=default_backend(),
+        )
+    except (TypeError, ValueError) as e:
+        raise ImproperlyConfigured(f"PRIVATE_KEY cannot be loaded: {e}")
+
+
+@lru_cache(maxsize=None)
+def get_public_key():
+    """Return the key object used to verify the tokens."""
+
+    try:
+        return load_pem_public_key(
+            _to_bytes(settings.JWT_AUTH_SETTINGS["PUBLIC_KEY"]),
+            backend=default_backend(),
+        )
+    except (TypeError, ValueError) as e:
+        raise ImproperlyConfigured(f"PUBLIC_KEY cannot be loaded: {e}")
+
+
+def load_keys():
+    """
+    Parse the keys and check that they form a pair. Called when the application starts, so that a misconfigured key
+    is reported at startup and not on the first login.
+    """
+
+    private_key, public_key = get_private_key(), get_public_key()
+
+    try:
+        check_key_pair(settings.JWT_AUTH_SETTINGS["ALGORITHM"], private_key, public_key)
+    except ValueError as e:
+        raise ImproperlyConfigured(str(e))
+
+    if _public_bytes(private_key.public_key()) != _public_bytes(public_key):
+        raise ImproperlyConfigured("PRIVATE_KEY and PUBLIC_KEY do not match.")
+
+
+def _public_bytes(public_key) -> bytes:
+    return public_key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+
+
+def public_jwk(public_key, algorithm: str = None) -> dict:
+    """
+    Return the JWK representation of an RSA, ECDSA P-256 or Ed25519 public key. Its `kid` is the RFC 7638 thumbprint
+    of the key.
+    """
+
+    if isinstance(public_key, rsa.RSAPublicKey):
+        numbers = public_key.public_numbers()
+        jwk = {
+            "e": _b64url_uint(numbers.e),
+            "kty": "RSA",
+            "n": _b64url_uint(numbers.n),
+        }
+    elif isinstance(public_key, ec.EllipticCurvePublicKey):
+        numbers = public_key.public_numbers()
+        jwk = {
+            "crv": "P-256",
+            "kty": "EC",
+            # The coordinates have the length of the curve, 32 bytes.
+            "x": _b64url(numbers.x.to_bytes(32, "big")),
+            "y": _b64url(numbers.y.to_bytes(32, "big")),
+        }
+    elif isinstance(public_key, ed25519.Ed25519PublicKey):
+        jwk = {
+            "crv": "Ed25519",
+            "kty": "OKP",
+            "x": _b64url(public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)),
+        }
+    else:
+        raise ValueError(f"Unsupported key {type(public_key).__name__}.")
+
+    thumbprint = hashlib.sha256(
+        json.dumps(jwk, separators=(",", ":"), sort_keys=True).encode()
+    ).digest()
+    jwk["kid"] = _b64url(thumbprint)
+    jwk["use"] = "sig"
+    jwk["alg"] = algorithm or settings.JWT_AUTH_SETTINGS["ALGORITHM"]
+
+    return jwk
+
+
+@dataclass(frozen=True)
+class Key:
+    kid: str
+    algorithm: str
+    # None for the keys which do not sign anymore.
+    private_key: object
+    public_key: object
+    jwk: dict
+
+
+def load_pem_key_pair(algorithm: str, private_pem, public_pem=None):
+    """Return `(private key, public key)` parsed from PEM strings. Raise ValueError if they cannot be used together."""
+
+    private_key = load_pem_private_key(
+        _to_bytes(private_pem), password=None, backend=default_backend()
+    )
+    public_key = (
+        load_pem_public_key(_to_bytes(public_pem), backend=default_backend())
+        if public_pem
+        else private_key.public_key()
+    )
+
+    check_key_pair(algorithm, private_key, public_key)
+    if _public_bytes(private_key.public_key()) != _public_bytes(public_key):
+        raise ValueError("The private key and the public key do not match.")
+
+    return private_key, public_key
+
+
+class KeyRing:
+    """
+    The keys used to sign and verify the tokens, parsed once and indexed by `kid`.
+
+    The key configured by `PRIVATE_KEY` and `PUBLIC_KEY` is always part of the ring: it signs the tokens until a key
+    of the database is promoted, and it verifies the tokens issued without a `kid` header. The keys of the database,
+    managed by `manage.py signing_keys`, are read again every `JWT_AUTH_SETTINGS["KEY_RING_REFRESH_INTERVAL"]`, or
+    when a token is signed by an unknown key.
+    """
+
+    REFRESH_INTERVAL: timedelta = settings.JWT_AUTH_SETTINGS[
+        "KEY_RING_REFRESH_INTERVAL"
+    ]
+    # Minimum delay between two refreshes caused by unknown keys, which anyone can forge.
+    UNKNOWN_KID_REFRESH_INTERVAL = timedelta(seconds=1)
+
+    _keys: dict = {}
+    _signing_key: Key = None
+    _default_key: Key = None
+    _jwks: dict = None
+    _jwks_etag: str = None
+
+    _lock = threading.Lock()
+    _next_refresh = 0.0
+    _next_unknown_kid_refresh = 0.0
+
+    @classmethod
+    def get_default_key(cls) -> Key:
+        if cls._default_key is None:
+            algorithm = settings.JWT_AUTH_SETTINGS["ALGORITHM"]
+            jwk = public_jwk(get_public_key(), algorithm)
+            cls._default_key = Key(
+                jwk["kid"], algorithm, get_private_key(), get_public_key(), jwk
+            )
+        return cls._default_key
+
+    @classmethod
+    def load(cls):
+        default_key = cls.get_default_key()
+        keys = {default_key.kid: default_key}
+        signing_key = default_key
+
+        for signing_key_model in SigningKey.objects.exclude(
+            status=SigningKey.RETIRED
+        ).order_by("created_at"):
+            private_key, public_key = load_pem_key_pair(
+                signing_key_model.algorithm,
+                signing_key_model.private_key,
+                signing_key_model.public_key,
+            )
+            is_active = signing_key_model.status == SigningKey.ACTIVE
+            key = Key(
+                signing_key_model.kid,
+                signing_key_model.algorithm,
+                private_key if is_active else None,
+                public_key,
+                public_jwk(public_key, signing_key_model.algorithm),
+            )
+
+            keys[key.kid] = key
+            if is_active:
+                signing_key = key
+
+        # Publish the signing key first. The tokens without a `kid` header are verified with the configured key,
+        # named by `default_kid`, an additional member of the set (RFC 7517, section 5).
+        jwks = {
+            "keys": [signing_key.jwk]
+            + [key.jwk for key in keys.values() if key is not signing_key],
+            "default_kid": default_key.kid,
+        }
+        document = json.dumps(jwks, separators=(",", ":"), sort_keys=True)
+
+        # The tokens verified with a key retired since the last load are not valid anymore, in every process.
+        removed_kids = cls._keys.keys() - keys.keys()
+        if removed_kids:
+            VerificationCache.forget_keys(removed_kids)
+
+        cls._keys, cls._signing_key = keys, signing_key
+        cls._jwks = jwks
+        cls._jwks_etag = '"' + hashlib.sha256(document.encode()).hexdigest() + '"'
+
+    @classmethod
+    def refresh(cls, force: bool = False):
+        if not force and time.monotonic() < cls._next_refresh:
+            return
+
+        with cls._lock:
+            if not force and time.monotonic() < cls._next_refresh:
+                return
+
+            cls.load()
+            cls._next_refresh = time.monotonic() + cls.REFRESH_INTERVAL.total_seconds()
+
+    @classmethod
+    def get_signing_key(cls) -> Key:
+        cls.refresh()
+        return cls._signing_key
+
+    @classmethod
+    def get_verification_key(cls, kid: str = None):
+        """Return the key identified by `kid`, or None if it is unknown or retired. Tokens without a `kid` are verified
+        with the configured key."""
+
+        cls.refresh()
+        if kid is None:
+            return cls.get_default_key()
+
+        key = cls._keys.get(kid)
+        if key is None and time.monotonic() >= cls._next_unknown_kid_refresh:
+            # E.g. a key promoted by another process since the last refresh.
+            cls._next_unknown_kid_refresh = (
+                time.monotonic() + cls.UNKNOWN_KID_REFRESH_INTERVAL.total_seconds()
+            )
+            cls.refresh(force=True)
+            key = cls._keys.get(kid)
+
+        return key
+
+    @classmethod
+    def get_jwks(cls) -> dict:
+        cls.refresh()
+        return cls._jwks
+
+    @classmethod
+    def get_jwks_etag(cls) -> str:
+        cls.refresh()
+        return cls._jwks_etag
+
+    @classmethod
+    def clear(cls):
+        """Forget the keys: they are read again by the next signature or verification."""
+
+        with cls._lock:
+            cls._default_key = None
+            cls._next_refresh = 0.0
+            cls._next_unknown_kid_refresh = 0.0
+
+    @classmethod
+    @transaction.atomic
+    def stage(cls, algorithm: str, private_pem: str = None) -> SigningKey:
+        """Add a key to the ring, published but not used to sign yet. A new key is generated if none is provided."""
+
+        if private_pem is None:
+            private_pem = (
+                generate_private_key(algorithm)
+                .private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+                .decode()
+            )
+        _, public_key = load_pem_key_pair(algorithm, private_pem)
+
+        signing_key = SigningKey.objects.create(
+            kid=public_jwk(public_key, algorithm)["kid"],
+            algorithm=algorithm,
+            private_key=private_pem,
+            public_key=public_key.public_bytes(
+                Encoding.PEM, PublicFormat.SubjectPublicKeyInfo
+            ).decode(),
+        )
+        cls.refresh(force=True)
+
+        return signing_key
+
+    @classmethod
+    @transaction.atomic
+    def promote(cls, kid: str) -> SigningKey:
+        """Sign the new tokens with a staged key. The previous active key only verifies the tokens from now on."""
+
+        signing_key = SigningKey.objects.select_for_update().get(kid=kid)
+        if signing_key.status != SigningKey.STAGED:
+            raise ValueError(f"The key {kid} is {signing_key.status}, not staged.")
+
+        now = timezone.now()
+        SigningKey.objects.filter(status=SigningKey.ACTIVE).update(
+            status=SigningKey.RETIRING, retiring_at=now
+        )
+        signing_key.status = SigningKey.ACTIVE
+        signing_key.promoted_at = now
+        signing_key.save(update_fields=("status", "promoted_at"))
+        cls.refresh(force=True)
+
+        return signing_key
+
+    @classmethod
+    @transaction.atomic
+    def retire(cls, kid: str) -> SigningKey:
+        """Stop verifying the tokens signed by a retiring or staged key and remove it from the JSON Web Key Set."""
+
+        signing_key = SigningKey.objects.select_for_update().get(kid=kid)
+        if signing_key.status not in (SigningKey.STAGED, SigningKey.RETIRING):
+            raise ValueError(
+                f"The key {kid} is {signing_key.status}, only a staged or retiring key can be retired."
+            )
+
+        signing_key.status = SigningKey.RETIRED
+        signing_key.retired_at = timezone.now()
+        signing_key.save(update_fields=("status", "retired_at"))
+        # Forget the tokens verified with the key now in this process, within `KEY_RING_REFRESH_INTERVAL` in the others.
+        cls.refresh(force=True)
+
+        return signing_key
+
+
+def get_jwks() -> dict:
+    """Return the JSON Web Key Set published to the audiences."""
+
+    return KeyRing.get_jwks()
+
+
+def get_jwks_etag() -> str:
+    """Return a strong ETag of the JSON Web Key Set, which only changes when the keys change."""
+
+    return KeyRing.get_jwks_etag()
@@ -1,24 +1,172 @@
+import json
+import os
 import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-from jinja2 import Template
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    select_autoescape,
+)
 
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from sso_server.models import QueuedEmail
+
+
+def open_smtp_connection(account=settings.EMAIL["ADDRESS"]):
+    """Return a new SMTP connection, logged in if a password is configured."""
+
+    if settings.EMAIL["USE_SSL"]:
+        smtp = smtplib.SMTP_SSL(
+            settings.EMAIL["HOST"],
+            settings.EMAIL["PORT"],
+            timeout=settings.EMAIL["TIMEOUT"],
+        )
+    else:
+        # E.g. a local debugging server: `python -m smtpd -n -c DebuggingServer localhost:1025`.
+        smtp = smtplib.SMTP(
+            settings.EMAIL["HOST"],
+            settings.EMAIL["PORT"],
+            timeout=settings.EMAIL["TIMEOUT"],
+        )
+
+    smtp.ehlo()
+    if settings.EMAIL["PASSWORD"]:
+        smtp.login(account, settings.EMAIL["PASSWORD"])
+
+    return smtp
+
+
+class SMTPConnectionPool:
+    """
+    Keep up to `size` SMTP connections open, so that the TLS handshake and the login are not paid for every email.
+
+    A connection is checked with a NOOP before being reused, and closed if it has been idle for more than `max_idle`
+    seconds. A connection on which an error happened is closed.
+    """
+
+    def __init__(self, size: int, max_idle: float, connect=None):
+        self.max_idle = max_idle
+        self.connect = connect or open_smtp_connection
+
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []  # (connection, time at which it was released)
+
+    @staticmethod
+    def _quit(smtp):
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+    @staticmethod
+    def _is_healthy(smtp) -> bool:
+        try:
+            return smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _acquire(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                smtp, released_at = self._idle.pop()
+
+            if time.monotonic() - released_at <= self.max_idle and self._is_healthy(
+                smtp
+            ):
+                return smtp
+            self._quit(smtp)
+
+        return self.connect()
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            smtp = self._acquire()
+            try:
+                yield smtp
+            except BaseException:
+                # The connection may be broken, or in the middle of a transaction.
+                self._quit(smtp)
+                raise
+            else:
+                with self._lock:
+                    self._idle.append((smtp, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for smtp, _ in idle:
+            self._quit(smtp)
+
+
+class EmailTemplateRegistry:
+    """
+    Load and compile the templates of `sso_server/email_template` once. Rendering a template does not touch the disk.
+
+    An email template `name` is made of `name.html` and, optionally, of its plain text alternative `name.txt`.
+    """
+
+    DIRECTORY = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "email_template"
+    )
+
+    def __init__(self, directory=DIRECTORY):
+        self.environment = Environment(
+            loader=FileSystemLoader(directory),
+            autoescape=select_autoescape(["html"]),
+            auto_reload=False,
+            bytecode_cache=FileSystemBytecodeCache(),
+        )
+        self.templates = {
+            name: self.environment.get_template(name)
+            for name in self.environment.list_templates(extensions=("html", "txt"))
+        }
+
+    def render(self, template_name, **kwargs) -> tuple:
+        """Return the plain text, or None if there is no plain text template, and the HTML of an email."""
+
+        html = self.templates[f"{template_name}.html"].render(**kwargs)
+        text_template = self.templates.get(f"{template_name}.txt")
+
+        return text_template.render(**kwargs) if text_template else None, html
+
+
+@lru_cache(maxsize=None)
+def get_template_registry() -> EmailTemplateRegistry:
+    """Return the registry of the email templates, compiled on first use."""
+
+    return EmailTemplateRegistry()
 
 
 class EmailSender:
-    def __init__(self, name, account=settings.EMAIL["ADDRESS"]):
-        self.smtp = None
+    def __init__(self, name, account=settings.EMAIL["ADDRESS"], smtp=None):
+        """`smtp` is an open connection, e.g. from an `SMTPConnectionPool`. Otherwise, call `connect`."""
+
+        self.smtp = smtp
         self.account = account
         self.name = name
 
     def connect(self):
-        self.smtp = smtplib.SMTP_SSL(settings.EMAIL["HOST"], settings.EMAIL["PORT"])
-        self.smtp.ehlo()
-        pw = settings.EMAIL["PASSWORD"]
-        self.smtp.login(self.account, pw)
+        self.smtp = open_smtp_connection(self.account)
 
     def sendemail(
         self,
@@ -29,10 +177,15 @@ class EmailSender:
         bcc=None,
         attachment=None,
         attachments=None,
-        template=False,
-        template_file_path=None,
+        template_name=None,
+        html=None,
         **kwargs,
     ):
+        """
+        Send an email whose HTML content is rendered from `template_name` with `kwargs`, or is `html`, already
+        rendered, with `text` as plain text alternative, or else is `text`.
+        """
+
         msg = MIMEMultipart("alternative")
         msg["Subject"] = f"[Rezal] {subject}"
         msg["From"] = f"{self.name} <{self.account}>"
@@ -45,10 +198,15 @@ class EmailSender:
             msg["Bcc"] = bcc
             destinations += [email.strip() for email in bcc.split(",")]
 
-        if template and template_file_path:
-            with open(template_file_path) as template_file:
-                template = Template(template_file.read())
-            content = template.render(**kwargs)
+        if template_name:
+            plain_text, content = get_template_registry().render(
+                template_name, **kwargs
+            )
+            # The last alternative is the preferred one.
+            msg.attach(MIMEText(plain_text or text, "plain"))
+        elif html is not None:
+            msg.attach(MIMEText(text, "plain"))
+            content = html
         else:
             content = text
 
@@ -66,21 +224,164 @@ class EmailSender:
             self.smtp.sendmail(self.account, destinations, msg.as_string())
 
     def send_password_recovery_link(self, user_address, name, password_recovery_id):
-        link = settings.FRONTEND_HOST + "/mot-de-passe/nouveau/" + password_recovery_id
-        text = "Cliquez sur ce lien pour reéinitialiser votre mot de passe : " + link
         self.sendemail(
-            to=user_address,
-            subject="Nouveau mot de passe",
-            text=text,
-            cc=None,
-            bcc=None,
-            attachment=None,
-            attachments=None,
-            template=True,
-            template_file_path="sso_server/email_template/password_recovery_email_template.html.html",
-            name=name,
-            link=link,
+            **get_password_recovery_email(user_address, name, password_recovery_id)
         )
 
     def close(self):
         self.smtp.quit()
+
+
+def get_password_recovery_email(user_address, name, password_recovery_id) -> dict:
+    """Return the arguments of `EmailSender.sendemail` for a password recovery email."""
+
+    link = settings.FRONTEND_HOST + "/mot-de-passe/nouveau/" + password_recovery_id
+    text = "Cliquez sur ce lien pour reéinitialiser votre mot de passe : " + link
+
+    return dict(
+        to=user_address,
+        subject="Nouveau mot de passe",
+        text=text,
+        template_name="password_recovery",
+        name=name,
+        link=link,
+    )
+
+
+class EmailQueue:
+    """
+    The emails are not sent during the HTTP requests: a `QueuedEmail` is written, and the `send_queued_emails`
+    command sends it later through an `SMTPConnectionPool`, retrying with an exponential backoff.
+    """
+
+    SETTINGS: dict = settings.EMAIL_QUEUE_SETTINGS
+
+    @classmethod
+    def enqueue(
+        cls,
+        sender_name,
+        to,
+        subject,
+        text,
+        template_name=None,
+        **kwargs,
+    ) -> QueuedEmail:
+        """Queue an email. The arguments are those of `EmailSender.sendemail`, without the attachments."""
+
+        return QueuedEmail.objects.create(
+            sender_name=sender_name,
+            to=to,
+            subject=subject,
+            text=text,
+            template_name=template_name or "",
+            context=json.dumps(kwargs),
+        )
+
+    @classmethod
+    def claim(cls, limit) -> list:
+        """
+        Return up to `limit` emails which are due. They are leased to the caller for `CLAIM_LEASE`: if the caller
+        dies before recording the outcome, they will be claimed again afterwards.
+        """
+
+        now = timezone.now()
+
+        with transaction.atomic():
+            emails = list(
+                QueuedEmail.objects.select_for_update(skip_locked=True)
+                .filter(status=QueuedEmail.PENDING, next_attempt_at__lte=now)
+                .order_by("next_attempt_at")[:limit]
+            )
+            QueuedEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+                next_attempt_at=now + cls.SETTINGS["CLAIM_LEASE"]
+            )
+
+        return emails
+
+    @classmethod
+    def get_retry_delay(cls, attempts):
+        return min(
+            cls.SETTINGS["RETRY_BACKOFF"] * 2 ** (attempts - 1),
+            cls.SETTINGS["MAX_RETRY_BACKOFF"],
+        )
+
+    @classmethod
+    def record_success(cls, email):
+        email.attempts += 1
+        email.status = QueuedEmail.SENT
+        email.sent_at = timezone.now()
+        email.last_error = ""
+        email.save(update_fields=("attempts", "status", "sent_at", "last_error"))
+
+    @classmethod
+    def record_failure(cls, email, error: str):
+        email.attempts += 1
+        email.last_error = error
+
+        if email.attempts >= cls.SETTINGS["MAX_ATTEMPTS"]:
+            email.status = QueuedEmail.FAILED
+        else:
+            email.next_attempt_at = timezone.now() + cls.get_retry_delay(email.attempts)
+
+        email.save(
+            update_fields=("attempts", "status", "next_attempt_at", "last_error")
+        )
+
+    @classmethod
+    def send(cls, pool: SMTPConnectionPool, email):
+        """Send a queued email and return the error, or None if it succeeded. Does not touch the database."""
+
+        try:
+            with pool.connection() as smtp:
+                EmailSender(email.sender_name, smtp=smtp).sendemail(
+                    to=email.to,
+                    subject=email.subject,
+                    text=email.text,
+                    template_name=email.template_name or None,
+                    **json.loads(email.context),
+                )
+            return None
+        except Exception as e:
+            return f"{e.__class__.__name__}: {e}"
+
+
+class EmailWorker:
+    """
+    Drain the email queue with `POOL_SIZE` threads sharing an `SMTPConnectionPool`. The threads only talk to the SMTP
+    server; the database is only used by the calling thread.
+    """
+
+    def __init__(self, batch_size=100):
+        self.batch_size = batch_size
+        self.pool = SMTPConnectionPool(
+            size=EmailQueue.SETTINGS["POOL_SIZE"],
+            max_idle=EmailQueue.SETTINGS["CONNECTION_MAX_IDLE"].total_seconds(),
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=EmailQueue.SETTINGS["POOL_SIZE"], thread_name_prefix="email"
+        )
+
+    def run_once(self) -> dict:
+        """Send up to `batch_size` due emails. Return the number of emails which were sent and which failed."""
+
+        futures = [
+            (email, self.executor.submit(EmailQueue.send, self.pool, email))
+            for email in EmailQueue.claim(self.batch_size)
+        ]
+
+        counts = {"sent": 0, "failed": 0}
+        for email, future in futures:
+            error = future.result()
+
+            if error is None:
+                EmailQueue.record_success(email)
+                counts["sent"] += 1
+            else:
+                EmailQueue.record_failure(email, error)
+                counts["failed"] += 1
+
+        return counts
+
+    def shutdown(self):
+        self.executor.shutdown()
+        self.pool.close()
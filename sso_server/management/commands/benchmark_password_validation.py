@@ -0,0 +1,79 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import password_validation
+from django.core.management.base import BaseCommand
+from rest_framework import serializers
+
+from sso_server.models import User
+from sso_server.serializers import RecoverPasswordSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the throughput of the validation of a new password at password reset, with the validators shared "
+        "by the process and with validators built for each password as Django does, on this machine."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            # Django's validators take milliseconds to build.
+            default=100,
+            help="Number of passwords validated per measure.",
+        )
+        parser.add_argument(
+            "--password",
+            default="unpeuplusdedouzecaracteres",
+            help="Password validated. Default: a valid one, which goes through every validator.",
+        )
+
+    @staticmethod
+    def measure(validate, iterations):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            validate()
+        return iterations / (time.perf_counter() - start)
+
+    def handle(self, *args, **options):
+        iterations, password = options["iterations"], options["password"]
+        user = User(
+            username="17admin",
+            first_name="Admin",
+            last_name="Piche",
+            email="17admin@mpt.fr",
+        )
+        serializer = RecoverPasswordSerializer()
+        serializer._user = user
+
+        def validate_shared():
+            try:
+                serializer.validate_password(password)
+            except serializers.ValidationError:
+                pass
+
+        def validate_rebuilt():
+            # Django's own `CommonPasswordValidator` parses its list each time it is built.
+            validators = password_validation.get_password_validators(
+                [
+                    {
+                        "NAME": "django.contrib.auth.password_validation.CommonPasswordValidator"
+                    }
+                    if "CommonPasswordValidator" in validator["NAME"]
+                    else validator
+                    for validator in settings.AUTH_PASSWORD_VALIDATORS
+                ]
+            )
+            try:
+                password_validation.validate_password(password, user, validators)
+            except password_validation.ValidationError:
+                pass
+
+        self.stdout.write(f"{'Validators':<12}{'Validations/s':>16}")
+        for name, validate in (
+            ("shared", validate_shared),
+            ("rebuilt", validate_rebuilt),
+        ):
+            validations = self.measure(validate, iterations)
+            self.stdout.write(f"{name:<12}{validations:>16.0f}")
@@ -0,0 +1,68 @@
+import time
+
+import jwt
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from sso_server.algorithms import KEY_TYPES, generate_private_key
+from sso_server.token import create_token
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the signature and verification throughputs and the token sizes of the signing algorithms, "
+        "with new keys, on this machine."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=1000,
+            help="Number of tokens signed and verified per algorithm.",
+        )
+        parser.add_argument(
+            "--algorithm",
+            action="append",
+            choices=sorted(KEY_TYPES),
+            help="Algorithm to benchmark, can be repeated. Default: all of them.",
+        )
+
+    def benchmark(self, algorithm, iterations):
+        private_key = generate_private_key(algorithm)
+        public_key = private_key.public_key()
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            token = create_token(
+                audience="portail",
+                username="17admin",
+                key=private_key,
+                algorithm=algorithm,
+            )
+        sign_duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            jwt.decode(
+                token,
+                key=public_key,
+                algorithms=[algorithm],
+                audience="portail",
+                issuer=settings.JWT_AUTH_SETTINGS["ISSUER"],
+            )
+        verify_duration = time.perf_counter() - start
+
+        return iterations / sign_duration, iterations / verify_duration, len(token)
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+
+        self.stdout.write(
+            f"{'Algorithm':<10}{'Signatures/s':>15}{'Verifications/s':>18}{'Token size':>13}"
+        )
+        for algorithm in options["algorithm"] or sorted(KEY_TYPES):
+            signatures, verifications, size = self.benchmark(algorithm, iterations)
+            self.stdout.write(
+                f"{algorithm:<10}{signatures:>15.0f}{verifications:>18.0f}{size:>13}"
+            )
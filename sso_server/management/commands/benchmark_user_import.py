@@ -0,0 +1,78 @@
+import os
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from sso_server.user_import import PasswordHasherPool, import_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the throughput of the import of users with initial passwords, for each number of processes hashing "
+        "the passwords, on this machine. The imported users are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=1000,
+            help="Number of users imported per measure. Default: 1000.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            action="append",
+            help="Number of processes, can be repeated. Default: 1, 2, 4... up to the number of cores.",
+        )
+
+    @staticmethod
+    def get_default_workers():
+        cores = os.cpu_count() or 1
+        workers = [1]
+        while workers[-1] * 2 < cores:
+            workers.append(workers[-1] * 2)
+        if workers[-1] != cores:
+            workers.append(cores)
+        return workers
+
+    @staticmethod
+    def make_rows(count):
+        prefix = uuid.uuid4().hex[:8]
+        return [
+            {
+                "username": f"{prefix}{i}",
+                "first_name": "Benchmark",
+                "last_name": "User",
+                "email": f"{prefix}{i}@benchmark.invalid",
+                "password": uuid.uuid4().hex,
+                "audience": [],
+            }
+            for i in range(count)
+        ]
+
+    def benchmark(self, rows, workers):
+        with PasswordHasherPool(workers) as hasher_pool:
+            # Start the processes before the measure.
+            hasher_pool.hash(["warm-up"] * workers)
+
+            with transaction.atomic():
+                start = time.perf_counter()
+                import_users(rows, hasher_pool=hasher_pool)
+                duration = time.perf_counter() - start
+                transaction.set_rollback(True)
+
+        return len(rows) / duration
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'Workers':<10}{'Users/s':>10}{'Speedup':>10}")
+
+        reference = None
+        for workers in options["workers"] or self.get_default_workers():
+            throughput = self.benchmark(self.make_rows(options["users"]), workers)
+            reference = reference or throughput
+            self.stdout.write(
+                f"{workers:<10}{throughput:>10.0f}{throughput / reference:>9.1f}x"
+            )
@@ -0,0 +1,134 @@
+import os
+import re
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from sso_server.hashers import Argon2PasswordHasher, PBKDF2PasswordHasher
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the median duration of a password hash on this machine, and recommend the work factors of the "
+        "hashers for it to take the target duration. Use --write to save them in the .env file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target",
+            type=float,
+            default=100,
+            help="Target median duration of a password hash, in milliseconds. Default: 100.",
+        )
+        parser.add_argument(
+            "--samples",
+            type=int,
+            default=20,
+            help="Number of passwords hashed per measure. Default: 20.",
+        )
+        parser.add_argument(
+            "--write",
+            action="store_true",
+            help="Save the recommended work factors in the .env file.",
+        )
+        parser.add_argument(
+            "--env-file", default=os.path.join(settings.BASE_DIR, "sso", ".env")
+        )
+
+    @staticmethod
+    def measure(hasher, samples):
+        """Return the median duration of a password hash by `hasher`, in milliseconds."""
+
+        durations = []
+        for _ in range(samples):
+            salt = hasher.salt()
+            start = time.perf_counter()
+            hasher.encode("correct horse battery staple", salt)
+            durations.append((time.perf_counter() - start) * 1000)
+
+        return statistics.median(durations)
+
+    def calibrate(self, hasher, attribute, minimum, target, samples):
+        """
+        Return the value of the work factor `attribute` of `hasher` for a hash to take `target` milliseconds. The
+        duration is about proportional to the work factor.
+        """
+
+        current = getattr(hasher, attribute)
+        duration = self.measure(hasher, samples)
+        self.stdout.write(
+            f"{hasher.algorithm}: {attribute}={current} takes {duration:.1f} ms"
+        )
+
+        value = max(minimum, round(current * target / duration))
+        if attribute == "iterations":
+            value = max(minimum, round(value, -3))
+
+        setattr(hasher, attribute, value)
+        duration = self.measure(hasher, samples)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{hasher.algorithm}: {attribute}={value} takes {duration:.1f} ms"
+            )
+        )
+
+        return value
+
+    def write(self, env_file, values):
+        try:
+            with open(env_file) as file:
+                content = file.read()
+        except FileNotFoundError:
+            content = ""
+
+        for name, value in values.items():
+            line = f"{name}={value}"
+            content, count = re.subn(rf"^{name}=.*$", line, content, flags=re.MULTILINE)
+            if not count:
+                if content and not content.endswith("\n"):
+                    content += "\n"
+                content += line + "\n"
+
+        with open(env_file, "w") as file:
+            file.write(content)
+
+        self.stdout.write(
+            f"Wrote {', '.join(values)} in {env_file}. Restart the server to use them."
+        )
+
+    def handle(self, *args, **options):
+        if options["target"] <= 0 or options["samples"] <= 0:
+            raise CommandError("--target and --samples must be positive.")
+
+        values = {
+            "PBKDF2_ITERATIONS": self.calibrate(
+                PBKDF2PasswordHasher(),
+                "iterations",
+                1000,
+                options["target"],
+                options["samples"],
+            )
+        }
+
+        try:
+            Argon2PasswordHasher()._load_library()
+        except ValueError:
+            self.stdout.write("argon2: skipped, argon2-cffi is not installed")
+        else:
+            values["ARGON2_TIME_COST"] = self.calibrate(
+                Argon2PasswordHasher(),
+                "time_cost",
+                1,
+                options["target"],
+                options["samples"],
+            )
+
+        if options["write"]:
+            self.write(options["env_file"], values)
+        else:
+            self.stdout.write(
+                "Recommended settings: "
+                + " ".join(f"{name}={value}" for name, value in values.items())
+            )
@@ -0,0 +1,66 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sso_server.user_import import import_csv, validate_csv
+
+
+class Command(BaseCommand):
+    help = "Import users and their accesses from a CSV file (see examples/user.csv)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv_file", help="Path of the CSV file.")
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=None,
+            help='Number of rows imported at once. Defaults to USER_IMPORT_SETTINGS["CHUNK_SIZE"].',
+        )
+        parser.add_argument(
+            "--validate-only",
+            action="store_true",
+            help="Check the file without importing it.",
+        )
+        parser.add_argument(
+            "--report",
+            help="Path of the CSV file where the validation errors are written.",
+        )
+
+    def write_validation_report(self, validation_report, path):
+        if path is None:
+            self.stderr.write(validation_report.to_csv())
+            return
+
+        with open(path, "w", newline="") as report_file:
+            report_file.write(validation_report.to_csv())
+        self.stderr.write(f"The errors have been written to {path}.")
+
+    def handle(self, *args, **options):
+        def progress(rows, report):
+            self.stdout.write(f"{rows} rows read. {report}")
+
+        try:
+            with open(options["csv_file"], "rb") as csv_file:
+                validation_report = validate_csv(
+                    csv_file, chunk_size=options["chunk_size"]
+                )
+                self.stdout.write(f"Validation: {validation_report}")
+
+                if not validation_report.is_valid:
+                    self.write_validation_report(validation_report, options["report"])
+                    raise CommandError("Nothing has been imported.")
+
+                if options["validate_only"]:
+                    return
+
+                csv_file.seek(0)
+                report = import_csv(
+                    csv_file, chunk_size=options["chunk_size"], progress=progress
+                )
+        except (OSError, ValueError, csv.Error) as e:
+            raise CommandError(e)
+
+        for line, message in report.errors:
+            self.stderr.write(f"Line {line}: {message}")
+
+        self.stdout.write(self.style.SUCCESS(f"Import finished. {report}"))
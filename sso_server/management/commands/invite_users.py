@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from sso_server.invitations import InvitationSender, get_users_to_invite
+
+
+class Command(BaseCommand):
+    help = (
+        "Send an invitation to choose their password to the active users without a password, e.g. the imported "
+        "users, which have not been invited yet."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "usernames", nargs="*", help="Only invite these users, if they qualify."
+        )
+        parser.add_argument(
+            "--resend",
+            action="store_true",
+            help="Also invite the users whose invitation is still valid.",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=None,
+            help=f'Maximum number of emails per second. Default: {settings.INVITATION_SETTINGS["RATE"]}.',
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help=f'Number of invitations created at once. Default: {settings.INVITATION_SETTINGS["BATCH_SIZE"]}.',
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only print the number of users to invite.",
+        )
+
+    def handle(self, *args, **options):
+        users = get_users_to_invite(resend=options["resend"]).order_by("username")
+        if options["usernames"]:
+            users = users.filter(username__in=options["usernames"])
+
+        users = list(users)
+        self.stdout.write(f"{len(users)} users to invite.")
+        if options["dry_run"] or not users:
+            return
+
+        sender = InvitationSender(
+            rate=options["rate"], batch_size=options["batch_size"]
+        )
+        report = sender.send(
+            users, progress=lambda report: self.stdout.write(str(report))
+        )
+
+        for email, error in report.errors:
+            self.stderr.write(f"{email}: {error}")
+
+        self.stdout.write(self.style.SUCCESS(f"Invitations finished. {report}"))
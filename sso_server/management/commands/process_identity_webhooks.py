@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sso_server.webhooks import IdentityWebhookService, IdentityWebhookWorker
+
+
+class Command(BaseCommand):
+    help = "Send the pending identity webhook deliveries to the audiences."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Send the due deliveries once, then exit.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Maximum number of deliveries sent per audience and per iteration.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Maximum number of concurrent requests per audience.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5,
+            help="Seconds to wait when there is nothing to send.",
+        )
+
+    def handle(self, *args, **options):
+        worker = IdentityWebhookWorker(
+            batch_size=options["batch_size"], concurrency=options["concurrency"]
+        )
+
+        try:
+            while True:
+                counts = worker.run_once()
+
+                if any(counts.values()):
+                    self.stdout.write(
+                        f"{counts['delivered']} delivered, {counts['failed']} failed, "
+                        f"{counts['postponed']} postponed."
+                    )
+
+                    if options["verbosity"] > 1:
+                        for (
+                            audience,
+                            stats,
+                        ) in IdentityWebhookService.get_stats().items():
+                            self.stdout.write(f"{audience}: {stats}")
+
+                if options["once"]:
+                    break
+
+                if not (counts["delivered"] or counts["failed"]):
+                    time.sleep(options["poll_interval"])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            worker.shutdown()
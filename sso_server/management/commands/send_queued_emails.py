@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sso_server.mail import EmailWorker
+
+
+class Command(BaseCommand):
+    help = "Send the queued emails."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Send the due emails once, then exit.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Maximum number of emails sent per iteration.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1,
+            help="Seconds to wait when there is nothing to send.",
+        )
+
+    def handle(self, *args, **options):
+        worker = EmailWorker(batch_size=options["batch_size"])
+
+        try:
+            while True:
+                counts = worker.run_once()
+
+                if counts["sent"] or counts["failed"]:
+                    self.stdout.write(
+                        f"{counts['sent']} sent, {counts['failed']} failed."
+                    )
+
+                if options["once"]:
+                    break
+
+                if not (counts["sent"] or counts["failed"]):
+                    time.sleep(options["poll_interval"])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            worker.shutdown()
@@ -0,0 +1,108 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from sso_server.algorithms import KEY_TYPES
+from sso_server.keys import KeyRing
+from sso_server.models import SigningKey
+
+
+class Command(BaseCommand):
+    help = (
+        "Manage the key ring. To rotate the signing key without downtime: stage a new key, wait for the audiences "
+        "to fetch the JSON Web Key Set, promote the new key, then retire the previous one once its tokens expired."
+    )
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest="action", required=True)
+
+        subparsers.add_parser("list", help="List the keys which are not retired.")
+
+        stage = subparsers.add_parser(
+            "stage", help="Publish a new key, which does not sign yet."
+        )
+        stage.add_argument(
+            "--algorithm",
+            choices=sorted(KEY_TYPES),
+            default=settings.JWT_AUTH_SETTINGS["ALGORITHM"],
+        )
+        stage.add_argument(
+            "--private-key",
+            help="PEM file of the private key. By default, a new key is generated.",
+        )
+
+        for action, help in (
+            ("promote", "Sign the new tokens with a staged key."),
+            ("retire", "Stop verifying the tokens of a retiring key."),
+        ):
+            subparser = subparsers.add_parser(action, help=help)
+            subparser.add_argument(
+                "kid", help='Use "-- KID" if the kid starts with "-".'
+            )
+            subparser.add_argument(
+                "--force",
+                action="store_true",
+                help="Do not wait for the audiences or for the tokens to expire.",
+            )
+
+    def handle(self, *args, **options):
+        try:
+            getattr(self, options["action"])(options)
+        except SigningKey.DoesNotExist:
+            raise CommandError(f"Unknown key {options['kid']}.")
+        except ValueError as e:
+            raise CommandError(str(e))
+
+    def list(self, options):
+        for signing_key in SigningKey.objects.exclude(
+            status=SigningKey.RETIRED
+        ).order_by("created_at"):
+            self.stdout.write(
+                f"{signing_key.kid}  {signing_key.algorithm:<6} {signing_key.status:<9} "
+                f"created at {signing_key.created_at:%Y-%m-%d %H:%M}"
+            )
+
+        default_key = KeyRing.get_default_key()
+        self.stdout.write(
+            f"{default_key.kid}  {default_key.algorithm:<6} configured by PRIVATE_KEY, "
+            f"{'signing' if KeyRing.get_signing_key() is default_key else 'verifying only'}"
+        )
+
+    def stage(self, options):
+        private_pem = None
+        if options["private_key"]:
+            with open(options["private_key"]) as file:
+                private_pem = file.read()
+
+        signing_key = KeyRing.stage(options["algorithm"], private_pem)
+        self.stdout.write(f"Staged {signing_key.kid}.")
+
+    def promote(self, options):
+        signing_key = SigningKey.objects.get(kid=options["kid"])
+
+        # The audiences cache the JSON Web Key Set: they may not know the key yet.
+        ready_at = signing_key.created_at + settings.JWT_AUTH_SETTINGS["JWKS_MAX_AGE"]
+        if not options["force"] and ready_at > timezone.now():
+            raise CommandError(
+                f"The audiences may not know the key before {ready_at:%Y-%m-%d %H:%M}. Use --force to promote it now."
+            )
+
+        KeyRing.promote(signing_key.kid)
+        self.stdout.write(f"Promoted {signing_key.kid}.")
+
+    def retire(self, options):
+        signing_key = SigningKey.objects.get(kid=options["kid"])
+
+        if signing_key.retiring_at is not None:
+            expires_at = (
+                signing_key.retiring_at
+                + settings.JWT_AUTH_SETTINGS["ACCESS_TOKEN_LIFETIME"]
+            )
+            if not options["force"] and expires_at > timezone.now():
+                raise CommandError(
+                    f"Tokens signed by the key are valid until {expires_at:%Y-%m-%d %H:%M}. Use --force to retire "
+                    f"it now."
+                )
+
+        KeyRing.retire(signing_key.kid)
+        self.stdout.write(f"Retired {signing_key.kid}.")
@@ -3,12 +3,10 @@ from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.utils import timezone
 
-from sso_server.webhooks import IdentityWebhookService
-
 
 class User(AbstractUser):
     # Override AbstractUser field validation
@@ -17,6 +15,59 @@ class User(AbstractUser):
     last_name = models.CharField(max_length=150, blank=False)
     password = models.CharField(max_length=128, blank=True)
 
+    # id -> username of the users being deleted, for the revocations of their accesses deleted in cascade.
+    _deleted_usernames: dict = {}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(User, cls).from_db(db, field_names, values)
+        # Remember whether the user was active, so that a deactivation can be detected when the user is saved.
+        instance._loaded_is_active = instance.__dict__.get("is_active")
+        return instance
+
+    @classmethod
+    def invalidate_grants(cls, sender, instance, *args, **kwargs):
+        from sso_server.grants import AudienceGrantCache
+
+        # E.g. `is_active` may have changed.
+        AudienceGrantCache.invalidate(instance.pk)
+
+    @classmethod
+    def post_deactivate(cls, sender, instance, created, *args, **kwargs):
+        from sso_server.revocation import TokenRevocationList
+
+        if getattr(instance, "_loaded_is_active", False) and not instance.is_active:
+            TokenRevocationList.revoke_user(instance.username)
+        instance._loaded_is_active = instance.is_active
+
+    @classmethod
+    def pre_delete(cls, sender, instance, *args, **kwargs):
+        # Sent before the accesses are deleted in cascade.
+        cls._deleted_usernames[instance.pk] = instance.username
+
+    @classmethod
+    def post_delete(cls, sender, instance, *args, **kwargs):
+        from sso_server.revocation import TokenRevocationList
+
+        cls._deleted_usernames.pop(instance.pk, None)
+        TokenRevocationList.revoke_user(instance.username)
+
+    @classmethod
+    def get_username(cls, user_id) -> str:
+        """Return the username of a user, without loading the user if it is being deleted."""
+
+        username = cls._deleted_usernames.get(user_id)
+        if username is None:
+            username = cls.objects.values_list("username", flat=True).get(pk=user_id)
+        return username
+
+
+post_save.connect(User.invalidate_grants, sender=User)
+post_save.connect(User.post_deactivate, sender=User)
+pre_delete.connect(User.pre_delete, sender=User)
+post_delete.connect(User.invalidate_grants, sender=User)
+post_delete.connect(User.post_delete, sender=User)
+
 
 class Access(models.Model):
     """This model links an user to an audience."""
@@ -30,17 +81,151 @@ class Access(models.Model):
         max_length=10, choices=AUDIENCES, blank=True, default=""
     )
 
+    def save(self, *args, **kwargs):
+        # The identity webhook delivery written by `post_create` has to be committed with the access.
+        with transaction.atomic():
+            super(Access, self).save(*args, **kwargs)
+
     @classmethod
     def post_create(self, sender, instance, created, *args, **kwargs):
-        if not created:
+        from sso_server.webhooks import IdentityWebhookOutbox
+
+        # The fixtures, saved raw, are not new identities.
+        if not created or kwargs.get("raw"):
             return
-        IdentityWebhookService.post_identity(instance.user, instance.audience)
+        IdentityWebhookOutbox.enqueue(instance.user, instance.audience)
+
+    @classmethod
+    def invalidate_grants(cls, sender, instance, *args, **kwargs):
+        from sso_server.grants import AudienceGrantCache
+
+        AudienceGrantCache.invalidate(instance.user_id)
+
+    @classmethod
+    def post_delete(cls, sender, instance, *args, **kwargs):
+        from sso_server.revocation import TokenRevocationList
+
+        TokenRevocationList.revoke_user(
+            User.get_username(instance.user_id), instance.audience
+        )
 
     class Meta:
         unique_together = ("user", "audience")
 
 
 post_save.connect(Access.post_create, sender=Access)
+post_save.connect(Access.invalidate_grants, sender=Access)
+post_delete.connect(Access.invalidate_grants, sender=Access)
+post_delete.connect(Access.post_delete, sender=Access)
+
+
+class RefreshToken(models.Model):
+    """
+    This model is an opaque refresh token, which can be exchanged once at `token/refresh/` for a new access token and a
+    new refresh token. Only the SHA-256 hash of the token is stored.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    audience = models.CharField(max_length=10, choices=Access.AUDIENCES)
+    token_hash = models.CharField(max_length=64, unique=True)
+    # The refresh tokens rotated from the same login. If a rotated token is used again, it was probably stolen: the
+    # whole family is revoked.
+    family = models.UUIDField(default=uuid.uuid4, db_index=True)
+
+    created_at = models.DateTimeField(editable=False, default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+    used_at = models.DateTimeField(null=True, blank=True)
+    revoked = models.BooleanField(default=False)
+
+
+class SSOSession(models.Model):
+    """
+    This model is an SSO session, opened at login and identified by a random key set as a signed cookie. Only the
+    SHA-256 hash of the key is stored.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    key_hash = models.CharField(max_length=64, unique=True)
+
+    created_at = models.DateTimeField(editable=False, default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked = models.BooleanField(default=False)
+
+
+class TokenRevocation(models.Model):
+    """
+    This model revokes the token whose claim `jti` is `jti`, or all the tokens issued to `username` before
+    `revoked_at`, for `audience` or, if it is blank, for every audience. It is useless once these tokens have expired,
+    at `expires_at`.
+    """
+
+    jti = models.CharField(max_length=32, blank=True, default="")
+    username = models.CharField(max_length=150, blank=True, default="")
+    audience = models.CharField(max_length=10, blank=True, default="")
+
+    revoked_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=("revoked_at",)),
+            models.Index(fields=("expires_at",)),
+        ]
+
+
+class IdentityWebhookDelivery(models.Model):
+    """
+    This model is the outbox of the identity webhooks: a row is written when an access is created, and the
+    `process_identity_webhooks` command sends the identity of the user to the audience.
+    """
+
+    PENDING = "pending"
+    DELIVERED = "delivered"
+    FAILED = "failed"
+    STATUSES = [(PENDING, "Pending"), (DELIVERED, "Delivered"), (FAILED, "Failed")]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    audience = models.CharField(max_length=10, choices=Access.AUDIENCES)
+
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+
+    created_at = models.DateTimeField(editable=False, default=timezone.now)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=("status", "audience", "next_attempt_at"))]
+
+
+class QueuedEmail(models.Model):
+    """This model is the queue of the emails, which are sent by the `send_queued_emails` command."""
+
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUSES = [(PENDING, "Pending"), (SENT, "Sent"), (FAILED, "Failed")]
+
+    sender_name = models.CharField(max_length=150)
+    to = models.TextField()
+    subject = models.CharField(max_length=255)
+    text = models.TextField()
+    # The name of a template of `sso_server/email_template`.
+    template_name = models.CharField(max_length=255, blank=True, default="")
+    # The JSON-encoded variables of the template.
+    context = models.TextField(blank=True, default="{}")
+
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+
+    created_at = models.DateTimeField(editable=False, default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=("status", "next_attempt_at"))]
 
 
 class PasswordRecovery(models.Model):
@@ -51,6 +236,8 @@ class PasswordRecovery(models.Model):
     """
 
     TOKEN_LIFETIME = timedelta(minutes=60)
+    # The invitations sent to the imported users, see `sso_server.invitations`.
+    INVITATION_LIFETIME = timedelta(days=7)
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(
@@ -63,9 +250,43 @@ class PasswordRecovery(models.Model):
     created_at = models.DateTimeField(editable=False, default=timezone.now)
 
     used = models.BooleanField(default=False, editable=False)
+    is_invitation = models.BooleanField(default=False, editable=False)
+
+    @property
+    def lifetime(self) -> timedelta:
+        return self.INVITATION_LIFETIME if self.is_invitation else self.TOKEN_LIFETIME
 
     @property
     def is_valid(self) -> bool:
-        return (
-            self.created_at + self.TOKEN_LIFETIME > timezone.now()
-        ) and not self.used
+        return (self.created_at + self.lifetime > timezone.now()) and not self.used
+
+
+class SigningKey(models.Model):
+    """
+    This model is a key of the key ring, see `sso_server.keys.KeyRing`. A key is published in the JSON Web Key Set
+    once staged, signs the tokens once promoted to active, and only verifies them once retiring, until it is retired.
+    """
+
+    STAGED = "staged"
+    ACTIVE = "active"
+    RETIRING = "retiring"
+    RETIRED = "retired"
+    STATUSES = [
+        (STAGED, "Staged"),
+        (ACTIVE, "Active"),
+        (RETIRING, "Retiring"),
+        (RETIRED, "Retired"),
+    ]
+
+    # The RFC 7638 thumbprint of the public key.
+    kid = models.CharField(max_length=64, unique=True)
+    algorithm = models.CharField(max_length=10)
+    # PEM-encoded keys.
+    private_key = models.TextField()
+    public_key = models.TextField()
+
+    status = models.CharField(max_length=10, choices=STATUSES, default=STAGED)
+    created_at = models.DateTimeField(editable=False, default=timezone.now)
+    promoted_at = models.DateTimeField(null=True, blank=True)
+    retiring_at = models.DateTimeField(null=True, blank=True)
+    retired_at = models.DateTimeField(null=True, blank=True)
@@ -0,0 +1,30 @@
+"""
+Password validators shared by every request.
+
+Django parses its list of 20,000 common passwords each time a `CommonPasswordValidator` is built. Here, each list is
+parsed once per process into a frozenset, and the validators themselves are built once, by
+`password_validation.get_default_password_validators`. See `manage.py benchmark_password_validation`.
+"""
+
+from functools import lru_cache
+
+from django.contrib.auth import password_validation
+
+
+@lru_cache(maxsize=None)
+def load_common_passwords(password_list_path) -> frozenset:
+    """Return the set of the passwords of a list, which may be gzipped, one password per line."""
+
+    return frozenset(
+        password_validation.CommonPasswordValidator(password_list_path).passwords
+    )
+
+
+class CommonPasswordValidator(password_validation.CommonPasswordValidator):
+    """A `CommonPasswordValidator` whose list of passwords is only read once per process."""
+
+    def __init__(
+        self,
+        password_list_path=password_validation.CommonPasswordValidator.DEFAULT_PASSWORD_LIST_PATH,
+    ):
+        self.passwords = load_common_passwords(str(password_list_path))
@@ -0,0 +1,176 @@
+"""
+Rate limiting of the endpoints which hash a password or send an email.
+
+The requests are counted per client IP and per account, in sliding windows approximated by two fixed windows: the
+count is the one of the current window plus the one of the previous window, weighted by the share of the sliding
+window it still covers. Each request costs a constant number of operations, whatever the limit.
+
+The counters are kept in an in-process LRU cache or, if `RATE_LIMIT_SETTINGS["CACHE_ALIAS"]` is set, in a Django cache
+shared by the processes, e.g. Redis or Memcached. The limits of each endpoint are set in
+`RATE_LIMIT_SETTINGS["LIMITS"]`.
+"""
+
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class RateLimitedError(Exception):
+    def __init__(self, retry_after: int):
+        super(RateLimitedError, self).__init__("RATE_LIMITED")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    SETTINGS: dict = settings.RATE_LIMIT_SETTINGS
+
+    # (scope, kind, value) -> [window index, count of the window, count of the previous window], the least recently
+    # used first.
+    _local: OrderedDict = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_client_ip(request) -> str:
+        header = RateLimiter.SETTINGS["CLIENT_IP_HEADER"]
+        if header and request.META.get(header):
+            # E.g. `X-Forwarded-For: spoofed, client, proxy1` as received through 2 proxies. Each proxy appends the
+            # address it received the request from, so only the last NUM_PROXIES entries are trusted: the client
+            # sets the others itself.
+            addresses = request.META[header].split(",")
+            num_proxies = RateLimiter.SETTINGS["NUM_PROXIES"]
+            return addresses[-min(num_proxies, len(addresses))].strip()
+
+        return request.META.get("REMOTE_ADDR", "")
+
+    @staticmethod
+    def _get_retry_after(limit, period, elapsed, count, previous_count) -> int:
+        if count >= limit:
+            # At least until the end of the current window.
+            retry_after = period - elapsed
+        else:
+            # Until the weight of the previous window is low enough.
+            retry_after = (
+                previous_count - limit + count
+            ) * period / previous_count - elapsed
+
+        return max(1, math.ceil(retry_after))
+
+    @classmethod
+    def _hit_local(cls, hits):
+        with cls._lock:
+            counts = []
+            for key, window, _, _, _ in hits:
+                entry = cls._local.get(key)
+                if entry is None or entry[0] < window - 1:
+                    entry = [window, 0, 0]
+                elif entry[0] == window - 1:
+                    entry = [window, 0, entry[1]]
+
+                cls._local[key] = entry
+                cls._local.move_to_end(key)
+                counts.append((entry[1], entry[2]))
+
+            retry_after = cls._get_max_retry_after(hits, counts)
+            if not retry_after:
+                for key, *_ in hits:
+                    cls._local[key][1] += 1
+
+            while len(cls._local) > cls.SETTINGS["MAX_SIZE"]:
+                cls._local.popitem(last=False)
+
+        return retry_after
+
+    @classmethod
+    def _hit_shared(cls, hits):
+        cache = caches[cls.SETTINGS["CACHE_ALIAS"]]
+
+        cache_keys = []
+        for key, window, _, _, _ in hits:
+            # The keys of Memcached are short and without spaces.
+            prefix = "ratelimit:" + hashlib.sha256(repr(key).encode()).hexdigest()
+            cache_keys.append((f"{prefix}:{window}", f"{prefix}:{window - 1}"))
+
+        values = cache.get_many([k for pair in cache_keys for k in pair])
+        counts = [
+            (values.get(cache_key, 0), values.get(previous_cache_key, 0))
+            for cache_key, previous_cache_key in cache_keys
+        ]
+
+        retry_after = cls._get_max_retry_after(hits, counts)
+        if not retry_after:
+            for (_, _, _, period, _), (cache_key, _) in zip(hits, cache_keys):
+                # The counter has to outlive the next window, which reads it as the previous one.
+                if not cache.add(cache_key, 1, timeout=2 * period):
+                    try:
+                        cache.incr(cache_key)
+                    except ValueError:
+                        # Evicted in between.
+                        cache.set(cache_key, 1, timeout=2 * period)
+
+        return retry_after
+
+    @classmethod
+    def _get_max_retry_after(cls, hits, counts) -> int:
+        """Return 0 if the requests are under their limits, else the delay before they all are."""
+
+        retry_after = 0
+        for (_, _, limit, period, elapsed), (count, previous_count) in zip(
+            hits, counts
+        ):
+            if count + previous_count * (1 - elapsed / period) >= limit:
+                retry_after = max(
+                    retry_after,
+                    cls._get_retry_after(limit, period, elapsed, count, previous_count),
+                )
+
+        return retry_after
+
+    @classmethod
+    def hit(cls, scope: str, **values):
+        """
+        Count a request to `scope`, e.g. `hit("login", ip=..., account=...)`. Raise `RateLimitedError` if one of the
+        values exceeded its limit, in which case the request is not counted at all. The values without a limit in
+        `RATE_LIMIT_SETTINGS["LIMITS"][scope]` are ignored.
+        """
+
+        if not cls.SETTINGS["ENABLED"]:
+            return
+
+        now = time.time()
+        limits = cls.SETTINGS["LIMITS"].get(scope, {})
+
+        # (key, window index, limit, period, time elapsed in the window) of each limited value.
+        hits = []
+        for kind, value in values.items():
+            if kind not in limits or not value:
+                continue
+
+            period = limits[kind]["PERIOD"].total_seconds()
+            window, elapsed = divmod(now, period)
+            hits.append(
+                (
+                    (scope, kind, value),
+                    int(window),
+                    limits[kind]["LIMIT"],
+                    period,
+                    elapsed,
+                )
+            )
+
+        if cls.SETTINGS["CACHE_ALIAS"]:
+            retry_after = cls._hit_shared(hits)
+        else:
+            retry_after = cls._hit_local(hits)
+
+        if retry_after:
+            raise RateLimitedError(retry_after)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._local.clear()
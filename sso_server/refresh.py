@@ -0,0 +1,146 @@
+"""
+Refresh tokens.
+
+A login returns, with the access token, an opaque refresh token which the audience exchanges at `token/refresh/` for a
+new access token and a new refresh token. The password hasher is not involved: a renewal costs one signature and a
+few queries, so the access tokens can be short-lived.
+
+As it travels in the redirect URL, the refresh token of a login is a refresh code: it only lasts
+`REFRESH_CODE_LIFETIME`, and the audience exchanges it from its backend for a refresh token which lasts
+`REFRESH_TOKEN_LIFETIME`.
+
+The refresh tokens are random strings of 256 bits. They are stored hashed with SHA-256, which is enough for secrets
+of that entropy, and rotated: each of them can only be used once.
+"""
+
+import hashlib
+import secrets
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from sso_server.grants import AudienceGrantCache
+from sso_server.models import RefreshToken
+from sso_server.token import create_token_for_user
+
+
+class RefreshTokenError(Exception):
+    def __init__(self, error_type: str):
+        super(RefreshTokenError, self).__init__(error_type)
+        self.error_type = error_type
+
+
+def hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def create_refresh_tokens(user, audiences, lifetime: timedelta = None) -> dict:
+    """
+    Return a new refresh token for the user and each audience, each of them starting a new family. They last
+    `lifetime`, `REFRESH_TOKEN_LIFETIME` by default.
+    """
+
+    now = timezone.now()
+    lifetime = lifetime or settings.JWT_AUTH_SETTINGS["REFRESH_TOKEN_LIFETIME"]
+    tokens = {audience: secrets.token_urlsafe(32) for audience in audiences}
+
+    # A login is a good time to forget the expired refresh tokens of the user.
+    RefreshToken.objects.filter(user=user, expires_at__lte=now).delete()
+
+    RefreshToken.objects.bulk_create(
+        RefreshToken(
+            user=user,
+            audience=audience,
+            token_hash=hash_refresh_token(token),
+            family=uuid.uuid4(),
+            expires_at=now + lifetime,
+        )
+        for audience, token in tokens.items()
+    )
+
+    return tokens
+
+
+def revoke_user_refresh_tokens(user):
+    """Revoke all the refresh tokens of the user, e.g. when their password changes."""
+
+    RefreshToken.objects.filter(user=user, revoked=False).update(revoked=True)
+
+
+def create_refresh_token(user, audience: str, family=None) -> str:
+    """Return a new refresh token for the user and the audience. It starts a new family if `family` is None."""
+
+    if family is None:
+        return create_refresh_tokens(user, [audience])[audience]
+
+    token = secrets.token_urlsafe(32)
+    RefreshToken.objects.create(
+        user=user,
+        audience=audience,
+        token_hash=hash_refresh_token(token),
+        family=family,
+        expires_at=timezone.now()
+        + settings.JWT_AUTH_SETTINGS["REFRESH_TOKEN_LIFETIME"],
+    )
+
+    return token
+
+
+def _rotate(token: str):
+    """Return `(access token, refresh token)`, or `(None, error type)` if the refresh token cannot be used."""
+
+    now = timezone.now()
+
+    with transaction.atomic():
+        try:
+            refresh_token = (
+                RefreshToken.objects.select_for_update(of=("self",))
+                .select_related("user")
+                .get(token_hash=hash_refresh_token(token))
+            )
+        except RefreshToken.DoesNotExist:
+            return None, "INVALID_REFRESH_TOKEN"
+
+        if refresh_token.revoked:
+            return None, "INVALID_REFRESH_TOKEN"
+
+        if refresh_token.used_at is not None:
+            RefreshToken.objects.filter(family=refresh_token.family).update(
+                revoked=True
+            )
+            return None, "REFRESH_TOKEN_REUSED"
+
+        if refresh_token.expires_at <= now:
+            return None, "REFRESH_TOKEN_EXPIRED"
+
+        user, audience = refresh_token.user, refresh_token.audience
+        if not user.is_active or not AudienceGrantCache.has_access(user, audience):
+            return None, "INVALID_AUDIENCE"
+
+        refresh_token.used_at = now
+        refresh_token.save(update_fields=("used_at",))
+
+        return (
+            create_token_for_user(user, audience),
+            create_refresh_token(user, audience, family=refresh_token.family),
+        )
+
+
+def rotate_refresh_token(token: str):
+    """
+    Return `(access token, refresh token)` in exchange of a refresh token, which cannot be used anymore.
+
+    Raise `RefreshTokenError` if the refresh token is unknown, expired or already used, or if the user cannot access the
+    audience anymore. When an already used refresh token is presented, all the refresh tokens of its family are
+    revoked.
+    """
+
+    access_token, result = _rotate(token)
+
+    if access_token is None:
+        raise RefreshTokenError(result)
+
+    return access_token, result
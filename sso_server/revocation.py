@@ -0,0 +1,170 @@
+"""
+Revocation of the tokens before their expiration.
+
+The revocations are stored in the database by `TokenRevocation` until the tokens they concern expire. Each process keeps
+them in memory, in a hash set of the revoked `jti` and a dict of the "revoked before" timestamps of the users, which is
+refreshed incrementally every `JWT_AUTH_SETTINGS["REVOCATION_REFRESH_INTERVAL"]`: checking a token does not query the
+database.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from sso_server.models import TokenRevocation
+from sso_server.verification import VerificationCache
+
+
+class TokenRevocationList:
+    REFRESH_INTERVAL: timedelta = settings.JWT_AUTH_SETTINGS[
+        "REVOCATION_REFRESH_INTERVAL"
+    ]
+    # The revocations written less than this before the last refresh are read again, in case their transaction was
+    # committed after it.
+    REFRESH_OVERLAP = timedelta(minutes=1)
+    # How often each process deletes the revocations of the expired tokens, on a revocation.
+    PURGE_INTERVAL: timedelta = settings.JWT_AUTH_SETTINGS["REVOCATION_PURGE_INTERVAL"]
+
+    # jti -> expiration timestamp.
+    _jtis: dict = {}
+    # (username, audience or "") -> (revoked before timestamp, expiration timestamp).
+    _revoked_before: dict = {}
+
+    _lock = threading.Lock()
+    _cursor = None
+    _next_refresh = 0.0
+    _next_purge = 0.0
+
+    @classmethod
+    def add(cls, revocation: TokenRevocation):
+        expires_at = revocation.expires_at.timestamp()
+
+        if revocation.jti:
+            cls._jtis[revocation.jti] = expires_at
+        if revocation.username:
+            key = (revocation.username, revocation.audience)
+            revoked_at = revocation.revoked_at.timestamp()
+            previous = cls._revoked_before.get(key)
+
+            if previous is None or previous[0] < revoked_at:
+                cls._revoked_before[key] = (revoked_at, expires_at)
+
+    @classmethod
+    def refresh(cls, force: bool = False):
+        """Read the revocations written since the last refresh, at most once per `REFRESH_INTERVAL`."""
+
+        if not force and time.monotonic() < cls._next_refresh:
+            return
+
+        with cls._lock:
+            if not force and time.monotonic() < cls._next_refresh:
+                return
+
+            now = timezone.now()
+            revocations = TokenRevocation.objects.filter(expires_at__gt=now)
+            if cls._cursor is not None:
+                revocations = revocations.filter(
+                    revoked_at__gte=cls._cursor - cls.REFRESH_OVERLAP
+                )
+
+            for revocation in revocations.only(
+                "jti", "username", "audience", "revoked_at", "expires_at"
+            ):
+                cls.add(revocation)
+
+            # Forget the revocations of the expired tokens.
+            timestamp = now.timestamp()
+            cls._jtis = {
+                jti: expires_at
+                for jti, expires_at in cls._jtis.items()
+                if expires_at > timestamp
+            }
+            cls._revoked_before = {
+                key: value
+                for key, value in cls._revoked_before.items()
+                if value[1] > timestamp
+            }
+
+            cls._cursor = now
+            cls._next_refresh = time.monotonic() + cls.REFRESH_INTERVAL.total_seconds()
+
+    @classmethod
+    def is_revoked(cls, payload: dict) -> bool:
+        cls.refresh()
+
+        if payload.get("jti") in cls._jtis:
+            return True
+
+        username = payload.get(settings.JWT_AUTH_SETTINGS["USER_ID_CLAIM_NAME"])
+        if not cls._revoked_before or username is None:
+            return False
+
+        # The tokens issued before the claim `iat` was added may have lived longer than `ACCESS_TOKEN_LIFETIME`: they
+        # are revoked by any revocation of their user.
+        issued_at = payload.get("iat", float("-inf"))
+
+        for key in ((username, ""), (username, payload.get("aud", ""))):
+            revoked_before = cls._revoked_before.get(key)
+            if revoked_before is not None and issued_at <= revoked_before[0]:
+                return True
+
+        return False
+
+    @classmethod
+    def revoke(cls, **kwargs) -> TokenRevocation:
+        revocation = TokenRevocation.objects.create(**kwargs)
+        with cls._lock:
+            cls.add(revocation)
+
+        if time.monotonic() >= cls._next_purge:
+            cls.purge()
+
+        return revocation
+
+    @classmethod
+    def purge(cls) -> int:
+        """Delete the revocations of the expired tokens, which nothing needs anymore. Return their number."""
+
+        cls._next_purge = time.monotonic() + cls.PURGE_INTERVAL.total_seconds()
+        count, _ = TokenRevocation.objects.filter(
+            expires_at__lte=timezone.now()
+        ).delete()
+
+        return count
+
+    @classmethod
+    def revoke_token(cls, payload: dict) -> TokenRevocation:
+        """Revoke a token, given its payload."""
+
+        VerificationCache.invalidate_jti(payload["jti"])
+        return cls.revoke(
+            jti=payload["jti"],
+            expires_at=datetime.fromtimestamp(payload["exp"], tz=timezone.utc),
+        )
+
+    @classmethod
+    def revoke_user(cls, username: str, audience: str = "") -> TokenRevocation:
+        """Revoke the tokens issued so far to the user for `audience` or, if it is blank, for every audience."""
+
+        revoked_at = timezone.now()
+
+        return cls.revoke(
+            username=username,
+            audience=audience,
+            revoked_at=revoked_at,
+            expires_at=revoked_at + settings.JWT_AUTH_SETTINGS["ACCESS_TOKEN_LIFETIME"],
+        )
+
+    @classmethod
+    def clear(cls):
+        """Forget the revocations in memory: they are read again from the database by the next check."""
+
+        with cls._lock:
+            cls._jtis = {}
+            cls._revoked_before = {}
+            cls._cursor = None
+            cls._next_refresh = 0.0
+            cls._next_purge = 0.0
@@ -1,30 +1,122 @@
 from django.conf import settings
 from django.contrib.auth import authenticate, password_validation
 from django.core.exceptions import ObjectDoesNotExist
+from jwt import InvalidTokenError
 from rest_framework import serializers
 
+from sso_server.admission import LoginAdmissionControl
+from sso_server.grants import AudienceGrantCache
 from sso_server.models import Access, PasswordRecovery
-from sso_server.token import create_token_for_user, decode_token
+from sso_server.refresh import (
+    RefreshTokenError,
+    create_refresh_tokens,
+    rotate_refresh_token,
+)
+from sso_server.sessions import SSOSessionError, get_session_key, get_session_user
+from sso_server.token import (
+    create_token_for_user,
+    get_token_error_type,
+    verify_token,
+)
 
 
 class CreateTokenSerializer(serializers.Serializer):
-    """This serializer tries to authenticate the user with the provided password. Then, it returns a JWT."""
+    """
+    This serializer tries to authenticate the user with the provided password. Then, it returns a JWT and a refresh
+    code for `audience` or, if `audiences` is provided instead, for each of them the user is allowed to access: the
+    password is only checked once.
+    """
 
     username = serializers.CharField()
     password = serializers.CharField(style={"input_type": "password"}, write_only=True)
-    audience = serializers.ChoiceField(choices=Access.AUDIENCES)
+    audience = serializers.ChoiceField(choices=Access.AUDIENCES, required=False)
+    audiences = serializers.ListField(
+        child=serializers.ChoiceField(choices=Access.AUDIENCES),
+        required=False,
+        allow_empty=False,
+        max_length=len(Access.AUDIENCES),
+    )
 
     def validate(self, data):
         data = super(CreateTokenSerializer, self).validate(data)
 
-        # Check if the credentials are valid.
-        user = authenticate(username=data["username"], password=data["password"])
+        if ("audience" in data) == ("audiences" in data):
+            raise serializers.ValidationError(
+                {"audience": "Provide either audience or audiences."}
+            )
+        requested_audiences = data.get("audiences", [data.get("audience")])
+
+        # Check if the credentials are valid. The password hashes are bounded, see `sso_server.admission`.
+        with LoginAdmissionControl.admit():
+            user = authenticate(username=data["username"], password=data["password"])
 
         if user is None or not user.is_active:
             raise serializers.ValidationError("INVALID_CREDENTIALS")
 
-        # Check if the user is allowed to access the given audience.
-        if not Access.objects.filter(user=user, audience=data["audience"]).exists():
+        # Check if the user is allowed to access the given audiences. All their accesses are read at once.
+        granted_audiences = AudienceGrantCache.get_audiences(user)
+        audiences = [
+            audience
+            for audience in dict.fromkeys(requested_audiences)
+            if audience in granted_audiences
+        ]
+        if not audiences:
+            raise serializers.ValidationError("INVALID_AUDIENCE")
+
+        data["user"] = user
+        refresh_codes = create_refresh_tokens(
+            user,
+            audiences,
+            lifetime=settings.JWT_AUTH_SETTINGS["REFRESH_CODE_LIFETIME"],
+        )
+        # Audience -> (JWT, refresh code).
+        data["tokens"] = {
+            audience: (create_token_for_user(user, audience), refresh_codes[audience])
+            for audience in audiences
+        }
+
+        return data
+
+
+class RefreshTokenSerializer(serializers.Serializer):
+    """This serializer exchanges a refresh token for a new access token and a new refresh token."""
+
+    refresh_token = serializers.CharField(write_only=True)
+
+    def validate(self, data):
+        data = super(RefreshTokenSerializer, self).validate(data)
+
+        try:
+            data["access"], data["refresh"] = rotate_refresh_token(
+                data["refresh_token"]
+            )
+        except RefreshTokenError as e:
+            raise serializers.ValidationError(e.error_type)
+
+        return data
+
+
+class SessionTokenSerializer(serializers.Serializer):
+    """
+    This serializer returns a JWT for the user of the SSO session of the request, without checking the password. The
+    session is given by `context["request"]`.
+    """
+
+    audience = serializers.ChoiceField(choices=Access.AUDIENCES)
+
+    def validate(self, data):
+        data = super(SessionTokenSerializer, self).validate(data)
+
+        key = get_session_key(self.context["request"])
+        if key is None:
+            raise serializers.ValidationError("INVALID_SESSION")
+
+        try:
+            user = get_session_user(key)
+        except SSOSessionError as e:
+            raise serializers.ValidationError(str(e))
+
+        if not AudienceGrantCache.has_access(user, data["audience"]):
             raise serializers.ValidationError("INVALID_AUDIENCE")
 
         data["token"] = create_token_for_user(user, data["audience"])
@@ -33,13 +125,58 @@ class CreateTokenSerializer(serializers.Serializer):
 
 
 class DecodeTokenSerializer(serializers.Serializer):
-    """This Serializer decodes the provided token."""
+    """
+    This Serializer verifies the provided token, with `verify_token`: its signature, its expiration date, its issuer and
+    that it was not revoked. The payload of a token verified recently is cached.
+    """
 
     token = serializers.CharField()
 
     def validate(self, data):
         data = super(DecodeTokenSerializer, self).validate(data)
-        data.update(decode_token(data["token"]))
+
+        try:
+            data.update(verify_token(data["token"]))
+        except InvalidTokenError as e:
+            raise serializers.ValidationError(get_token_error_type(e))
+
+        return data
+
+
+class BatchDecodeTokenSerializer(serializers.Serializer):
+    """
+    This serializer verifies up to `JWT_AUTH_SETTINGS["VERIFY_BATCH_MAX_SIZE"]` tokens. The audience of the tokens is
+    checked iff it is provided.
+
+    `results` holds, in the order of `tokens`, either `{"claims": {...}}` or `{"error": {"type": "", "detail": ""}}`.
+    """
+
+    tokens = serializers.ListField(
+        child=serializers.CharField(),
+        allow_empty=False,
+        max_length=settings.JWT_AUTH_SETTINGS["VERIFY_BATCH_MAX_SIZE"],
+    )
+    audience = serializers.ChoiceField(choices=Access.AUDIENCES, required=False)
+
+    def validate(self, data):
+        data = super(BatchDecodeTokenSerializer, self).validate(data)
+
+        # A gateway may send the same token several times: verify it once.
+        verified = {}
+        for token in data["tokens"]:
+            if token in verified:
+                continue
+
+            try:
+                verified[token] = {
+                    "claims": verify_token(token, audience=data.get("audience"))
+                }
+            except InvalidTokenError as e:
+                verified[token] = {
+                    "error": {"type": get_token_error_type(e), "detail": str(e)}
+                }
+
+        data["results"] = [verified[token] for token in data["tokens"]]
 
         return data
 
@@ -89,14 +226,9 @@ class RecoverPasswordSerializer(serializers.Serializer):
         return value
 
     def validate_password(self, value):
-        password_validators = password_validation.get_password_validators(
-            settings.AUTH_PASSWORD_VALIDATORS
-        )
-
         try:
-            password_validation.validate_password(
-                value, user=self._user, password_validators=password_validators
-            )
+            # The default validators are built once, from `settings.AUTH_PASSWORD_VALIDATORS`.
+            password_validation.validate_password(value, user=self._user)
         except password_validation.ValidationError:
             raise serializers.ValidationError("WEAK_PASSWORD")
 
@@ -0,0 +1,109 @@
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+from sso_server.admission import LoginAdmissionControl, LoginOverloadedError
+from .utils import BaseTestCase
+
+
+class TestLoginAdmissionControl(BaseTestCase):
+    def setUp(self):
+        super(TestLoginAdmissionControl, self).setUp()
+        patcher = mock.patch.dict(
+            LoginAdmissionControl.SETTINGS,
+            {
+                "MAX_CONCURRENT": 1,
+                "MAX_QUEUE": 1,
+                "QUEUE_TIMEOUT": timedelta(milliseconds=50),
+                "RETRY_AFTER": timedelta(seconds=5),
+            },
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self):
+        return self.post(
+            "/login/",
+            {"username": "17portail", "password": "password", "audience": "portail"},
+        )
+
+    def test_login_is_admitted(self):
+        self.login()
+        self.assertStatusCode(200)
+        self.assertEqual(1, LoginAdmissionControl.get_stats()["admitted"])
+        self.assertEqual(0, LoginAdmissionControl.get_stats()["in_flight"])
+
+    def test_saturated_login_is_shed(self):
+        with mock.patch.dict(LoginAdmissionControl.SETTINGS, {"MAX_QUEUE": 0}):
+            with LoginAdmissionControl.admit():
+                res = self.login()
+
+        self.assertStatusCode(503)
+        self.assertEqual("5", res["Retry-After"])
+        self.assertResponseDataEqual(
+            {"error": {"type": "LOGIN_OVERLOADED", "detail": ""}}
+        )
+        self.assertEqual(1, LoginAdmissionControl.get_stats()["rejected"])
+
+        # The slot was released.
+        self.login()
+        self.assertStatusCode(200)
+
+    def test_queued_login_times_out(self):
+        with LoginAdmissionControl.admit():
+            self.login()
+
+        self.assertStatusCode(503)
+        self.assertEqual(1, LoginAdmissionControl.get_stats()["timed_out"])
+        self.assertEqual(0, LoginAdmissionControl.get_stats()["queue_depth"])
+
+    def test_queued_login_gets_the_released_slot(self):
+        waiting = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def hold_slot():
+            with LoginAdmissionControl.admit():
+                waiting.set()
+                release.wait()
+
+        def wait_for_slot():
+            try:
+                with LoginAdmissionControl.admit():
+                    results.append("admitted")
+            except LoginOverloadedError:
+                results.append("rejected")
+
+        holder = threading.Thread(target=hold_slot)
+        holder.start()
+        waiting.wait()
+
+        with mock.patch.dict(
+            LoginAdmissionControl.SETTINGS, {"QUEUE_TIMEOUT": timedelta(seconds=5)}
+        ):
+            waiter = threading.Thread(target=wait_for_slot)
+            waiter.start()
+            while LoginAdmissionControl.get_stats()["queue_depth"] == 0:
+                time.sleep(0.001)
+
+            # The queue is full.
+            with self.assertRaises(LoginOverloadedError):
+                with LoginAdmissionControl.admit():
+                    pass
+
+            release.set()
+            holder.join()
+            waiter.join()
+
+        self.assertEqual(["admitted"], results)
+        self.assertEqual(
+            {
+                "in_flight": 0,
+                "queue_depth": 0,
+                "admitted": 2,
+                "rejected": 1,
+                "timed_out": 0,
+            },
+            LoginAdmissionControl.get_stats(),
+        )
@@ -0,0 +1,92 @@
+from unittest import mock
+
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import override_settings
+
+from sso_server.grants import AudienceGrantCache
+from sso_server.models import Access, User
+from .utils import BaseTestCase
+
+
+class TestAudienceGrantCache(BaseTestCase):
+    endpoint = "/login/"
+
+    def setUp(self):
+        super(TestAudienceGrantCache, self).setUp()
+        self.user = User.objects.get(username="17portail")
+
+    def login(self, audience="portail"):
+        return self.post(
+            self.endpoint,
+            {"username": "17portail", "password": "password", "audience": audience},
+        )
+
+    def test_repeated_login_skips_the_access_query(self):
+        self.login()
+        self.assertStatusCode(200)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.login()
+        self.assertStatusCode(200)
+        self.assertFalse(
+            [query for query in queries if "sso_server_access" in query["sql"]]
+        )
+
+    def test_deleted_access_is_not_served(self):
+        self.login()
+        self.assertStatusCode(200)
+
+        Access.objects.get(user=self.user, audience="portail").delete()
+
+        self.login()
+        self.assertStatusCode(401)
+        self.assertResponseDataEqual(
+            {"error": {"type": "INVALID_AUDIENCE", "detail": ""}}
+        )
+
+    def test_created_access_is_served(self):
+        self.login("rezal")
+        self.assertStatusCode(401)
+
+        Access.objects.create(user=self.user, audience="rezal")
+
+        self.login("rezal")
+        self.assertStatusCode(200)
+
+    def test_deactivated_user_has_no_grant(self):
+        self.assertIn("portail", AudienceGrantCache.get_audiences(self.user))
+
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(frozenset(), AudienceGrantCache.get_audiences(self.user))
+
+    def test_least_recently_used_user_is_evicted(self):
+        other = User.objects.get(username="17rezal")
+
+        with mock.patch.dict(AudienceGrantCache.SETTINGS, {"MAX_SIZE": 1}):
+            AudienceGrantCache.get_audiences(self.user)
+            AudienceGrantCache.get_audiences(other)
+
+        self.assertEqual(1, AudienceGrantCache.get_stats()["size"])
+        self.assertIsNone(AudienceGrantCache.get_local(self.user.pk))
+
+    @override_settings(
+        CACHES={"grants": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_shared_cache_is_invalidated(self):
+        with mock.patch.dict(AudienceGrantCache.SETTINGS, {"CACHE_ALIAS": "grants"}):
+            AudienceGrantCache.get_audiences(self.user)
+            # Another process would only see the shared cache.
+            AudienceGrantCache.clear()
+
+            with self.assertNumQueries(0):
+                self.assertIn("portail", AudienceGrantCache.get_audiences(self.user))
+
+            Access.objects.filter(user=self.user).delete()
+            self.assertIsNone(
+                caches["grants"].get(AudienceGrantCache.get_key(self.user.pk))
+            )
+            self.assertEqual(frozenset(), AudienceGrantCache.get_audiences(self.user))
@@ -0,0 +1,85 @@
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.hashers import get_hasher
+from django.core.management import call_command
+
+from sso_server.hashers import PBKDF2PasswordHasher
+from sso_server.models import User
+from .utils import BaseTestCase
+
+
+class TestPasswordHashers(BaseTestCase):
+    def test_hashers_use_the_settings(self):
+        self.assertIsInstance(get_hasher(), PBKDF2PasswordHasher)
+
+        user = User.objects.get(username="17portail")
+        user.set_password("password")
+        self.assertEqual(
+            str(PBKDF2PasswordHasher.iterations), user.password.split("$")[1]
+        )
+
+    def test_outdated_hash_is_updated_at_login(self):
+        user = User.objects.get(username="17portail")
+        hasher = PBKDF2PasswordHasher()
+        User.objects.filter(pk=user.pk).update(
+            password=hasher.encode("password", hasher.salt(), iterations=1000)
+        )
+
+        self.post(
+            "/login/",
+            {"username": "17portail", "password": "password", "audience": "portail"},
+        )
+        self.assertStatusCode(200)
+
+        user.refresh_from_db()
+        self.assertEqual(
+            str(PBKDF2PasswordHasher.iterations), user.password.split("$")[1]
+        )
+        self.assertTrue(user.check_password("password"))
+
+    def test_failed_login_does_not_update_the_hash(self):
+        user = User.objects.get(username="17portail")
+        hasher = PBKDF2PasswordHasher()
+        password = hasher.encode("password", hasher.salt(), iterations=1000)
+        User.objects.filter(pk=user.pk).update(password=password)
+
+        self.post(
+            "/login/",
+            {"username": "17portail", "password": "wrong", "audience": "portail"},
+        )
+        self.assertStatusCode(401)
+
+        user.refresh_from_db()
+        self.assertEqual(password, user.password)
+
+
+class TestCalibrateHasherCommand(BaseTestCase):
+    def call(self, *args):
+        output = StringIO()
+        # A few iterations, for the test to be fast.
+        with mock.patch.object(PBKDF2PasswordHasher, "iterations", 10000):
+            call_command("calibrate_hasher", "--samples", "3", *args, stdout=output)
+        return output.getvalue()
+
+    def test_recommendation(self):
+        output = self.call("--target", "1")
+        self.assertIn("pbkdf2_sha256: iterations=10000 takes", output)
+        self.assertRegex(output, r"Recommended settings: PBKDF2_ITERATIONS=\d+000\b")
+
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as directory:
+            env_file = os.path.join(directory, ".env")
+            with open(env_file, "w") as file:
+                file.write("DEBUG=True\nPBKDF2_ITERATIONS=1\n")
+
+            self.call("--target", "1", "--write", "--env-file", env_file)
+
+            with open(env_file) as file:
+                lines = file.read().splitlines()
+
+        self.assertEqual("DEBUG=True", lines[0])
+        self.assertRegex(lines[1], r"^PBKDF2_ITERATIONS=\d+000$")
+        self.assertNotEqual("PBKDF2_ITERATIONS=1", lines[1])
@@ -0,0 +1,220 @@
+import email
+import smtplib
+from io import StringIO
+from unittest import mock
+
+from django.contrib.admin.sites import site
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from sso_server.invitations import (
+    InvitationSender,
+    get_users_to_invite,
+    queue_invitations,
+)
+from sso_server.mail import EmailWorker, get_template_registry
+from sso_server.models import PasswordRecovery, QueuedEmail, User
+from .utils import BaseTestCase
+
+
+def make_smtp():
+    smtp = mock.Mock()
+    smtp.noop.return_value = (250, b"OK")
+    return smtp
+
+
+def get_parts(message: str) -> dict:
+    return {
+        part.get_content_type(): part.get_payload(decode=True).decode()
+        for part in email.message_from_string(message).walk()
+        if not part.is_multipart()
+    }
+
+
+class TestInvitations(BaseTestCase):
+    def setUp(self):
+        super(TestInvitations, self).setUp()
+
+        User.objects.bulk_create(
+            User(
+                username=f"20user{i}",
+                first_name="<First>",
+                last_name=f"Last{i}",
+                email=f"20user{i}@mpt.fr",
+            )
+            for i in range(5)
+        )
+        self.smtp = make_smtp()
+        self.connect = mock.Mock(return_value=self.smtp)
+        self.sleep = mock.Mock()
+
+    def make_sender(self, **kwargs):
+        return InvitationSender(
+            connect=self.connect,
+            sleep=self.sleep,
+            clock=mock.Mock(return_value=0),
+            **kwargs,
+        )
+
+    def test_users_without_password_are_invited(self):
+        self.assertEqual(
+            {f"20user{i}" for i in range(5)},
+            set(get_users_to_invite().values_list("username", flat=True)),
+        )
+
+        report = self.make_sender().send(get_users_to_invite())
+        self.assertEqual(5, report.sent)
+        self.assertEqual(5, PasswordRecovery.objects.filter(is_invitation=True).count())
+
+        # The invited users are not invited again, unless asked to.
+        self.assertFalse(get_users_to_invite())
+        self.assertEqual(5, get_users_to_invite(resend=True).count())
+
+    def test_batches_share_a_connection_and_a_rendering(self):
+        users = list(get_users_to_invite().order_by("username"))
+
+        with mock.patch.object(
+            get_template_registry(),
+            "render",
+            wraps=get_template_registry().render,
+        ) as render, CaptureQueriesContext(connection) as queries:
+            self.make_sender(batch_size=2).send(users)
+
+        self.assertEqual(3, render.call_count)
+        self.assertEqual(1, self.connect.call_count)
+        self.assertEqual(5, self.smtp.sendmail.call_count)
+        self.assertEqual(
+            3,
+            len([query for query in queries if query["sql"].startswith("INSERT")]),
+        )
+
+    def test_email_content(self):
+        user = User.objects.get(username="20user0")
+        self.make_sender().send([user])
+
+        invitation = PasswordRecovery.objects.get(user=user)
+        self.assertTrue(invitation.is_valid)
+        self.assertEqual(PasswordRecovery.INVITATION_LIFETIME, invitation.lifetime)
+
+        destinations, message = self.smtp.sendmail.call_args[0][1:]
+        self.assertEqual(["20user0@mpt.fr"], destinations)
+        parts = get_parts(message)
+        self.assertIn(f"/mot-de-passe/nouveau/{invitation.id}", parts["text/plain"])
+        self.assertIn("Bonjour <First> Last0", parts["text/plain"])
+        self.assertIn(f"/mot-de-passe/nouveau/{invitation.id}", parts["text/html"])
+        self.assertIn("&lt;First&gt; Last0", parts["text/html"])
+        self.assertNotIn("%%", parts["text/html"])
+
+    def test_send_rate(self):
+        now = [0]
+        self.sleep.side_effect = lambda delay: now.__setitem__(0, now[0] + delay)
+
+        InvitationSender(
+            rate=4, connect=self.connect, sleep=self.sleep, clock=lambda: now[0]
+        ).send(get_users_to_invite())
+
+        # Each email waits for a quarter of second after the previous one.
+        self.assertEqual([mock.call(0.25)] * 4, self.sleep.call_args_list)
+        self.assertEqual(1, now[0])
+
+    def test_refused_recipient_does_not_stop_the_invitations(self):
+        self.smtp.sendmail.side_effect = [
+            None,
+            smtplib.SMTPRecipientsRefused({"20user1@mpt.fr": (550, b"Unknown")}),
+            None,
+            smtplib.SMTPServerDisconnected("Closed"),
+            None,
+            None,
+        ]
+
+        report = self.make_sender().send(get_users_to_invite().order_by("username"))
+
+        self.assertEqual(4, report.sent)
+        self.assertEqual(["20user1@mpt.fr"], [email for email, _ in report.errors])
+        # The disconnection is recovered with a new connection.
+        self.assertEqual(2, self.connect.call_count)
+
+    def test_failed_invitation_is_sent_again(self):
+        self.smtp.sendmail.side_effect = [
+            None,
+            smtplib.SMTPRecipientsRefused({"20user1@mpt.fr": (550, b"Unknown")}),
+            OSError("Connection reset"),
+            None,
+            None,
+        ]
+        report = self.make_sender().send(get_users_to_invite().order_by("username"))
+        self.assertEqual(3, report.sent)
+
+        # The next run only invites the users whose invitation was not sent.
+        self.smtp.sendmail.side_effect = None
+        self.assertEqual(
+            ["20user1", "20user2"],
+            list(
+                get_users_to_invite()
+                .order_by("username")
+                .values_list("username", flat=True)
+            ),
+        )
+        report = self.make_sender().send(get_users_to_invite())
+        self.assertEqual(2, report.sent)
+        self.assertFalse(get_users_to_invite())
+
+    def test_queued_invitations(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(5, queue_invitations(get_users_to_invite(), batch_size=2))
+        self.connect.assert_not_called()
+        self.assertEqual(
+            6,
+            len([query for query in queries if query["sql"].startswith("INSERT")]),
+        )
+        self.assertFalse(get_users_to_invite())
+
+        with mock.patch("sso_server.mail.open_smtp_connection", return_value=self.smtp):
+            worker = EmailWorker(batch_size=10)
+            self.addCleanup(worker.shutdown)
+            self.assertEqual({"sent": 5, "failed": 0}, worker.run_once())
+
+        invitation = PasswordRecovery.objects.get(user__username="20user0")
+        message = next(
+            call[0][2]
+            for call in self.smtp.sendmail.call_args_list
+            if call[0][1] == ["20user0@mpt.fr"]
+        )
+        parts = get_parts(message)
+        self.assertIn(f"/mot-de-passe/nouveau/{invitation.id}", parts["text/html"])
+        self.assertIn("&lt;First&gt; Last0", parts["text/html"])
+
+    def test_admin_action_queues_the_invitations(self):
+        user_admin = site._registry[User]
+        request = RequestFactory().post("/")
+
+        with mock.patch.object(user_admin, "message_user") as message_user:
+            user_admin.invite(request, User.objects.filter(username="20user0"))
+
+        self.connect.assert_not_called()
+        self.assertEqual("20user0@mpt.fr", QueuedEmail.objects.get().to)
+        self.assertIn("1 invitations queued", message_user.call_args[0][1])
+
+    def test_previous_recoveries_are_cancelled(self):
+        user = User.objects.get(username="20user0")
+        recovery = PasswordRecovery.objects.create(user=user)
+
+        self.make_sender().send([user])
+
+        recovery.refresh_from_db()
+        self.assertTrue(recovery.used)
+
+    def test_command(self):
+        output = StringIO()
+        with mock.patch(
+            "sso_server.invitations.open_smtp_connection", return_value=self.smtp
+        ), mock.patch("sso_server.invitations.time.sleep"):
+            call_command("invite_users", "--dry-run", stdout=output)
+            self.assertFalse(self.smtp.sendmail.called)
+
+            call_command("invite_users", "20user0", "20user1", stdout=output)
+
+        self.assertEqual(2, self.smtp.sendmail.call_count)
+        self.assertIn("2 invitations sent, 0 failed.", output.getvalue())
@@ -0,0 +1,132 @@
+from datetime import timedelta
+from io import StringIO
+
+import jwt
+from django.core.management import CommandError, call_command
+from django.utils import timezone
+
+from sso_server.keys import KeyRing
+from sso_server.models import SigningKey
+from sso_server.token import create_token, verify_token
+from sso_server.verification import VerificationCache
+from .utils import BaseTestCase
+
+
+class TestKeyRing(BaseTestCase):
+    def test_token_names_its_key(self):
+        token = create_token(audience="portail", username="17portail")
+
+        kid = jwt.get_unverified_header(token)["kid"]
+        self.assertEqual(KeyRing.get_default_key().kid, kid)
+        self.assertIn(kid, [jwk["kid"] for jwk in KeyRing.get_jwks()["keys"]])
+
+    def test_rotation_keeps_the_outstanding_tokens_valid(self):
+        old_token = create_token(audience="portail", username="17portail")
+
+        staged_key = KeyRing.stage("ES256")
+        # A staged key is published, but does not sign yet.
+        self.assertIn(
+            staged_key.kid, [jwk["kid"] for jwk in KeyRing.get_jwks()["keys"]]
+        )
+        self.assertNotEqual(
+            staged_key.kid,
+            jwt.get_unverified_header(create_token("portail", "17portail"))["kid"],
+        )
+
+        KeyRing.promote(staged_key.kid)
+        new_token = create_token(audience="portail", username="17portail")
+
+        header = jwt.get_unverified_header(new_token)
+        self.assertEqual((staged_key.kid, "ES256"), (header["kid"], header["alg"]))
+        verify_token(new_token)
+        verify_token(old_token)
+
+    def test_retired_key_does_not_verify(self):
+        first_key = KeyRing.stage("EdDSA")
+        KeyRing.promote(first_key.kid)
+        token = create_token(audience="portail", username="17portail")
+
+        KeyRing.promote(KeyRing.stage("EdDSA").kid)
+        verify_token(token)
+
+        KeyRing.retire(first_key.kid)
+        with self.assertRaises(jwt.InvalidSignatureError):
+            verify_token(token)
+        self.assertNotIn(
+            first_key.kid, [jwk["kid"] for jwk in KeyRing.get_jwks()["keys"]]
+        )
+
+    def test_key_retired_by_another_process_is_forgotten_at_reload(self):
+        first_key = KeyRing.stage("EdDSA")
+        KeyRing.promote(first_key.kid)
+        token = create_token(audience="portail", username="17portail")
+        KeyRing.promote(KeyRing.stage("EdDSA").kid)
+        other_token = create_token(audience="portail", username="17portail")
+        verify_token(token)
+        verify_token(other_token)
+
+        # Another process retires the key: this one still has the verification cached.
+        SigningKey.objects.filter(kid=first_key.kid).update(status=SigningKey.RETIRED)
+        verify_token(token)
+
+        # Until it reads the ring again.
+        KeyRing._next_refresh = 0.0
+        with self.assertRaises(jwt.InvalidSignatureError):
+            verify_token(token)
+        self.assertIn(
+            VerificationCache.get_key(other_token), VerificationCache._entries
+        )
+
+    def test_key_promoted_by_another_process_is_found(self):
+        signing_key = KeyRing.stage("ES256")
+        KeyRing.promote(signing_key.kid)
+        token = create_token(audience="portail", username="17portail")
+
+        # Another process, which loaded the ring before the promotion.
+        KeyRing._keys = {KeyRing.get_default_key().kid: KeyRing.get_default_key()}
+
+        self.assertEqual("17portail", verify_token(token)["user"])
+
+    def test_invalid_transitions(self):
+        signing_key = KeyRing.stage("ES256")
+        KeyRing.promote(signing_key.kid)
+
+        with self.assertRaises(ValueError):
+            KeyRing.promote(signing_key.kid)
+        with self.assertRaises(ValueError):
+            KeyRing.retire(signing_key.kid)
+
+
+class TestSigningKeysCommand(BaseTestCase):
+    def call(self, *args):
+        output = StringIO()
+        call_command("signing_keys", *args, stdout=output)
+        return output.getvalue()
+
+    def test_stage_promote_retire(self):
+        # The kids are base64url-encoded and may start with "-": they are passed after "--".
+        self.call("stage", "--algorithm", "ES256")
+        kid = SigningKey.objects.get().kid
+
+        # The audiences may not have fetched the key yet.
+        with self.assertRaises(CommandError):
+            self.call("promote", "--", kid)
+
+        SigningKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        self.call("promote", "--", kid)
+        self.assertEqual(SigningKey.ACTIVE, SigningKey.objects.get().status)
+        self.assertIn(kid, self.call("list"))
+
+        self.call("stage", "--algorithm", "ES256")
+        other_kid = SigningKey.objects.exclude(kid=kid).get().kid
+        self.call("promote", "--force", "--", other_kid)
+
+        # Its tokens are still valid.
+        with self.assertRaises(CommandError):
+            self.call("retire", "--", kid)
+        self.call("retire", "--force", "--", kid)
+        self.assertEqual(SigningKey.RETIRED, SigningKey.objects.get(kid=kid).status)
+
+    def test_unknown_key(self):
+        with self.assertRaises(CommandError):
+            self.call("promote", "piche")
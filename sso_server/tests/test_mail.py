@@ -0,0 +1,181 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.utils import timezone
+
+from sso_server.mail import (
+    EmailQueue,
+    EmailSender,
+    EmailTemplateRegistry,
+    EmailWorker,
+    SMTPConnectionPool,
+    get_template_registry,
+)
+from sso_server.models import QueuedEmail
+from .utils import BaseTestCase
+
+
+def make_smtp(noop_code=250):
+    smtp = mock.Mock()
+    smtp.noop.return_value = (noop_code, b"OK")
+    return smtp
+
+
+class TestSMTPConnectionPool(BaseTestCase):
+    def test_connection_is_reused(self):
+        connect = mock.Mock(side_effect=[make_smtp(), make_smtp()])
+        pool = SMTPConnectionPool(size=2, max_idle=60, connect=connect)
+
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual(1, connect.call_count)
+        second.noop.assert_called_once_with()
+
+    def test_unhealthy_connection_is_replaced(self):
+        connect = mock.Mock(side_effect=[make_smtp(noop_code=421), make_smtp()])
+        pool = SMTPConnectionPool(size=2, max_idle=60, connect=connect)
+
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        self.assertIsNot(first, second)
+        first.quit.assert_called_once_with()
+
+    def test_idle_connection_is_closed(self):
+        connect = mock.Mock(side_effect=[make_smtp(), make_smtp()])
+        pool = SMTPConnectionPool(size=2, max_idle=-1, connect=connect)
+
+        with pool.connection() as first:
+            pass
+        with pool.connection():
+            pass
+
+        self.assertEqual(2, connect.call_count)
+        first.quit.assert_called_once_with()
+        first.noop.assert_not_called()
+
+    def test_connection_is_closed_after_an_error(self):
+        connect = mock.Mock(side_effect=[make_smtp(), make_smtp()])
+        pool = SMTPConnectionPool(size=2, max_idle=60, connect=connect)
+
+        with self.assertRaises(OSError):
+            with pool.connection() as first:
+                raise OSError()
+        with pool.connection() as second:
+            pass
+
+        self.assertIsNot(first, second)
+        first.quit.assert_called_once_with()
+
+
+class TestEmailTemplateRegistry(BaseTestCase):
+    def test_templates_are_compiled_once(self):
+        self.assertIn("password_recovery.html", get_template_registry().templates)
+        self.assertIs(get_template_registry(), get_template_registry())
+
+    def test_render_does_not_read_the_disk(self):
+        registry = EmailTemplateRegistry()
+
+        with mock.patch("builtins.open", side_effect=AssertionError("disk I/O")):
+            text, html = registry.render(
+                "password_recovery", name="Léo", link="https://mpt.fr/reset"
+            )
+
+        self.assertIn("https://mpt.fr/reset", text)
+        self.assertIn("https://mpt.fr/reset", html)
+
+    def test_render_escapes_html_only(self):
+        text, html = get_template_registry().render(
+            "password_recovery", name="<b>", link=""
+        )
+
+        self.assertIn("<b>", text)
+        self.assertIn("&lt;b&gt;", html)
+
+    def test_sendemail_does_not_depend_on_the_working_directory(self):
+        smtp = mock.Mock()
+        cwd = os.getcwd()
+
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                EmailSender("Rezal", smtp=smtp).sendemail(
+                    to="a@mpt.fr",
+                    subject="Subject",
+                    text="",
+                    template_name="password_recovery",
+                    name="Léo",
+                    link="https://mpt.fr/reset",
+                )
+            finally:
+                os.chdir(cwd)
+
+        message = smtp.sendmail.call_args[0][2]
+        self.assertIn("text/plain", message)
+        self.assertIn("text/html", message)
+
+
+class TestEmailQueue(BaseTestCase):
+    def setUp(self):
+        super(TestEmailQueue, self).setUp()
+
+        self.smtp = make_smtp()
+        patcher = mock.patch(
+            "sso_server.mail.open_smtp_connection", return_value=self.smtp
+        )
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.worker = EmailWorker(batch_size=10)
+        self.addCleanup(self.worker.shutdown)
+
+    def test_password_recovery_request_does_not_connect(self):
+        self.post("/password/recover/request/", {"email": "17admin@mpt.fr"})
+        self.assertStatusCode(200)
+
+        self.connect.assert_not_called()
+        email = QueuedEmail.objects.get()
+        self.assertEqual("17admin@mpt.fr", email.to)
+        self.assertEqual(QueuedEmail.PENDING, email.status)
+
+    def test_queued_emails_share_a_connection(self):
+        for i in range(3):
+            EmailQueue.enqueue(
+                "Rezal", to=f"{i}@mpt.fr", subject="Subject", text="Text"
+            )
+
+        self.assertEqual({"sent": 3, "failed": 0}, self.worker.run_once())
+        self.assertEqual(1, self.connect.call_count)
+        self.assertEqual(3, self.smtp.sendmail.call_count)
+        self.assertEqual(3, QueuedEmail.objects.filter(status=QueuedEmail.SENT).count())
+
+    def test_template_is_rendered_by_the_worker(self):
+        self.post("/password/recover/request/", {"email": "17admin@mpt.fr"})
+        self.assertEqual(
+            {"sent": 1, "failed": 0},
+            self.worker.run_once(),
+            QueuedEmail.objects.values_list("last_error", flat=True),
+        )
+
+        destinations, message = self.smtp.sendmail.call_args[0][1:]
+        self.assertEqual(["17admin@mpt.fr"], destinations)
+        self.assertIn("Subject: [Rezal] Nouveau mot de passe", message)
+
+    def test_failed_email_is_retried_later(self):
+        self.smtp.sendmail.side_effect = OSError("down")
+        EmailQueue.enqueue("Rezal", to="a@mpt.fr", subject="Subject", text="Text")
+
+        self.assertEqual({"sent": 0, "failed": 1}, self.worker.run_once())
+
+        email = QueuedEmail.objects.get()
+        self.assertEqual(QueuedEmail.PENDING, email.status)
+        self.assertEqual(1, email.attempts)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertIn("down", email.last_error)
@@ -0,0 +1,58 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import password_validation
+from django.core.management import call_command
+from rest_framework import serializers
+
+from sso_server.models import User
+from sso_server.password_validation import CommonPasswordValidator
+from sso_server.serializers import RecoverPasswordSerializer
+from .utils import BaseTestCase
+
+
+class TestCommonPasswordValidator(BaseTestCase):
+    def test_common_passwords_are_read_once(self):
+        CommonPasswordValidator()
+
+        with mock.patch("gzip.open", side_effect=AssertionError("disk I/O")):
+            validator = CommonPasswordValidator()
+
+        self.assertIsInstance(validator.passwords, frozenset)
+        with self.assertRaises(password_validation.ValidationError):
+            validator.validate("Password")
+
+    def test_validators_are_built_once(self):
+        self.assertIs(
+            password_validation.get_default_password_validators(),
+            password_validation.get_default_password_validators(),
+        )
+
+    def test_reset_validation_uses_the_common_password_set(self):
+        serializer = RecoverPasswordSerializer()
+        serializer._user = User.objects.get(username="17admin")
+        common_passwords = next(
+            validator.passwords
+            for validator in password_validation.get_default_password_validators()
+            if isinstance(validator, CommonPasswordValidator)
+        )
+        self.assertIsInstance(common_passwords, frozenset)
+
+        # The validation neither reads the list again nor builds another set.
+        with mock.patch(
+            "gzip.open", side_effect=AssertionError("disk I/O")
+        ), mock.patch(
+            "sso_server.password_validation.frozenset",
+            side_effect=AssertionError("new set"),
+            create=True,
+        ):
+            serializer.validate_password("unpeuplusdedouzecaracteres")
+            with self.assertRaises(serializers.ValidationError):
+                serializer.validate_password("password1234")
+
+    def test_benchmark_command(self):
+        output = StringIO()
+        call_command("benchmark_password_validation", iterations=2, stdout=output)
+
+        for validators in ("shared", "rebuilt"):
+            self.assertIn(validators, output.getvalue())
@@ -0,0 +1,140 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+
+from sso_server.ratelimit import RateLimitedError, RateLimiter
+from .utils import BaseTestCase
+
+LIMITS = {
+    "login": {
+        "ip": {"LIMIT": 4, "PERIOD": timedelta(minutes=1)},
+        "account": {"LIMIT": 2, "PERIOD": timedelta(minutes=1)},
+    },
+    "password_recovery": {"account": {"LIMIT": 1, "PERIOD": timedelta(minutes=1)}},
+}
+
+
+class TestRateLimiter(BaseTestCase):
+    def setUp(self):
+        super(TestRateLimiter, self).setUp()
+        patcher = mock.patch.dict(RateLimiter.SETTINGS, {"LIMITS": LIMITS})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self, username="17portail", password="password", **extra):
+        return self.client.post(
+            self.api_base + "/login/",
+            {"username": username, "password": password, "audience": "portail"},
+            format="json",
+            **extra,
+        )
+
+    def test_login_is_limited_per_account(self):
+        for _ in range(2):
+            self.assertEqual(401, self.login(password="wrong").status_code)
+
+        res = self.login()
+        self.assertEqual(429, res.status_code)
+        self.assertEqual({"error": {"type": "RATE_LIMITED", "detail": ""}}, res.data)
+        self.assertLessEqual(1, int(res["Retry-After"]))
+
+        # The usernames are case-insensitive.
+        self.assertEqual(429, self.login(username="17PORTAIL").status_code)
+        # The other accounts are not limited.
+        self.assertNotEqual(429, self.login(username="17rezal").status_code)
+
+    def test_login_is_limited_per_client_ip(self):
+        for username in ("17portail", "17rezal", "17admin", "17piche"):
+            self.assertNotEqual(429, self.login(username=username).status_code)
+        self.assertEqual(429, self.login(username="17other").status_code)
+
+        # Another client.
+        res = self.login(username="17other", REMOTE_ADDR="10.0.0.2")
+        self.assertNotEqual(429, res.status_code)
+
+    def test_client_ip_header(self):
+        with mock.patch.dict(
+            RateLimiter.SETTINGS,
+            {"CLIENT_IP_HEADER": "HTTP_X_FORWARDED_FOR", "NUM_PROXIES": 2},
+        ):
+            for i in range(5):
+                # Each request comes from another client, through the same two proxies.
+                res = self.login(
+                    username=f"17user{i}", HTTP_X_FORWARDED_FOR=f"10.0.0.{i}, 10.1.1.1"
+                )
+                self.assertNotEqual(429, res.status_code)
+
+    def test_spoofed_client_ip_header(self):
+        with mock.patch.dict(
+            RateLimiter.SETTINGS,
+            {"CLIENT_IP_HEADER": "HTTP_X_FORWARDED_FOR", "NUM_PROXIES": 1},
+        ):
+            for i in range(4):
+                # The client prepends another address to each request.
+                res = self.login(
+                    username=f"17user{i}", HTTP_X_FORWARDED_FOR=f"1.2.3.{i}, 10.0.0.1"
+                )
+                self.assertNotEqual(429, res.status_code)
+
+            res = self.login(
+                username="17user4", HTTP_X_FORWARDED_FOR="1.2.3.4, 10.0.0.1"
+            )
+            self.assertEqual(429, res.status_code)
+
+            # The requests were counted under the address appended by the proxy.
+            request = mock.Mock(META={"HTTP_X_FORWARDED_FOR": "1.2.3.4, 10.0.0.1"})
+            self.assertEqual("10.0.0.1", RateLimiter.get_client_ip(request))
+
+    def test_password_recovery_is_limited_per_email(self):
+        self.post("/password/recover/request/", {"email": "17portail@mpt.fr"})
+        self.assertStatusCodeIn((200, 400))
+
+        self.post("/password/recover/request/", {"email": "17portail@mpt.fr"})
+        self.assertStatusCode(429)
+
+    def test_sliding_window(self):
+        limit = {"LIMIT": 10, "PERIOD": timedelta(seconds=100)}
+
+        with mock.patch.dict(
+            RateLimiter.SETTINGS, {"LIMITS": {"test": {"ip": limit}}}
+        ), mock.patch("sso_server.ratelimit.time.time") as time:
+            time.return_value = 1000
+            for _ in range(10):
+                RateLimiter.hit("test", ip="1.2.3.4")
+            with self.assertRaises(RateLimitedError) as context:
+                RateLimiter.hit("test", ip="1.2.3.4")
+            self.assertEqual(100, context.exception.retry_after)
+
+            # The 10 requests of the previous window still weigh 7.5 requests.
+            time.return_value = 1125
+            for _ in range(3):
+                RateLimiter.hit("test", ip="1.2.3.4")
+            with self.assertRaises(RateLimitedError) as context:
+                RateLimiter.hit("test", ip="1.2.3.4")
+            # They weigh less than 7 requests after 5 more seconds.
+            self.assertEqual(5, context.exception.retry_after)
+
+            time.return_value = 1131
+            RateLimiter.hit("test", ip="1.2.3.4")
+
+            # Two windows later, the counts are forgotten.
+            time.return_value = 1300
+            for _ in range(10):
+                RateLimiter.hit("test", ip="1.2.3.4")
+
+    def test_shared_backend(self):
+        self.addCleanup(cache.clear)
+
+        with mock.patch.dict(RateLimiter.SETTINGS, {"CACHE_ALIAS": "default"}):
+            for _ in range(2):
+                self.login(password="wrong")
+
+            # Another process shares the counters.
+            RateLimiter.clear()
+            self.assertEqual(429, self.login().status_code)
+
+    def test_disabled(self):
+        with mock.patch.dict(RateLimiter.SETTINGS, {"ENABLED": False}):
+            for _ in range(5):
+                self.assertEqual(401, self.login(password="wrong").status_code)
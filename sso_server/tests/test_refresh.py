@@ -0,0 +1,142 @@
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.utils import timezone
+
+from sso_server.models import Access, PasswordRecovery, RefreshToken, User
+from sso_server.refresh import hash_refresh_token
+from sso_server.token import verify_token
+from .utils import BaseTestCase
+
+
+class TestRefreshToken(BaseTestCase):
+    endpoint = "/token/refresh/"
+
+    def login(self):
+        res = self.post(
+            "/login/",
+            {"username": "17portail", "password": "password", "audience": "portail"},
+        )
+        self.assertStatusCode(200)
+
+        parameters = parse_qs(urlparse(res.data["redirect"]).query)
+        return parameters[settings.JWT_AUTH_SETTINGS["REFRESH_CODE_GET_PARAMETER"]][0]
+
+    def refresh(self, refresh_token):
+        return self.post(self.endpoint, {"refresh_token": refresh_token})
+
+    def assertError(self, error_type):
+        self.assertStatusCode(401)
+        self.assertResponseDataEqual({"error": {"type": error_type, "detail": ""}})
+
+    def test_refresh_token_is_stored_hashed(self):
+        refresh_token = self.login()
+
+        self.assertFalse(RefreshToken.objects.filter(token_hash=refresh_token).exists())
+        self.assertTrue(
+            RefreshToken.objects.filter(
+                token_hash=hash_refresh_token(refresh_token)
+            ).exists()
+        )
+
+    def test_refresh_does_not_hash_the_password(self):
+        refresh_token = self.login()
+
+        with mock.patch.object(User, "check_password") as check:
+            res = self.refresh(refresh_token)
+
+        self.assertStatusCode(200)
+        check.assert_not_called()
+        payload = verify_token(res.data["access"], audience="portail")
+        self.assertEqual("17portail", payload["user"])
+        self.assertNotEqual(refresh_token, res.data["refresh"])
+
+    def test_refresh_code_is_short_lived(self):
+        refresh_code = self.login()
+
+        expires_at = RefreshToken.objects.get(
+            token_hash=hash_refresh_token(refresh_code)
+        ).expires_at
+        self.assertLessEqual(
+            expires_at,
+            timezone.now() + settings.JWT_AUTH_SETTINGS["REFRESH_CODE_LIFETIME"],
+        )
+
+        # The refresh token obtained in exchange lasts longer.
+        refresh_token = self.refresh(refresh_code).data["refresh"]
+        expires_at = RefreshToken.objects.get(
+            token_hash=hash_refresh_token(refresh_token)
+        ).expires_at
+        self.assertGreater(
+            expires_at,
+            timezone.now()
+            + settings.JWT_AUTH_SETTINGS["REFRESH_TOKEN_LIFETIME"]
+            - timedelta(minutes=1),
+        )
+
+    def test_refresh_token_is_rotated(self):
+        refresh_token = self.login()
+        new_refresh_token = self.refresh(refresh_token).data["refresh"]
+
+        self.refresh(new_refresh_token)
+        self.assertStatusCode(200)
+
+    def test_reused_refresh_token_revokes_the_family(self):
+        refresh_token = self.login()
+        new_refresh_token = self.refresh(refresh_token).data["refresh"]
+
+        self.refresh(refresh_token)
+        self.assertError("REFRESH_TOKEN_REUSED")
+
+        self.refresh(new_refresh_token)
+        self.assertError("INVALID_REFRESH_TOKEN")
+
+    def test_expired_refresh_token(self):
+        refresh_token = self.login()
+        RefreshToken.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.refresh(refresh_token)
+        self.assertError("REFRESH_TOKEN_EXPIRED")
+
+    def test_unknown_refresh_token(self):
+        self.refresh("piche")
+        self.assertError("INVALID_REFRESH_TOKEN")
+
+        self.post(self.endpoint, {})
+        self.assertError("INVALID_REFRESH_TOKEN")
+
+    def test_revoked_access_cannot_be_refreshed(self):
+        refresh_token = self.login()
+        Access.objects.filter(user__username="17portail").delete()
+
+        self.refresh(refresh_token)
+        self.assertError("INVALID_AUDIENCE")
+
+    def test_password_reset_revokes_the_refresh_tokens(self):
+        refresh_token = self.refresh(self.login()).data["refresh"]
+        password_recovery = PasswordRecovery.objects.create(
+            user=User.objects.get(username="17portail")
+        )
+
+        self.post(
+            "/password/recover/reset/",
+            {"token": str(password_recovery.id), "password": "aVery$trongPassw0rd"},
+        )
+        self.assertStatusCode(200)
+        self.assertFalse(
+            RefreshToken.objects.filter(user__username="17portail", revoked=False)
+        )
+
+        self.refresh(refresh_token)
+        self.assertError("INVALID_REFRESH_TOKEN")
+
+    def test_deactivated_user_cannot_refresh(self):
+        refresh_token = self.login()
+        user = User.objects.get(username="17portail")
+        user.is_active = False
+        user.save()
+
+        self.refresh(refresh_token)
+        self.assertError("INVALID_AUDIENCE")
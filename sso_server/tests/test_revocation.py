@@ -0,0 +1,149 @@
+import time
+from unittest import mock
+
+import jwt
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from sso_server.models import Access, TokenRevocation, User
+from sso_server.revocation import TokenRevocationList
+from sso_server.token import (
+    RevokedTokenError,
+    create_token,
+    decode_token,
+    verify_token,
+)
+from .utils import BaseTestCase, mess
+
+
+class TestTokenRevocation(BaseTestCase):
+    def setUp(self):
+        super(TestTokenRevocation, self).setUp()
+        self.user = User.objects.get(username="17portail")
+        self.token = create_token(audience="portail", username="17portail")
+
+    def test_revoked_token_is_rejected(self):
+        other_token = create_token(audience="portail", username="17portail")
+
+        TokenRevocationList.revoke_token(decode_token(self.token))
+
+        with self.assertRaises(RevokedTokenError):
+            verify_token(self.token)
+        with self.assertRaises(RevokedTokenError):
+            decode_token(self.token)
+        self.assertEqual("17portail", verify_token(other_token)["user"])
+
+    def test_deactivated_user_tokens_are_rejected(self):
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(RevokedTokenError):
+            verify_token(self.token)
+
+        # The tokens issued after a reactivation are valid.
+        self.user.is_active = True
+        self.user.save()
+        verify_token(create_token(audience="portail", username="17portail"))
+
+    def test_saving_an_active_user_does_not_revoke(self):
+        self.user.first_name = "Piche"
+        self.user.save()
+
+        self.assertFalse(TokenRevocation.objects.exists())
+        verify_token(self.token)
+
+    def test_removed_access_revokes_its_audience_only(self):
+        Access.objects.create(user=self.user, audience="rezal")
+        rezal_token = create_token(audience="rezal", username="17portail")
+
+        Access.objects.get(user=self.user, audience="portail").delete()
+
+        with self.assertRaises(RevokedTokenError):
+            verify_token(self.token)
+        verify_token(rezal_token)
+
+    def test_revocations_are_refreshed_from_the_database(self):
+        TokenRevocationList.revoke_user("17portail")
+        # E.g. another process, which has not seen the revocation yet.
+        TokenRevocationList.clear()
+
+        with self.assertNumQueries(1):
+            with self.assertRaises(RevokedTokenError):
+                verify_token(self.token)
+        # The next checks are made in memory.
+        with self.assertNumQueries(0):
+            with self.assertRaises(RevokedTokenError):
+                verify_token(self.token)
+
+    def test_verify_endpoints_report_revoked_tokens(self):
+        TokenRevocationList.revoke_token(decode_token(self.token))
+
+        self.post("/verify/", {"token": self.token})
+        self.assertStatusCode(400)
+
+        res = self.post("/verify/batch/", {"tokens": [self.token]})
+        self.assertStatusCode(200)
+        self.assertEqual("TOKEN_REVOKED", res.data["results"][0]["error"]["type"])
+
+    def test_forged_token_is_rejected_before_the_revocation_check(self):
+        TokenRevocationList.revoke_user("17portail")
+        # Both revoked, being issued in the second of the revocation, and not signed by the server.
+        forged_token = mess(create_token(audience="portail", username="17portail"))
+
+        res = self.post("/verify/", {"token": forged_token})
+        self.assertStatusCode(400)
+        self.assertEqual(["INVALID_SIGNATURE"], res.data["non_field_errors"])
+
+    def test_token_without_iat_is_revoked_by_any_revocation_of_its_user(self):
+        payload = jwt.decode(self.token, verify=False)
+        del payload["iat"]
+        self.assertFalse(TokenRevocationList.is_revoked(payload))
+
+        TokenRevocationList.revoke_user("17portail", "rezal")
+        self.assertFalse(TokenRevocationList.is_revoked(payload))
+        TokenRevocationList.revoke_user("17portail", "portail")
+        self.assertTrue(TokenRevocationList.is_revoked(payload))
+
+    def test_expired_revocations_are_purged_once_per_interval(self):
+        TokenRevocationList.revoke_user("17portail")
+        TokenRevocation.objects.update(expires_at=timezone.now())
+
+        TokenRevocationList.revoke_user("17admin")
+        self.assertEqual(2, TokenRevocation.objects.count())
+
+        with mock.patch.object(
+            TokenRevocationList,
+            "_next_purge",
+            time.monotonic() - 1,
+        ):
+            TokenRevocationList.revoke_user("17admin")
+        self.assertEqual(
+            {"17admin"}, set(TokenRevocation.objects.values_list("username", flat=True))
+        )
+
+    def test_deleted_users_accesses_revoke_without_loading_the_users(self):
+        Access.objects.create(user=self.user, audience="rezal")
+
+        with CaptureQueriesContext(connection) as context:
+            User.objects.filter(username__in=["17portail", "17rezal"]).delete()
+
+        # The users are only selected by the deletion itself, not again by each of their accesses.
+        user_selects = [
+            query
+            for query in context.captured_queries
+            if query["sql"].startswith("SELECT")
+            and 'FROM "sso_server_user" ' in query["sql"]
+        ]
+        self.assertEqual(1, len(user_selects))
+        self.assertEqual(
+            {("17portail", ""), ("17portail", "portail"), ("17portail", "rezal")},
+            set(
+                TokenRevocation.objects.filter(username="17portail").values_list(
+                    "username", "audience"
+                )
+            ),
+        )
+        self.assertEqual({}, User._deleted_usernames)
+        with self.assertRaises(RevokedTokenError):
+            verify_token(self.token)
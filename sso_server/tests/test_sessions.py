@@ -0,0 +1,152 @@
+from datetime import timedelta
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from sso_server.models import PasswordRecovery, SSOSession, User
+from sso_server.sessions import hash_session_key
+from sso_server.token import verify_token
+from .utils import BaseTestCase
+
+ENABLED_SSO_SESSION_SETTINGS = dict(settings.SSO_SESSION_SETTINGS, ENABLED=True)
+
+
+@override_settings(SSO_SESSION_SETTINGS=ENABLED_SSO_SESSION_SETTINGS)
+class TestSSOSession(BaseTestCase):
+    endpoint = "/session/token/"
+    cookie_name = ENABLED_SSO_SESSION_SETTINGS["COOKIE_NAME"]
+
+    def login(self, username="17admin"):
+        self.post(
+            "/login/",
+            {"username": username, "password": "password", "audience": "portail"},
+        )
+        self.assertStatusCode(200)
+
+    def assertError(self, error_type):
+        self.assertStatusCode(401)
+        self.assertResponseDataEqual({"error": {"type": error_type, "detail": ""}})
+
+    def test_login_sets_a_signed_http_only_cookie(self):
+        self.login()
+
+        cookie = self._res.cookies[self.cookie_name]
+        self.assertTrue(cookie["httponly"])
+        self.assertEqual("Lax", cookie["samesite"])
+
+        # Only the hash of the key is stored, and the cookie is signed.
+        key = cookie.value.split(":")[0]
+        self.assertTrue(SSOSession.objects.filter(key_hash=hash_session_key(key)))
+        self.assertNotEqual(key, cookie.value)
+
+    def test_session_issues_tokens_without_password(self):
+        self.login()
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.post(self.endpoint, {"audience": "rezal"})
+        self.assertStatusCode(200)
+        self.assertFalse(
+            [query for query in queries if "UPDATE" in query["sql"]],
+            msg="The password should not be hashed again.",
+        )
+
+        parameters = parse_qs(urlparse(res.data["redirect"]).query)
+        token = parameters[settings.JWT_AUTH_SETTINGS["GET_PARAMETER"]][0]
+        self.assertEqual("17admin", verify_token(token, audience="rezal")["user"])
+        self.assertNotIn(
+            settings.JWT_AUTH_SETTINGS["REFRESH_CODE_GET_PARAMETER"], parameters
+        )
+
+    def test_session_checks_the_audience(self):
+        self.login("17portail")
+
+        self.post(self.endpoint, {"audience": "rezal"})
+        self.assertError("INVALID_AUDIENCE")
+        self.post(self.endpoint, {})
+        self.assertError("INVALID_AUDIENCE")
+
+    def test_no_or_forged_cookie(self):
+        self.post(self.endpoint, {"audience": "portail"})
+        self.assertError("INVALID_SESSION")
+
+        self.login()
+        key = self._res.cookies[self.cookie_name].value.split(":")[0]
+        self.client.cookies[self.cookie_name] = key + ":forged:signature"
+        self.post(self.endpoint, {"audience": "portail"})
+        self.assertError("INVALID_SESSION")
+
+    def test_expired_session(self):
+        self.login()
+        SSOSession.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.post(self.endpoint, {"audience": "portail"})
+        self.assertError("INVALID_SESSION")
+
+    def test_inactive_user(self):
+        self.login()
+        User.objects.filter(username="17admin").update(is_active=False)
+
+        self.post(self.endpoint, {"audience": "portail"})
+        self.assertError("INVALID_SESSION")
+
+    def test_revoked_session(self):
+        self.login()
+        SSOSession.objects.update(revoked=True)
+
+        self.post(self.endpoint, {"audience": "portail"})
+        self.assertError("INVALID_SESSION")
+
+    def test_logout(self):
+        self.login()
+        self.post("/logout/")
+        self.assertStatusCode(204)
+        self.assertEqual("", self._res.cookies[self.cookie_name].value)
+        self.assertTrue(SSOSession.objects.get().revoked)
+
+        self.post(self.endpoint, {"audience": "portail"})
+        self.assertError("INVALID_SESSION")
+
+    def test_logout_of_all_sessions(self):
+        self.login()
+        self.login()
+
+        self.post("/logout/")
+        self.assertEqual(1, SSOSession.objects.filter(revoked=False).count())
+
+        with override_settings(
+            SSO_SESSION_SETTINGS=dict(
+                ENABLED_SSO_SESSION_SETTINGS, LOGOUT_ALL_SESSIONS=True
+            )
+        ):
+            self.login()
+            self.post("/logout/")
+        self.assertFalse(SSOSession.objects.filter(revoked=False))
+
+    def test_password_reset_revokes_the_sessions(self):
+        self.login()
+        password_recovery = PasswordRecovery.objects.create(
+            user=User.objects.get(username="17admin")
+        )
+
+        self.post(
+            "/password/recover/reset/",
+            {"token": str(password_recovery.id), "password": "aVery$trongPassw0rd"},
+        )
+        self.assertStatusCode(200)
+
+        self.post(self.endpoint, {"audience": "portail"})
+        self.assertError("INVALID_SESSION")
+
+    def test_disabled_sessions(self):
+        with override_settings(
+            SSO_SESSION_SETTINGS=dict(ENABLED_SSO_SESSION_SETTINGS, ENABLED=False)
+        ):
+            self.login()
+            self.assertNotIn(self.cookie_name, self._res.cookies)
+
+            self.post(self.endpoint, {"audience": "portail"})
+            self.assertError("INVALID_SESSION")
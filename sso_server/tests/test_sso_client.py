@@ -0,0 +1,198 @@
+from datetime import timedelta
+from unittest import mock
+
+import jwt
+import requests
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from sso_client import JWKSCache, JWKSUnavailableError, TokenVerifier
+from sso_client import middleware
+from sso_server.keys import KeyRing
+from sso_server.token import create_token
+from .utils import BaseTestCase
+
+
+class JWKSSession:
+    """A `requests.Session` which fetches the JSON Web Key Set from the test client."""
+
+    def __init__(self, client):
+        self.client = client
+        self.requests = 0
+        self.is_down = False
+
+    def get(self, url, headers, timeout):
+        self.requests += 1
+        if self.is_down:
+            raise requests.ConnectionError("SSO unreachable")
+
+        response = self.client.get(
+            "/api/v1/.well-known/jwks.json",
+            HTTP_IF_NONE_MATCH=headers.get("If-None-Match", ""),
+        )
+        response.headers = {"ETag": response["ETag"]}
+        response.raise_for_status = lambda: None
+        return response
+
+
+class SSOClientTestCase(BaseTestCase):
+    def setUp(self):
+        super(SSOClientTestCase, self).setUp()
+        self.now = 0
+        self.session = JWKSSession(self.client)
+        self.jwks = JWKSCache(
+            "http://sso/api/v1/.well-known/jwks.json",
+            ttl=60,
+            session=self.session,
+            clock=lambda: self.now,
+        )
+        self.verifier = TokenVerifier("http://sso", audience="portail", jwks=self.jwks)
+
+
+class TestTokenVerifier(SSOClientTestCase):
+    def test_token_is_verified_locally(self):
+        token = create_token(audience="portail", username="17portail")
+
+        for _ in range(3):
+            self.assertEqual("17portail", self.verifier.verify(token)["user"])
+        self.assertEqual(1, self.session.requests)
+
+    def test_claims_are_enforced(self):
+        for token, error in (
+            (create_token("rezal", "17portail"), jwt.InvalidAudienceError),
+            (
+                create_token("portail", "17portail", issuer="piche"),
+                jwt.InvalidIssuerError,
+            ),
+            (
+                create_token("portail", "17portail", lifetime=timedelta(days=-1)),
+                jwt.ExpiredSignatureError,
+            ),
+        ):
+            with self.assertRaises(error):
+                self.verifier.verify(token)
+
+    def test_token_signed_by_another_key_is_rejected(self):
+        signing_key = KeyRing.get_signing_key()
+        token = jwt.encode(
+            {"aud": "portail", "iss": "sso_server", "exp": 2**40},
+            key=signing_key.private_key,
+            algorithm=signing_key.algorithm,
+            headers={"kid": "piche"},
+        ).decode()
+
+        with self.assertRaises(jwt.InvalidSignatureError):
+            self.verifier.verify(token)
+
+    def test_stale_keys_are_fetched_in_background(self):
+        self.verifier.verify(create_token("portail", "17portail"))
+
+        self.now = 61
+        with mock.patch("threading.Thread") as thread:
+            self.verifier.verify(create_token("portail", "17portail"))
+        thread.return_value.start.assert_called_once()
+
+        # The SSO answers 304 Not Modified, the keys are kept.
+        self.jwks.fetch()
+        self.assertEqual(2, self.session.requests)
+        self.verifier.verify(create_token("portail", "17portail"))
+
+    def test_new_key_is_fetched(self):
+        self.verifier.verify(create_token("portail", "17portail"))
+
+        KeyRing.promote(KeyRing.stage("ES256").kid)
+        token = create_token("portail", "17portail")
+
+        self.now = 10
+        self.assertEqual("17portail", self.verifier.verify(token)["user"])
+        self.assertEqual(2, self.session.requests)
+
+    def test_token_without_kid_is_verified_with_the_default_key(self):
+        default_key = KeyRing.get_default_key()
+        token = jwt.encode(
+            {
+                "aud": "portail",
+                "iss": "sso_server",
+                "exp": 2**40,
+                "user": "17portail",
+            },
+            key=default_key.private_key,
+            algorithm=default_key.algorithm,
+        ).decode()
+
+        # The configured key does not sign anymore, but still verifies the tokens without a `kid`.
+        KeyRing.promote(KeyRing.stage("ES256").kid)
+        self.assertNotEqual(default_key.kid, KeyRing.get_jwks()["keys"][0]["kid"])
+
+        self.assertEqual("17portail", self.verifier.verify(token)["user"])
+
+    def test_unreachable_sso_without_cached_keys(self):
+        self.session.is_down = True
+
+        with self.assertRaises(JWKSUnavailableError):
+            self.verifier.verify(create_token("portail", "17portail"))
+        # The SSO is not requested again before `min_refresh_interval`.
+        with self.assertRaises(JWKSUnavailableError):
+            self.verifier.verify(create_token("portail", "17portail"))
+        self.assertEqual(1, self.session.requests)
+
+        self.session.is_down = False
+        self.now = 10
+        self.verifier.verify(create_token("portail", "17portail"))
+
+    def test_unreachable_sso_with_cached_keys(self):
+        token = create_token("portail", "17portail")
+        self.verifier.verify(token)
+
+        self.session.is_down = True
+        self.now = 10
+        # An unknown key cannot be fetched, the cached keys are still used.
+        with self.assertRaises(jwt.InvalidSignatureError):
+            self.verifier.verify(
+                jwt.encode(
+                    {"aud": "portail"}, "secret", headers={"kid": "piche"}
+                ).decode()
+            )
+        self.assertEqual(2, self.session.requests)
+        self.assertEqual("17portail", self.verifier.verify(token)["user"])
+
+
+class TestSSOTokenMiddleware(SSOClientTestCase):
+    def setUp(self):
+        super(TestSSOTokenMiddleware, self).setUp()
+        patcher = mock.patch.object(
+            middleware, "get_verifier", return_value=self.verifier
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(SSO_CLIENT={"COOKIE_NAME": "sso"})
+    def test_claims_are_set(self):
+        sso_middleware = middleware.SSOTokenMiddleware(lambda request: HttpResponse())
+        token = create_token(audience="portail", username="17portail")
+        factory = RequestFactory()
+
+        request = factory.get("/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        sso_middleware(request)
+        self.assertEqual("17portail", request.sso_claims["user"])
+
+        request = factory.get("/")
+        request.COOKIES["sso"] = token
+        sso_middleware(request)
+        self.assertEqual("17portail", request.sso_claims["user"])
+
+        request = factory.get("/", HTTP_AUTHORIZATION="Bearer piche")
+        sso_middleware(request)
+        self.assertIsNone(request.sso_claims)
+        self.assertIsInstance(request.sso_error, jwt.InvalidTokenError)
+
+    @override_settings(SSO_CLIENT={})
+    def test_unreachable_sso(self):
+        sso_middleware = middleware.SSOTokenMiddleware(lambda request: HttpResponse())
+        token = create_token(audience="portail", username="17portail")
+        self.session.is_down = True
+
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(200, sso_middleware(request).status_code)
+        self.assertIsNone(request.sso_claims)
+        self.assertIsInstance(request.sso_error, JWKSUnavailableError)
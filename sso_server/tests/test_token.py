@@ -1,9 +1,27 @@
 from datetime import datetime
+from io import StringIO
+from unittest import mock
 
+import jwt
+from cryptography.hazmat.primitives.serialization import (
+    Encoding,
+    NoEncryption,
+    PrivateFormat,
+    PublicFormat,
+)
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
 
-from sso_server.token import create_token, create_token_for_user, decode_token
-from .utils import BaseTestCase
+from sso_server import keys
+from sso_server.algorithms import generate_private_key
+from sso_server.token import (
+    create_token,
+    create_token_for_user,
+    decode_token,
+    verify_token,
+)
+from .utils import BaseTestCase, mess
 
 
 class TestToken(BaseTestCase):
@@ -16,7 +34,7 @@ class TestToken(BaseTestCase):
             "exp": (
                 datetime.utcnow() + settings.JWT_AUTH_SETTINGS["ACCESS_TOKEN_LIFETIME"]
             ).timestamp(),
-            "iss": "piche",
+            "iss": settings.JWT_AUTH_SETTINGS["ISSUER"],
             "aud": "piche",
             settings.JWT_AUTH_SETTINGS["USER_ID_CLAIM_NAME"]: "17piche",
         }
@@ -40,7 +58,100 @@ class TestToken(BaseTestCase):
             payload[settings.JWT_AUTH_SETTINGS["USER_ID_CLAIM_NAME"]],
         )
 
+    def test_decode_token_checks_the_issuer(self):
+        with self.assertRaises(jwt.InvalidIssuerError):
+            decode_token(
+                create_token(audience="portail", username="17portail", issuer="piche")
+            )
+
+    def test_decode_token_picks_the_key_of_the_kid(self):
+        keys.KeyRing.promote(keys.KeyRing.stage("ES256").kid)
+        token = create_token(audience="portail", username="17portail")
+        self.assertEqual("ES256", jwt.get_unverified_header(token)["alg"])
+
+        self.assertEqual("17portail", decode_token(token)["user"])
+        with self.assertRaises(jwt.InvalidSignatureError):
+            decode_token(mess(token))
+
     def test_if_unknown_audience_then_cannot_create_token(self):
         self.assertRaises(
             ValueError, create_token_for_user, user="piche", audience="piche"
         )
+
+
+class TestSigningAlgorithms(BaseTestCase):
+    def use_keys(self, algorithm, private_key, public_key=None):
+        """Sign and verify the tokens with these keys until the end of the test."""
+
+        public_key = public_key or private_key.public_key()
+        patcher = mock.patch.dict(
+            settings.JWT_AUTH_SETTINGS,
+            {
+                "ALGORITHM": algorithm,
+                "PRIVATE_KEY": private_key.private_bytes(
+                    Encoding.PEM, PrivateFormat.PKCS8, NoEncryption()
+                ).decode(),
+                "PUBLIC_KEY": public_key.public_bytes(
+                    Encoding.PEM, PublicFormat.SubjectPublicKeyInfo
+                ).decode(),
+            },
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        for function in (
+            keys.get_private_key.cache_clear,
+            keys.get_public_key.cache_clear,
+            keys.KeyRing.clear,
+        ):
+            function()
+            self.addCleanup(function)
+
+    def test_sign_and_verify(self):
+        for algorithm in ("RS256", "ES256", "EdDSA"):
+            with self.subTest(algorithm=algorithm):
+                self.use_keys(algorithm, generate_private_key(algorithm))
+                keys.load_keys()
+
+                token = create_token(
+                    audience="portail", username="17admin", algorithm=algorithm
+                )
+
+                self.assertEqual(algorithm, jwt.get_unverified_header(token)["alg"])
+                self.assertEqual("17admin", verify_token(token, "portail")["user"])
+                with self.assertRaises(jwt.InvalidSignatureError):
+                    verify_token(
+                        token[:-4] + ("AAAA" if token[-4:] != "AAAA" else "BBBB")
+                    )
+
+    def test_public_jwk(self):
+        es256_jwk = keys.public_jwk(generate_private_key("ES256").public_key(), "ES256")
+        self.assertEqual(("EC", "P-256"), (es256_jwk["kty"], es256_jwk["crv"]))
+        self.assertEqual({"x", "y"}, {"x", "y"} & set(es256_jwk))
+
+        eddsa_jwk = keys.public_jwk(generate_private_key("EdDSA").public_key(), "EdDSA")
+        self.assertEqual(("OKP", "Ed25519"), (eddsa_jwk["kty"], eddsa_jwk["crv"]))
+        self.assertEqual("EdDSA", eddsa_jwk["alg"])
+
+    def test_key_must_match_the_algorithm(self):
+        self.use_keys("ES256", generate_private_key("EdDSA"))
+
+        with self.assertRaises(ImproperlyConfigured):
+            keys.load_keys()
+
+    def test_keys_must_form_a_pair(self):
+        self.use_keys(
+            "EdDSA",
+            generate_private_key("EdDSA"),
+            generate_private_key("EdDSA").public_key(),
+        )
+
+        with self.assertRaises(ImproperlyConfigured):
+            keys.load_keys()
+
+    def test_benchmark_command(self):
+        output = StringIO()
+        call_command("benchmark_signing", iterations=2, stdout=output)
+
+        for algorithm in ("RS256", "ES256", "EdDSA"):
+            self.assertIn(algorithm, output.getvalue())
@@ -0,0 +1,346 @@
+import io
+import os
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
+
+from sso_server.models import Access, IdentityWebhookDelivery, User
+from sso_server.user_import import (
+    PasswordHasherPool,
+    import_csv,
+    import_users,
+    parse_audiences,
+    validate_csv,
+)
+from sso_server.webhooks import IdentityWebhookOutbox, IdentityWebhookService
+from .utils import BaseTestCase
+
+
+def make_rows(count, audience=("portail",), prefix="19user"):
+    return [
+        {
+            "username": f"{prefix}{i}",
+            "first_name": "First",
+            "last_name": "Last",
+            "email": f"{prefix}{i}@mpt.fr",
+            "audience": list(audience),
+        }
+        for i in range(count)
+    ]
+
+
+class TestImportUsers(BaseTestCase):
+    def test_creates_users_and_accesses(self):
+        report = import_users(make_rows(3, audience=("portail", "rezal")))
+
+        self.assertEqual(3, report.users_created)
+        self.assertEqual(6, report.accesses_created)
+        self.assertEqual(0, report.failed)
+        self.assertEqual(
+            {"portail", "rezal"},
+            set(
+                Access.objects.filter(user__username="19user1").values_list(
+                    "audience", flat=True
+                )
+            ),
+        )
+
+    def test_existing_users_and_accesses_are_skipped(self):
+        import_users(make_rows(2))
+        report = import_users(make_rows(3, audience=("portail", "rezal")))
+
+        self.assertEqual(1, report.users_created)
+        self.assertEqual(2, report.users_skipped)
+        self.assertEqual(4, report.accesses_created)
+        self.assertEqual(2, report.accesses_skipped)
+        self.assertEqual(3, User.objects.filter(username__startswith="19user").count())
+
+    def test_failures_are_reported(self):
+        rows = make_rows(2, audience=("portail", "piche"))
+        rows[1]["email"] = "17admin@mpt.fr"
+
+        report = import_users(rows, start=2)
+
+        self.assertEqual(1, report.users_created)
+        self.assertEqual(1, report.accesses_created)
+        self.assertEqual([2, 3], sorted(row for row, _ in report.errors))
+        self.assertFalse(User.objects.filter(username="19user1").exists())
+
+    def test_duplicated_rows_are_imported_once(self):
+        report = import_users(make_rows(1) + make_rows(1, audience=("rezal",)))
+
+        self.assertEqual(1, report.users_created)
+        self.assertEqual(1, report.users_skipped)
+        self.assertEqual(2, report.accesses_created)
+
+    def test_identities_are_enqueued_without_signals(self):
+        with mock.patch.object(
+            IdentityWebhookService, "IDENTITY_WEBHOOK_URLS", {"portail": "http://p/"}
+        ), mock.patch.object(
+            IdentityWebhookService, "IDENTITY_API_KEYS", {"portail": "key"}
+        ):
+            import_users(make_rows(3, audience=("portail", "rezal")))
+
+        self.assertEqual(
+            ["portail"] * 3,
+            list(IdentityWebhookDelivery.objects.values_list("audience", flat=True)),
+        )
+
+    def test_query_count_does_not_depend_on_the_number_of_rows(self):
+        query_counts = []
+
+        for count, prefix in ((3, "19small"), (60, "19large")):
+            with CaptureQueriesContext(connection) as context:
+                import_users(
+                    make_rows(count, audience=("portail", "rezal"), prefix=prefix)
+                )
+            query_counts.append(len(context.captured_queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+def make_csv(rows, header="username,first_name,last_name,email,audience"):
+    lines = [header] + [
+        f"{row['username']},{row['first_name']},{row['last_name']},{row['email']},"
+        f"\"{row['audience']}\""
+        for row in rows
+    ]
+    return io.BytesIO("\n".join(lines).encode())
+
+
+class TestImportCsv(BaseTestCase):
+    def test_parse_audiences(self):
+        for value in (
+            "['portail','rezal']",
+            "[ 'portail', \"rezal\" ]",
+            "portail,rezal",
+        ):
+            self.assertEqual(["portail", "rezal"], parse_audiences(value))
+        self.assertEqual([], parse_audiences("[]"))
+
+    def test_imports_by_chunks(self):
+        progress = mock.Mock()
+        report = import_csv(make_csv(make_rows(5)), chunk_size=2, progress=progress)
+
+        self.assertEqual(5, report.users_created)
+        self.assertEqual(5, report.accesses_created)
+        self.assertEqual([2, 4, 5], [c[0][0] for c in progress.call_args_list])
+
+    def test_failed_chunk_is_rolled_back(self):
+        csv_file = make_csv(make_rows(4))
+
+        # The second chunk fails after its users are created.
+        with mock.patch.object(
+            IdentityWebhookOutbox,
+            "enqueue_many",
+            side_effect=[None, DatabaseError("Connection lost")],
+        ):
+            report = import_csv(csv_file, chunk_size=2)
+
+        self.assertEqual(2, report.users_created)
+        self.assertEqual([4], [line for line, _ in report.errors])
+        self.assertEqual(
+            ["19user0", "19user1"],
+            sorted(
+                User.objects.filter(username__startswith="19user").values_list(
+                    "username", flat=True
+                )
+            ),
+        )
+
+    def test_only_the_known_columns_are_imported(self):
+        rows = make_rows(1)
+        rows[0].update(is_superuser=True, is_staff=True, promo="2017")
+
+        self.assertEqual(1, import_users(rows).users_created)
+        user = User.objects.get(username="19user0")
+        self.assertFalse(user.is_superuser)
+        self.assertFalse(user.is_staff)
+
+    def test_missing_columns(self):
+        with self.assertRaises(ValueError):
+            import_csv(make_csv([], header="username,email"))
+
+    def test_command(self):
+        call_command(
+            "import_users",
+            os.path.join(settings.BASE_DIR, "examples", "user.csv"),
+            stdout=io.StringIO(),
+        )
+
+        self.assertEqual(
+            {"portail", "rezal"},
+            set(
+                Access.objects.filter(user__username="20audience").values_list(
+                    "audience", flat=True
+                )
+            ),
+        )
+
+
+class TestValidateCsv(BaseTestCase):
+    def test_valid_file(self):
+        report = validate_csv(make_csv(make_rows(5)), chunk_size=2)
+
+        self.assertTrue(report.is_valid)
+        self.assertEqual(5, report.rows)
+
+    def test_errors_are_reported_per_row(self):
+        rows = make_rows(8, audience=("portail",))
+        rows[0]["email"] = "not an email"
+        rows[1]["username"] = rows[2]["username"]
+        rows[3]["email"] = "17admin@mpt.fr"
+        rows[4]["username"] = "17admin"
+        rows[5]["audience"] = ["portail", "piche"]
+        rows[6]["first_name"] = "x" * 31
+        rows[7]["last_name"] = ""
+
+        report = validate_csv(make_csv(rows), chunk_size=3)
+
+        self.assertFalse(report.is_valid)
+        self.assertEqual(
+            [
+                (2, "email"),
+                (4, "username"),
+                (5, "email"),
+                (6, "username"),
+                (7, "audience"),
+                (8, "first_name"),
+                (9, "last_name"),
+            ],
+            sorted((line, column) for line, column, _, _ in report.errors),
+        )
+        self.assertFalse(User.objects.filter(username__startswith="19user").exists())
+
+        lines = report.to_csv().splitlines()
+        self.assertEqual("line,column,value,error", lines[0])
+        self.assertEqual(8, len(lines))
+
+    def test_unknown_columns_are_reported(self):
+        csv_file = make_csv(
+            [dict(row, audience=f"{row['audience']}\",\"True") for row in make_rows(3)],
+            header="username,first_name,last_name,email,audience,is_superuser",
+        )
+
+        report = validate_csv(csv_file, chunk_size=2)
+
+        self.assertEqual([(1, "is_superuser", "", "Unknown column.")], report.errors)
+
+    def test_cells_without_a_column_are_reported(self):
+        csv_file = make_csv(make_rows(3))
+        lines = csv_file.getvalue().decode().split("\n")
+        lines[2] += ",extra"
+        csv_file = io.BytesIO("\n".join(lines).encode())
+
+        report = validate_csv(csv_file)
+
+        self.assertEqual([(3, "", "extra", "Cells without a column.")], report.errors)
+
+    def test_short_rows_are_reported(self):
+        csv_file = make_csv(make_rows(3))
+        lines = csv_file.getvalue().decode().split("\n")
+        # The cells of the missing columns are read as None.
+        lines[2] = "19short1,Piche"
+        lines[3] = "19short2,Piche"
+        csv_file = io.BytesIO("\n".join(lines).encode())
+
+        report = validate_csv(csv_file)
+
+        self.assertEqual(
+            [
+                (3, "email", None, "This value is required."),
+                (3, "last_name", None, "This value is required."),
+                (4, "email", None, "This value is required."),
+                (4, "last_name", None, "This value is required."),
+            ],
+            sorted(report.errors),
+        )
+
+    def test_existing_user_with_same_email_is_valid(self):
+        rows = make_rows(1)
+        rows[0]["username"], rows[0]["email"] = "17admin", "17admin@mpt.fr"
+
+        self.assertTrue(validate_csv(make_csv(rows)).is_valid)
+
+    def test_file_can_be_imported_after_validation(self):
+        csv_file = make_csv(make_rows(3))
+
+        self.assertTrue(validate_csv(csv_file).is_valid)
+        csv_file.seek(0)
+        self.assertEqual(3, import_csv(csv_file).users_created)
+
+
+class TestPasswordImport(BaseTestCase):
+    def make_rows(self, count):
+        rows = make_rows(count)
+        for i, row in enumerate(rows):
+            row["password"] = f"initial password {i}" if i % 2 == 0 else ""
+        return rows
+
+    def test_passwords_are_hashed_on_a_pool(self):
+        with PasswordHasherPool(workers=2) as hasher_pool:
+            report = import_users(self.make_rows(4), hasher_pool=hasher_pool)
+        self.assertEqual(4, report.users_created)
+
+        user = User.objects.get(username="19user2")
+        self.assertTrue(user.password.startswith("pbkdf2_sha256$"))
+        self.assertTrue(user.check_password("initial password 2"))
+        # Without a password, the user has to recover one.
+        self.assertEqual("", User.objects.get(username="19user1").password)
+
+    def test_pool_keeps_the_order(self):
+        passwords = [f"password {i}" for i in range(8)]
+        with PasswordHasherPool(workers=2) as hasher_pool:
+            encoded = hasher_pool.hash(passwords)
+
+        for password, encoded_password in zip(passwords, encoded):
+            self.assertTrue(check_password(password, encoded_password))
+
+    def test_csv_with_passwords(self):
+        csv_file = io.BytesIO(
+            b"username,first_name,last_name,email,audience,password\n"
+            b"19user0,First,Last,19user0@mpt.fr,portail,correct horse battery staple\n"
+            b"19user1,First,Last,19user1@mpt.fr,portail,\n"
+        )
+
+        self.assertTrue(validate_csv(csv_file).is_valid)
+        csv_file.seek(0)
+        report = import_csv(csv_file)
+
+        self.assertEqual(2, report.users_created)
+        self.assertTrue(
+            User.objects.get(username="19user0").check_password(
+                "correct horse battery staple"
+            )
+        )
+
+    def test_weak_passwords_are_reported_without_the_password(self):
+        csv_file = io.BytesIO(
+            b"username,first_name,last_name,email,audience,password\n"
+            b"19user0,First,Last,19user0@mpt.fr,portail,password\n"
+        )
+
+        report = validate_csv(csv_file)
+        self.assertEqual(1, len(report.errors))
+        line, column, value, _ = report.errors[0]
+        self.assertEqual((2, "password", ""), (line, column, value))
+
+    def test_benchmark_command(self):
+        output = io.StringIO()
+        call_command(
+            "benchmark_user_import",
+            "--users",
+            "4",
+            "--workers",
+            "1",
+            "--workers",
+            "2",
+            stdout=output,
+        )
+
+        self.assertEqual(3, len(output.getvalue().splitlines()))
+        self.assertFalse(User.objects.filter(last_name="User", first_name="Benchmark"))
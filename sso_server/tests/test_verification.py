@@ -0,0 +1,67 @@
+import time
+from datetime import timedelta
+from unittest import mock
+
+import jwt
+
+from sso_server.revocation import TokenRevocationList
+from sso_server.token import RevokedTokenError, create_token, verify_token
+from sso_server.verification import VerificationCache
+from .utils import BaseTestCase
+
+
+class TestVerificationCache(BaseTestCase):
+    def setUp(self):
+        super(TestVerificationCache, self).setUp()
+        self.token = create_token(audience="portail", username="17portail")
+
+    def test_signature_is_verified_once(self):
+        verify_token(self.token)
+
+        with mock.patch("jwt.decode", side_effect=AssertionError("verified")):
+            self.assertEqual("17portail", verify_token(self.token)["user"])
+
+        stats = VerificationCache.get_stats()
+        self.assertEqual(
+            (1, 1, 0.5), (stats["hits"], stats["misses"], stats["hit_rate"])
+        )
+
+    def test_audience_is_checked_on_hits(self):
+        verify_token(self.token, audience="portail")
+
+        with self.assertRaises(jwt.InvalidAudienceError):
+            verify_token(self.token, audience="rezal")
+
+    def test_entry_does_not_outlive_the_token(self):
+        token = create_token("portail", "17portail", lifetime=timedelta(seconds=2))
+        verify_token(token)
+
+        _, expires_at, _ = VerificationCache._entries[VerificationCache.get_key(token)]
+        self.assertLessEqual(expires_at, jwt.decode(token, verify=False)["exp"])
+
+        with mock.patch("time.time", return_value=expires_at):
+            self.assertIsNone(VerificationCache.get(token))
+
+    def test_expired_token_is_not_cached(self):
+        VerificationCache.set(self.token, {"exp": time.time() - 1})
+        self.assertIsNone(VerificationCache.get(self.token))
+
+    def test_least_recently_used_token_is_evicted(self):
+        other_token = create_token(audience="portail", username="17portail")
+
+        with mock.patch.object(VerificationCache, "MAX_SIZE", 1):
+            verify_token(self.token)
+            verify_token(other_token)
+
+        self.assertIsNone(VerificationCache.get(self.token))
+        self.assertIsNotNone(VerificationCache.get(other_token))
+        self.assertEqual(1, VerificationCache.get_stats()["evictions"])
+
+    def test_revoked_token_is_invalidated(self):
+        payload = verify_token(self.token)
+
+        TokenRevocationList.revoke_token(payload)
+
+        self.assertIsNone(VerificationCache.get(self.token))
+        with self.assertRaises(RevokedTokenError):
+            verify_token(self.token)
@@ -1,9 +1,18 @@
 from datetime import datetime, timezone
+from unittest import mock
 
+import json
+
+import jwt
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from jwt.algorithms import RSAAlgorithm
 
 from sso_server.models import PasswordRecovery
-from .utils import BaseTestCase
+from sso_server.token import create_token
+from .utils import BaseTestCase, generate_fake_tokens
 
 
 class TestLogin(BaseTestCase):
@@ -86,6 +95,208 @@ class TestLogin(BaseTestCase):
         self.assertStatusCode(200)
         self.assertSetEqual({"redirect"}, set(res.data.keys()))
 
+    def test_login_to_several_audiences(self):
+        payload = {
+            "username": "17admin",
+            "password": "password",
+            "audiences": ["portail", "rezal"],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            res = self.post(self.endpoint, payload)
+        self.assertStatusCode(200)
+        self.assertSetEqual({"redirects"}, set(res.data.keys()))
+        self.assertSetEqual({"portail", "rezal"}, set(res.data["redirects"].keys()))
+
+        # The accesses are read at once, and the refresh tokens are inserted at once.
+        for table in ("sso_server_access", 'INSERT INTO "sso_server_refreshtoken"'):
+            self.assertEqual(
+                1, len([query for query in queries if table in query["sql"]])
+            )
+
+        for audience, url in res.data["redirects"].items():
+            self.assertTrue(
+                url.startswith(settings.JWT_AUTH_SETTINGS["REDIRECT_URLS"][audience])
+            )
+            token = url.split(f"{settings.JWT_AUTH_SETTINGS['GET_PARAMETER']}=")[1]
+            token = token.split("&")[0]
+            self.assertEqual(
+                audience,
+                jwt.decode(token, verify=False)["aud"],
+            )
+
+    def test_login_to_several_audiences_skips_unauthorized_ones(self):
+        payload = {
+            "username": "17portail",
+            "password": "password",
+            "audiences": ["portail", "rezal"],
+        }
+        res = self.post(self.endpoint, payload)
+        self.assertStatusCode(200)
+        self.assertSetEqual({"portail"}, set(res.data["redirects"].keys()))
+
+        payload = {
+            "username": "17portail",
+            "password": "password",
+            "audiences": ["rezal"],
+        }
+        self.post(self.endpoint, payload)
+        self.assertStatusCode(401)
+        self.assertResponseDataEqual(
+            {"error": {"type": "INVALID_AUDIENCE", "detail": ""}}
+        )
+
+    def test_invalid_audiences(self):
+        for audiences in ([], ["piche"], "portail"):
+            payload = {
+                "username": "17admin",
+                "password": "password",
+                "audiences": audiences,
+            }
+            self.post(self.endpoint, payload)
+            self.assertStatusCode(401)
+            self.assertResponseDataEqual(
+                {"error": {"type": "INVALID_AUDIENCE", "detail": ""}}
+            )
+
+
+class TestDecode(BaseTestCase):
+    endpoint = "/verify/"
+
+    def test_valid_token(self):
+        token = create_token(audience="portail", username="17portail")
+
+        res = self.post(self.endpoint, {"token": token})
+        self.assertStatusCode(200)
+        self.assertEqual("17portail", res.data["user"])
+
+        # The signature is only verified once.
+        with mock.patch("jwt.decode", side_effect=AssertionError("verified")):
+            self.post(self.endpoint, {"token": token})
+        self.assertStatusCode(200)
+
+    def test_invalid_tokens(self):
+        tokens = generate_fake_tokens("portail", "17portail")
+        unsigned_token = jwt.encode(
+            jwt.decode(tokens["VALID_17PORTAIL_TOKEN"], verify=False),
+            key=None,
+            algorithm="none",
+        ).decode()
+
+        for token, error_type in (
+            (tokens["INVALID_SIGNATURE_TOKEN"], "INVALID_SIGNATURE"),
+            (tokens["EXPIRED_TOKEN"], "TOKEN_EXPIRED"),
+            (tokens["INVALID_ISSUER_TOKEN"], "INVALID_ISSUER"),
+            (unsigned_token, "INVALID_TOKEN"),
+            ("not-a-token", "INVALID_TOKEN"),
+        ):
+            with self.subTest(error_type=error_type, token=token):
+                self.post(self.endpoint, {"token": token})
+                self.assertStatusCode(400)
+                self.assertResponseDataEqual({"non_field_errors": [error_type]})
+
+
+class TestBatchDecode(BaseTestCase):
+    endpoint = "/verify/batch/"
+
+    def test_no_other_method_than_post(self):
+        for method in (self.get, self.patch, self.put, self.delete):
+            method(self.endpoint)
+            self.assertStatusCode(405)
+
+    def test_invalid_payload(self):
+        for payload in [
+            {},
+            {"tokens": []},
+            {"tokens": "not a list"},
+            {
+                "tokens": ["a"]
+                * (settings.JWT_AUTH_SETTINGS["VERIFY_BATCH_MAX_SIZE"] + 1)
+            },
+            {"tokens": ["a"], "audience": "piche"},
+        ]:
+            self.post(self.endpoint, payload)
+            self.assertStatusCode(400)
+
+    def test_per_token_results(self):
+        tokens = generate_fake_tokens("portail", "17portail")
+        expected_types = {
+            "INVALID_SIGNATURE_TOKEN": "INVALID_SIGNATURE",
+            "EXPIRED_TOKEN": "TOKEN_EXPIRED",
+            "INVALID_ISSUER_TOKEN": "INVALID_ISSUER",
+            "INVALID_AUDIENCE_TOKEN": "INVALID_AUDIENCE",
+        }
+        names = list(expected_types) + ["VALID_17PORTAIL_TOKEN", "VALID_PICHE_TOKEN"]
+
+        res = self.post(
+            self.endpoint,
+            {
+                "tokens": [tokens[name] for name in names] + ["not a token"],
+                "audience": "portail",
+            },
+        )
+        self.assertStatusCode(200)
+
+        results = dict(zip(names + ["GARBAGE"], res.data["results"]))
+        for name, error_type in expected_types.items():
+            self.assertEqual(error_type, results[name]["error"]["type"], name)
+        self.assertEqual("INVALID_TOKEN", results["GARBAGE"]["error"]["type"])
+        self.assertEqual(
+            "17portail",
+            results["VALID_17PORTAIL_TOKEN"]["claims"][
+                settings.JWT_AUTH_SETTINGS["USER_ID_CLAIM_NAME"]
+            ],
+        )
+        self.assertEqual(
+            "piche",
+            results["VALID_PICHE_TOKEN"]["claims"][
+                settings.JWT_AUTH_SETTINGS["USER_ID_CLAIM_NAME"]
+            ],
+        )
+
+    def test_audience_is_optional(self):
+        token = generate_fake_tokens("rezal", "17rezal")["INVALID_AUDIENCE_TOKEN"]
+        res = self.post(self.endpoint, {"tokens": [token, token]})
+        self.assertStatusCode(200)
+        self.assertEqual(2, len(res.data["results"]))
+        self.assertEqual("piche", res.data["results"][1]["claims"]["aud"])
+
+
+class TestJWKS(BaseTestCase):
+    endpoint = "/.well-known/jwks.json"
+
+    def test_no_other_method_than_get(self):
+        for method in (self.post, self.patch, self.put, self.delete):
+            method(self.endpoint)
+            self.assertStatusCode(405)
+
+    def test_published_key_verifies_tokens(self):
+        res = self.get(self.endpoint)
+        self.assertStatusCode(200)
+        self.assertEqual(1, len(res.data["keys"]))
+
+        jwk = res.data["keys"][0]
+        self.assertEqual("RSA", jwk["kty"])
+        self.assertEqual("sig", jwk["use"])
+
+        token = create_token(audience="portail", username="17portail")
+        payload = jwt.decode(
+            token,
+            key=RSAAlgorithm.from_jwk(json.dumps(jwk)),
+            algorithms=[jwk["alg"]],
+            audience="portail",
+        )
+        self.assertEqual("portail", payload["aud"])
+
+    def test_cache_headers(self):
+        res = self.get(self.endpoint)
+        self.assertIn("public", res["Cache-Control"])
+        self.assertIn("max-age=", res["Cache-Control"])
+
+        self._res = self.client.get(
+            self.api_base + self.endpoint, HTTP_IF_NONE_MATCH=res["ETag"]
+        )
+        self.assertStatusCode(304)
+
 
 class TestRequestPasswordRecovery(BaseTestCase):
     endpoint = "/password/recover/request/"
@@ -0,0 +1,313 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.utils import timezone
+from requests import ConnectionError
+
+from sso_server.models import Access, IdentityWebhookDelivery, User
+from sso_server.webhooks import (
+    CircuitBreaker,
+    CircuitOpenError,
+    IdentityWebhookOutbox,
+    IdentityWebhookService,
+    IdentityWebhookWorker,
+)
+from .utils import BaseTestCase
+
+
+class WebhookTestCase(BaseTestCase):
+    """Configure a webhook for the `portail` audience only."""
+
+    def setUp(self):
+        super(WebhookTestCase, self).setUp()
+
+        for name, value in (
+            ("IDENTITY_WEBHOOK_URLS", {"portail": "http://portail.test/hook/"}),
+            ("IDENTITY_API_KEYS", {"portail": "key"}),
+        ):
+            patcher = mock.patch.object(IdentityWebhookService, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(IdentityWebhookService.reset_clients)
+
+        self.user = User.objects.create(
+            username="18new", email="18new@mpt.fr", first_name="New", last_name="User"
+        )
+
+
+class TestCircuitBreaker(BaseTestCase):
+    def setUp(self):
+        self.now = 0
+        self.breaker = CircuitBreaker(
+            failure_threshold=3,
+            recovery_timeout=30,
+            half_open_max_calls=1,
+            clock=lambda: self.now,
+        )
+
+    def open_breaker(self):
+        for _ in range(3):
+            self.assertTrue(self.breaker.allow_request())
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+        self.breaker.record_success()
+
+        self.open_breaker()
+        self.assertEqual(CircuitBreaker.OPEN, self.breaker.state)
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(1, self.breaker.get_stats()["rejected"])
+
+    def test_half_open_probe_closes_on_success(self):
+        self.open_breaker()
+        self.now = 30
+        self.assertEqual(CircuitBreaker.HALF_OPEN, self.breaker.state)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+
+        self.breaker.record_success()
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+        self.assertEqual(
+            {"opened": 1, "closed": 1},
+            {k: self.breaker.get_stats()[k] for k in ("opened", "closed")},
+        )
+
+    def test_half_open_probe_opens_on_failure(self):
+        self.open_breaker()
+        self.now = 30
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, self.breaker.state)
+
+        self.now = 59
+        self.assertFalse(self.breaker.allow_request())
+        self.now = 60
+        self.assertTrue(self.breaker.allow_request())
+
+
+class TestIdentityWebhookOutbox(WebhookTestCase):
+    def test_creating_access_does_not_call_the_audience(self):
+        with mock.patch("requests.Session.post") as post:
+            Access.objects.create(user=self.user, audience="portail")
+            Access.objects.create(user=self.user, audience="rezal")
+
+        post.assert_not_called()
+        delivery = IdentityWebhookDelivery.objects.get()
+        self.assertEqual("portail", delivery.audience)
+        self.assertEqual(self.user, delivery.user)
+        self.assertEqual(IdentityWebhookDelivery.PENDING, delivery.status)
+
+    def test_updating_access_does_not_enqueue(self):
+        access = Access.objects.create(user=self.user, audience="portail")
+        access.save()
+        self.assertEqual(1, IdentityWebhookDelivery.objects.count())
+
+    def test_loading_fixtures_does_not_enqueue(self):
+        access = Access(user=self.user, audience="portail")
+        # As saved by `loaddata`.
+        access.save_base(raw=True)
+
+        self.assertFalse(IdentityWebhookDelivery.objects.exists())
+
+    def test_retry_delay_is_exponential_and_bounded(self):
+        delays = [IdentityWebhookOutbox.get_retry_delay(n) for n in range(1, 20)]
+        self.assertEqual(delays[1], 2 * delays[0])
+        self.assertEqual(
+            IdentityWebhookOutbox.SETTINGS["MAX_RETRY_BACKOFF"], delays[-1]
+        )
+
+
+class TestIdentityWebhookWorker(WebhookTestCase):
+    def setUp(self):
+        super(TestIdentityWebhookWorker, self).setUp()
+        Access.objects.create(user=self.user, audience="portail")
+        self.worker = IdentityWebhookWorker(batch_size=10, concurrency=2)
+        self.addCleanup(self.worker.shutdown)
+
+    def test_successful_delivery(self):
+        with mock.patch("requests.Session.post") as post:
+            post.return_value.status_code = 201
+            counts = self.worker.run_once()
+
+        self.assertEqual({"delivered": 1, "failed": 0, "postponed": 0}, counts)
+        self.assertEqual("18new", post.call_args[1]["json"]["username"], post.call_args)
+
+        delivery = IdentityWebhookDelivery.objects.get()
+        self.assertEqual(IdentityWebhookDelivery.DELIVERED, delivery.status)
+        self.assertIsNotNone(delivery.delivered_at)
+
+        # Nothing left to send.
+        self.assertEqual(
+            {"delivered": 0, "failed": 0, "postponed": 0}, self.worker.run_once()
+        )
+
+    def test_failed_delivery_is_retried_later(self):
+        with mock.patch("requests.Session.post") as post:
+            post.return_value.status_code = 500
+            counts = self.worker.run_once()
+
+        self.assertEqual({"delivered": 0, "failed": 1, "postponed": 0}, counts)
+        delivery = IdentityWebhookDelivery.objects.get()
+        self.assertEqual(IdentityWebhookDelivery.PENDING, delivery.status)
+        self.assertEqual(1, delivery.attempts)
+        self.assertGreater(delivery.next_attempt_at, timezone.now())
+
+        # The delivery is not due yet.
+        self.assertEqual(
+            {"delivered": 0, "failed": 0, "postponed": 0}, self.worker.run_once()
+        )
+
+    def test_delivery_is_given_up_after_max_attempts(self):
+        IdentityWebhookDelivery.objects.update(
+            attempts=IdentityWebhookOutbox.SETTINGS["MAX_ATTEMPTS"] - 1
+        )
+
+        with mock.patch("requests.Session.post", side_effect=ConnectionError("down")):
+            self.worker.run_once()
+
+        delivery = IdentityWebhookDelivery.objects.get()
+        self.assertEqual(IdentityWebhookDelivery.FAILED, delivery.status)
+        self.assertIn("down", delivery.last_error)
+
+    def test_claimed_delivery_is_leased(self):
+        self.assertEqual(1, len(IdentityWebhookOutbox.claim("portail", 10)))
+        self.assertEqual([], IdentityWebhookOutbox.claim("portail", 10))
+
+        IdentityWebhookDelivery.objects.update(
+            next_attempt_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(1, len(IdentityWebhookOutbox.claim("portail", 10)))
+
+    def test_request_uses_policy_timeouts(self):
+        with mock.patch("requests.Session.post") as post:
+            post.return_value.status_code = 201
+            self.worker.run_once()
+
+        policy = IdentityWebhookService.get_policy("portail")
+        self.assertEqual(
+            (policy["CONNECT_TIMEOUT"], policy["READ_TIMEOUT"]),
+            post.call_args[1]["timeout"],
+        )
+
+    def test_open_circuit_postpones_deliveries(self):
+        client = IdentityWebhookService.get_client("portail")
+        for _ in range(client.breaker.failure_threshold):
+            client.breaker.record_failure()
+
+        with mock.patch("requests.Session.post") as post:
+            self.assertEqual(
+                {"delivered": 0, "failed": 0, "postponed": 0}, self.worker.run_once()
+            )
+            self.assertRaises(
+                CircuitOpenError,
+                IdentityWebhookService.post_identity,
+                self.user,
+                "portail",
+            )
+
+        post.assert_not_called()
+        delivery = IdentityWebhookDelivery.objects.get()
+        self.assertEqual(0, delivery.attempts)
+        self.assertEqual(IdentityWebhookDelivery.PENDING, delivery.status)
+
+
+class TestBulkIdentityWebhook(WebhookTestCase):
+    def setUp(self):
+        super(TestBulkIdentityWebhook, self).setUp()
+
+        patcher = mock.patch.object(
+            IdentityWebhookService,
+            "IDENTITY_BULK_WEBHOOK_URLS",
+            {"portail": "http://portail.test/hook/bulk/"},
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.users = [self.user] + [
+            User.objects.create(
+                username=f"18new{i}",
+                email=f"18new{i}@mpt.fr",
+                first_name="New",
+                last_name="User",
+            )
+            for i in range(2)
+        ]
+
+        self.worker = IdentityWebhookWorker(batch_size=10, concurrency=2)
+        self.addCleanup(self.worker.shutdown)
+
+    def set_policy(self, **policy):
+        patcher = mock.patch.dict(
+            IdentityWebhookService.SETTINGS["AUDIENCE_POLICIES"], {"portail": policy}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_identities_are_sent_in_batches(self):
+        self.set_policy(BULK_BATCH_SIZE=2, BULK_FLUSH_INTERVAL=timedelta(0))
+        IdentityWebhookOutbox.enqueue_many(
+            Access.objects.bulk_create(
+                Access(user=user, audience="portail") for user in self.users
+            )
+        )
+        self.assertEqual(3, IdentityWebhookDelivery.objects.count())
+
+        with mock.patch("requests.Session.post") as post:
+            post.return_value.status_code = 201
+            counts = self.worker.run_once()
+
+        self.assertEqual({"delivered": 3, "failed": 0, "postponed": 0}, counts)
+        self.assertEqual(
+            [2, 1],
+            sorted((len(c[1]["json"]) for c in post.call_args_list), reverse=True),
+        )
+        self.assertEqual(
+            {"http://portail.test/hook/bulk/"}, {c[0][0] for c in post.call_args_list}
+        )
+        self.assertFalse(
+            IdentityWebhookDelivery.objects.exclude(
+                status=IdentityWebhookDelivery.DELIVERED
+            ).exists()
+        )
+
+    def test_partial_batch_waits_for_the_flush_interval(self):
+        self.set_policy(BULK_BATCH_SIZE=2, BULK_FLUSH_INTERVAL=timedelta(hours=1))
+        Access.objects.create(user=self.users[0], audience="portail")
+
+        with mock.patch("requests.Session.post") as post:
+            post.return_value.status_code = 201
+            self.worker.run_once()
+            post.assert_not_called()
+
+            Access.objects.create(user=self.users[1], audience="portail")
+            self.worker.run_once()
+            self.assertEqual(1, post.call_count)
+
+    def test_failed_batch_fails_every_delivery(self):
+        self.set_policy(BULK_BATCH_SIZE=5, BULK_FLUSH_INTERVAL=timedelta(0))
+        for user in self.users:
+            Access.objects.create(user=user, audience="portail")
+
+        with mock.patch("requests.Session.post") as post:
+            post.return_value.status_code = 400
+            counts = self.worker.run_once()
+
+        self.assertEqual({"delivered": 0, "failed": 3, "postponed": 0}, counts)
+        self.assertEqual(1, post.call_count)
+
+    def test_fallback_to_single_posts(self):
+        with mock.patch.object(
+            IdentityWebhookService, "IDENTITY_BULK_WEBHOOK_URLS", {}
+        ), mock.patch("requests.Session.post") as post:
+            post.return_value.status_code = 201
+            self.assertTrue(
+                IdentityWebhookService.post_identities(self.users, "portail")
+            )
+
+        self.assertEqual(3, post.call_count)
+        self.assertEqual("18new", post.call_args_list[0][1]["json"]["username"])
@@ -1,8 +1,16 @@
 from datetime import timedelta
+from unittest import mock
 
 from rest_framework.test import APITestCase
 
+from sso_server.admission import LoginAdmissionControl
+from sso_server.grants import AudienceGrantCache
+from sso_server.keys import KeyRing
+from sso_server.ratelimit import RateLimiter
+from sso_server.revocation import TokenRevocationList
 from sso_server.token import create_token
+from sso_server.verification import VerificationCache
+from sso_server.webhooks import IdentityWebhookService
 
 
 class BaseTestCase(APITestCase):
@@ -19,6 +27,38 @@ class BaseTestCase(APITestCase):
         super(BaseTestCase, self).__init__(*args, **kwargs)
         self._res = None
 
+    @classmethod
+    def setUpClass(cls):
+        # No identity webhook is configured, whatever the environment, from the loading of the fixtures on. The
+        # webhook tests configure their own.
+        cls._webhooks_patcher = mock.patch.multiple(
+            IdentityWebhookService,
+            IDENTITY_WEBHOOK_URLS={},
+            IDENTITY_BULK_WEBHOOK_URLS={},
+            IDENTITY_API_KEYS={},
+        )
+        cls._webhooks_patcher.start()
+        try:
+            super(BaseTestCase, cls).setUpClass()
+        except Exception:
+            cls._webhooks_patcher.stop()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        super(BaseTestCase, cls).tearDownClass()
+        cls._webhooks_patcher.stop()
+
+    def setUp(self):
+        super(BaseTestCase, self).setUp()
+        # The grants cached by a previous test may have been rolled back.
+        AudienceGrantCache.clear()
+        TokenRevocationList.clear()
+        KeyRing.clear()
+        VerificationCache.clear()
+        LoginAdmissionControl.clear()
+        RateLimiter.clear()
+
     def _prepare_message(self, user_msg):
         msg = ""
 
@@ -5,7 +5,14 @@ import jwt
 from django.conf import settings
 from django.contrib.auth.models import User
 
+from sso_server.keys import KeyRing
 from sso_server.models import Access
+from sso_server.revocation import TokenRevocationList
+from sso_server.verification import VerificationCache
+
+
+class RevokedTokenError(jwt.InvalidTokenError):
+    """The token was revoked before its expiration, see `sso_server.revocation`."""
 
 
 def create_token(
@@ -13,20 +20,34 @@ def create_token(
     username: str,
     lifetime: timedelta = settings.JWT_AUTH_SETTINGS["ACCESS_TOKEN_LIFETIME"],
     issuer: str = settings.JWT_AUTH_SETTINGS["ISSUER"],
-    key: bytes = settings.JWT_AUTH_SETTINGS["PRIVATE_KEY"],
+    key=None,
     algorithm: str = settings.JWT_AUTH_SETTINGS["ALGORITHM"],
 ):
+    """
+    Return a signed token. If `key` is not provided, the token is signed by the active key of the key ring, with its
+    algorithm, and names it in its `kid` header.
+    """
+
+    headers = None
+    if key is None:
+        signing_key = KeyRing.get_signing_key()
+        key, algorithm = signing_key.private_key, signing_key.algorithm
+        headers = {"kid": signing_key.kid}
+
     jti = uuid4().hex
+    now = datetime.utcnow()
 
     payload = {
-        "exp": (datetime.utcnow() + lifetime).timestamp(),
+        "iat": now.timestamp(),
+        "exp": (now + lifetime).timestamp(),
         "iss": issuer,
         "aud": audience,
         "jti": jti,
         settings.JWT_AUTH_SETTINGS["USER_ID_CLAIM_NAME"]: username,
     }
 
-    return jwt.encode(payload=payload, key=key, algorithm=algorithm).decode(
+    token = jwt.encode(payload=payload, key=key, algorithm=algorithm, headers=headers)
+    return token.decode(
         "utf-8"
     )  # jwt.encode returns a bytes object, it thus has to be decoded to a str.
 
@@ -40,11 +61,72 @@ def create_token_for_user(user: User, audience: str) -> str:
     return create_token(audience=str(audience), username=str(user.username))
 
 
+def check_not_revoked(payload: dict) -> dict:
+    if TokenRevocationList.is_revoked(payload):
+        raise RevokedTokenError("The token was revoked.")
+    return payload
+
+
+# The error types reported for a token which does not pass `verify_token`. Subclasses come before their parents.
+TOKEN_ERROR_TYPES = (
+    (RevokedTokenError, "TOKEN_REVOKED"),
+    (jwt.ExpiredSignatureError, "TOKEN_EXPIRED"),
+    (jwt.InvalidSignatureError, "INVALID_SIGNATURE"),
+    (jwt.InvalidAudienceError, "INVALID_AUDIENCE"),
+    (jwt.InvalidIssuerError, "INVALID_ISSUER"),
+    (jwt.InvalidTokenError, "INVALID_TOKEN"),
+)
+
+
+def get_token_error_type(error: jwt.InvalidTokenError) -> str:
+    for error_class, error_type in TOKEN_ERROR_TYPES:
+        if isinstance(error, error_class):
+            return error_type
+
+
+def verify_token(token: str, audience: str = None) -> dict:
+    """
+    Return the payload of the token after checking its signature, its expiration date, its issuer and that it was not
+    revoked. The audience is checked iff `audience` is provided. The signature of a token verified recently is not
+    verified again, see `sso_server.verification`.
+
+    Raise a subclass of `jwt.InvalidTokenError` if the token is not valid.
+    """
+
+    # A due reload of the key ring forgets the cached tokens of the retired keys.
+    KeyRing.refresh()
+    payload = VerificationCache.get(token)
+
+    if payload is None:
+        # The key, and thus the algorithm, are chosen by the `kid` header. The algorithm of the header is not trusted.
+        key = KeyRing.get_verification_key(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            raise jwt.InvalidSignatureError("The token is not signed by a known key.")
+
+        payload = jwt.decode(
+            jwt=token,
+            key=key.public_key,
+            algorithms=[key.algorithm],
+            issuer=settings.JWT_AUTH_SETTINGS["ISSUER"],
+            # The audience is checked below, so that the payload can be cached whatever the audience.
+            options={"verify_aud": False},
+        )
+        VerificationCache.set(token, payload, kid=key.kid)
+
+    if audience is not None:
+        if "aud" not in payload:
+            raise jwt.MissingRequiredClaimError("aud")
+
+        audiences = (
+            payload["aud"] if isinstance(payload["aud"], list) else [payload["aud"]]
+        )
+        if audience not in audiences:
+            raise jwt.InvalidAudienceError("Invalid audience")
+
+    return check_not_revoked(dict(payload))
+
+
 def decode_token(token: str) -> dict:
-    return jwt.decode(
-        jwt=token,
-        key=settings.JWT_AUTH_SETTINGS["PUBLIC_KEY"],
-        algorithms=[settings.JWT_AUTH_SETTINGS["ALGORITHM"]],
-        issuer=settings.JWT_AUTH_SETTINGS["ISSUER"],
-        verify=False,
-    )
+    """Return the payload of the token, verified by `verify_token` whatever its audience."""
+
+    return verify_token(token)
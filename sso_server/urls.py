@@ -1,15 +1,25 @@
 from django.urls import path
 
 from sso_server.views import (
+    BatchDecodeView,
     LoginView,
+    LogoutView,
     DecodeView,
+    JWKSView,
+    RefreshTokenView,
     ResetPasswordView,
     RequestPasswordRecoveryView,
+    SessionTokenView,
 )
 
 urlpatterns = [
     path("login/", LoginView.as_view()),
+    path("logout/", LogoutView.as_view()),
+    path("session/token/", SessionTokenView.as_view()),
+    path("token/refresh/", RefreshTokenView.as_view()),
     path("verify/", DecodeView.as_view()),
+    path("verify/batch/", BatchDecodeView.as_view()),
+    path(".well-known/jwks.json", JWKSView.as_view()),
     path("password/recover/request/", RequestPasswordRecoveryView.as_view()),
     path("password/recover/reset/", ResetPasswordView.as_view()),
 ]
@@ -0,0 +1,461 @@
+"""
+Set-based import of users and of their accesses.
+
+Whatever the number of rows, an import costs a constant number of queries: the existing users and accesses are read
+with one query each, then the new users, the new accesses and their identity webhook deliveries are bulk created.
+
+CSV files are streamed and imported by chunks of `USER_IMPORT_SETTINGS["CHUNK_SIZE"]` rows, each one in its own
+savepoint, so that the memory used does not depend on the size of the file. They can be checked beforehand by
+`validate_csv`, which writes nothing and reports every error.
+
+The optional `password` column holds the initial passwords. They are hashed on a pool of processes, one per core by
+default, before the users are bulk created: see `manage.py benchmark_user_import`.
+"""
+
+import csv
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import password_validation
+from django.contrib.auth.hashers import make_password
+from django.core.validators import EmailValidator
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+
+from sso_server.grants import AudienceGrantCache
+from sso_server.models import Access, User
+from sso_server.webhooks import IdentityWebhookOutbox
+
+
+AUDIENCES = {audience for audience, _ in Access.AUDIENCES}
+# The `User` fields set from the rows. The other fields, e.g. `is_superuser`, cannot be imported.
+USER_COLUMNS = ("username", "first_name", "last_name", "email")
+REQUIRED_COLUMNS = USER_COLUMNS + ("audience",)
+COLUMNS = REQUIRED_COLUMNS + ("password",)
+
+
+@dataclass
+class ImportReport:
+    users_created: int = 0
+    users_skipped: int = 0
+    accesses_created: int = 0
+    accesses_skipped: int = 0
+    # (row number, message) of the rows, or of the accesses, which could not be imported.
+    errors: list = field(default_factory=list)
+
+    @property
+    def failed(self) -> int:
+        return len(self.errors)
+
+    def update(self, other: "ImportReport"):
+        self.users_created += other.users_created
+        self.users_skipped += other.users_skipped
+        self.accesses_created += other.accesses_created
+        self.accesses_skipped += other.accesses_skipped
+        self.errors += other.errors
+
+    def __str__(self):
+        return (
+            f"{self.users_created} users created, {self.users_skipped} already existing. "
+            f"{self.accesses_created} accesses created, {self.accesses_skipped} already existing. "
+            f"{self.failed} failed."
+        )
+
+
+class PasswordHasherPool:
+    """
+    Hash passwords on `workers` processes, `USER_IMPORT_SETTINGS["HASH_WORKERS"]` or one per core by default. The
+    processes are started on first use, and stopped when the pool is closed.
+    """
+
+    def __init__(self, workers: int = None):
+        self.workers = (
+            workers
+            or settings.USER_IMPORT_SETTINGS["HASH_WORKERS"]
+            or os.cpu_count()
+            or 1
+        )
+        self._executor = None
+
+    def hash(self, passwords) -> list:
+        """Return the encoded `passwords`, in the same order."""
+
+        passwords = list(passwords)
+        if self.workers == 1 or len(passwords) < 2:
+            return [make_password(password) for password in passwords]
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        # A few tasks per process, so that they finish at about the same time.
+        chunk_size = max(1, len(passwords) // (4 * self.workers))
+        return list(self._executor.map(make_password, passwords, chunksize=chunk_size))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def import_users(
+    rows, start: int = 0, hasher_pool: PasswordHasherPool = None
+) -> ImportReport:
+    """
+    Create the users and the accesses described by `rows`, an iterable of dicts with the `USER_COLUMNS` and an
+    `audience` list. Their other keys are ignored. `start` is the number of the first row, used in the error messages.
+
+    The `password` of a row, if any, is the initial password of the user. The passwords are hashed by `hasher_pool`,
+    or by a pool of this call.
+
+    A row whose username already exists does not create a user, but its missing accesses are created. A row whose
+    email belongs to another user fails, as well as an unknown audience.
+    """
+
+    if hasher_pool is None:
+        with PasswordHasherPool() as hasher_pool:
+            return import_users(rows, start=start, hasher_pool=hasher_pool)
+
+    report = ImportReport()
+    rows = list(enumerate(rows, start=start))
+
+    usernames = {row["username"] for _, row in rows}
+    emails = {row["email"] for _, row in rows}
+
+    with transaction.atomic():
+        existing = {
+            username: (user_id, email)
+            for username, user_id, email in User.objects.filter(
+                Q(username__in=usernames) | Q(email__in=emails)
+            ).values_list("username", "id", "email")
+        }
+        taken_emails = {email: username for username, (_, email) in existing.items()}
+
+        # Create the new users.
+        new_users = []
+        passwords = []
+        failed_rows = set()
+        for row_number, row in rows:
+            username, email = row["username"], row["email"]
+
+            if username in existing:
+                report.users_skipped += 1
+            elif taken_emails.get(email, username) != username:
+                report.errors.append(
+                    (row_number, f"The email {email} is used by another user.")
+                )
+                failed_rows.add(row_number)
+            else:
+                new_users.append(User(**{k: row[k] for k in USER_COLUMNS}))
+                passwords.append(row.get("password") or "")
+                existing[username] = (None, email)
+                taken_emails[email] = username
+
+        # Without a password, the user has to recover one.
+        users_with_password = [
+            (user, password) for user, password in zip(new_users, passwords) if password
+        ]
+        for (user, _), encoded in zip(
+            users_with_password,
+            hasher_pool.hash(password for _, password in users_with_password),
+        ):
+            user.password = encoded
+
+        User.objects.bulk_create(new_users)
+        report.users_created = len(new_users)
+
+        # Resolve the ids of the new users, and of the users whose row did not fail.
+        user_ids = dict(
+            User.objects.filter(
+                username__in=[user.username for user in new_users]
+            ).values_list("username", "id")
+        )
+        user_ids.update(
+            (username, user_id)
+            for username, (user_id, _) in existing.items()
+            if user_id is not None
+        )
+
+        # Create the new accesses.
+        existing_accesses = set(
+            Access.objects.filter(user_id__in=user_ids.values()).values_list(
+                "user_id", "audience"
+            )
+        )
+        new_accesses = []
+        for row_number, row in rows:
+            user_id = user_ids.get(row["username"])
+            if user_id is None or row_number in failed_rows:
+                continue
+
+            for audience in row["audience"]:
+                if audience not in AUDIENCES:
+                    report.errors.append(
+                        (row_number, f"The audience {audience} does not exist.")
+                    )
+                elif (user_id, audience) in existing_accesses:
+                    report.accesses_skipped += 1
+                else:
+                    new_accesses.append(Access(user_id=user_id, audience=audience))
+                    existing_accesses.add((user_id, audience))
+
+        # Bulk create does not trigger signals: the identities are enqueued and the grants invalidated explicitly.
+        Access.objects.bulk_create(new_accesses, ignore_conflicts=True)
+        IdentityWebhookOutbox.enqueue_many(new_accesses)
+        AudienceGrantCache.invalidate(*{access.user_id for access in new_accesses})
+        report.accesses_created = len(new_accesses)
+
+    return report
+
+
+def parse_audiences(value: str) -> list:
+    """Parse an `audience` cell, written as a Python list (`"['portail','rezal']"`) or as `portail,rezal`."""
+
+    return [
+        audience.strip().strip("'\"").strip()
+        for audience in value.strip().strip("[]").split(",")
+        if audience.strip().strip("'\"").strip()
+    ]
+
+
+def read_csv(file):
+    """
+    Yield the rows of a CSV file of users, opened in binary mode, with their audiences parsed.
+    Raise ValueError if a required column is missing.
+    """
+
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+
+    try:
+        reader = csv.DictReader(text)
+
+        missing_columns = set(REQUIRED_COLUMNS) - set(reader.fieldnames or ())
+        if missing_columns:
+            raise ValueError(f"Missing columns: {', '.join(sorted(missing_columns))}.")
+
+        for row in reader:
+            row["audience"] = parse_audiences(row["audience"] or "")
+            yield row
+    finally:
+        # Do not close `file` when `text` is garbage collected: it may be read again.
+        text.detach()
+
+
+def read_chunks(file, chunk_size: int = None):
+    """Yield `(number of the first line, rows)` for each chunk of `chunk_size` rows of a CSV file of users."""
+
+    chunk_size = chunk_size or settings.USER_IMPORT_SETTINGS["CHUNK_SIZE"]
+    rows = read_csv(file)
+    # The first line of the file is the header.
+    start = 2
+
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+
+        yield start, chunk
+        start += len(chunk)
+
+
+@dataclass
+class ValidationReport:
+    rows: int = 0
+    # (line, column, value, message) of each error.
+    errors: list = field(default_factory=list)
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.errors
+
+    def to_csv(self) -> str:
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(("line", "column", "value", "error"))
+        writer.writerows(sorted(self.errors, key=lambda error: error[0]))
+        return output.getvalue()
+
+    def __str__(self):
+        return f"{self.rows} rows checked, {len(self.errors)} errors."
+
+
+class CsvValidator:
+    """
+    Check a CSV file of users before anything is written. The checks are made column by column on chunks of rows,
+    with one query per chunk for the conflicts with the database:
+
+        * the columns are known;
+        * the required values are present and fit in the `User` fields;
+        * the emails are well-formed;
+        * the usernames and the emails are not duplicated in the file;
+        * an existing username has the same email in the file and in the database, and an existing email belongs to
+          the same username;
+        * the audiences exist;
+        * the initial passwords, if any, pass the password validators.
+    """
+
+    EMAIL_REGEX = EmailValidator.user_regex, EmailValidator.domain_regex
+    MAX_LENGTHS = {
+        column: User._meta.get_field(column).max_length for column in USER_COLUMNS
+    }
+
+    def __init__(self):
+        self.report = ValidationReport()
+        self.usernames = set()
+        self.emails = set()
+        self.unknown_columns = set()
+
+    def error(self, line, column, value, message):
+        self.report.errors.append((line, column, value, message))
+
+    def check_columns(self, lines, rows):
+        for line, row in zip(lines, rows):
+            for column in row.keys() - set(COLUMNS) - self.unknown_columns:
+                if column is None:
+                    # The cells beyond the header.
+                    self.error(line, "", ",".join(row[None]), "Cells without a column.")
+                    continue
+
+                # Reported once, on the header line.
+                self.unknown_columns.add(column)
+                self.error(1, column, "", "Unknown column.")
+
+    def check_values(self, lines, rows):
+        for column, max_length in self.MAX_LENGTHS.items():
+            for line, value in zip(lines, (row[column] for row in rows)):
+                if not value:
+                    self.error(line, column, value, "This value is required.")
+                elif len(value) > max_length:
+                    self.error(
+                        line, column, value, f"Longer than {max_length} characters."
+                    )
+
+    def check_emails(self, lines, rows):
+        user_regex, domain_regex = self.EMAIL_REGEX
+
+        for line, email in zip(lines, (row["email"] for row in rows)):
+            # A missing email, e.g. of a short row, is reported by `check_values`.
+            if not email:
+                continue
+
+            user_part, _, domain_part = email.rpartition("@")
+            if not (
+                user_part
+                and user_regex.match(user_part)
+                and domain_regex.match(domain_part)
+            ):
+                self.error(line, "email", email, "Invalid email address.")
+
+    def check_duplicates(self, lines, rows):
+        for column, seen in (("username", self.usernames), ("email", self.emails)):
+            for line, value in zip(lines, (row[column] for row in rows)):
+                if not value:
+                    continue
+                if value in seen:
+                    self.error(line, column, value, "Duplicated in the file.")
+                seen.add(value)
+
+    def check_database(self, lines, rows):
+        usernames = {row["username"] for row in rows}
+        emails = {row["email"] for row in rows}
+        existing = User.objects.filter(
+            Q(username__in=usernames) | Q(email__in=emails)
+        ).values_list("username", "email")
+        email_of = {username: email for username, email in existing}
+        username_of = {email: username for username, email in email_of.items()}
+
+        for line, row in zip(lines, rows):
+            username, email = row["username"], row["email"]
+
+            if email_of.get(username, email) != email:
+                self.error(
+                    line,
+                    "username",
+                    username,
+                    f"Already exists, with the email {email_of[username]}.",
+                )
+            if username_of.get(email, username) != username:
+                self.error(
+                    line, "email", email, f"Already used by {username_of[email]}."
+                )
+
+    def check_audiences(self, lines, rows):
+        for line, audiences in zip(lines, (row["audience"] for row in rows)):
+            for audience in set(audiences) - AUDIENCES:
+                self.error(line, "audience", audience, "Unknown audience.")
+
+    def check_passwords(self, lines, rows):
+        for line, row in zip(lines, rows):
+            if not row.get("password"):
+                continue
+
+            user = User(**{column: row[column] for column in USER_COLUMNS})
+            try:
+                password_validation.validate_password(row["password"], user=user)
+            except password_validation.ValidationError as e:
+                # The password itself is not written in the report.
+                self.error(line, "password", "", " ".join(e.messages))
+
+    def validate_chunk(self, start, rows):
+        lines = range(start, start + len(rows))
+
+        self.check_columns(lines, rows)
+        self.check_values(lines, rows)
+        self.check_emails(lines, rows)
+        self.check_duplicates(lines, rows)
+        self.check_database(lines, rows)
+        self.check_audiences(lines, rows)
+        self.check_passwords(lines, rows)
+
+        self.report.rows += len(rows)
+
+
+def validate_csv(file, chunk_size: int = None) -> ValidationReport:
+    """Check a CSV file of users, opened in binary mode, without writing anything. Raise ValueError if a column is
+    missing."""
+
+    validator = CsvValidator()
+
+    for start, rows in read_chunks(file, chunk_size):
+        validator.validate_chunk(start, rows)
+
+    return validator.report
+
+
+def import_csv(file, chunk_size: int = None, progress=None) -> ImportReport:
+    """
+    Import a CSV file of users, opened in binary mode, by chunks of `chunk_size` rows. A chunk which cannot be
+    imported is rolled back to its savepoint and reported, and the import goes on with the next chunk.
+
+    `progress`, if provided, is called with the number of rows read and the report so far after each chunk.
+    """
+
+    report = ImportReport()
+    rows_read = 0
+
+    with transaction.atomic(), PasswordHasherPool() as hasher_pool:
+        for start, chunk in read_chunks(file, chunk_size):
+            try:
+                report.update(import_users(chunk, start=start, hasher_pool=hasher_pool))
+            except (DatabaseError, TypeError, ValueError) as e:
+                report.errors.append(
+                    (
+                        start,
+                        f"Lines {start} to {start + len(chunk) - 1} not imported: {e}",
+                    )
+                )
+
+            rows_read += len(chunk)
+            if progress is not None:
+                progress(rows_read, report)
+
+    return report
@@ -0,0 +1,122 @@
+"""
+Cache of the results of the token verifications.
+
+The audiences verify the same token again and again during its lifetime. Once a token has been verified, its payload is
+kept in an in-process LRU cache, keyed by the SHA-256 hash of the token, until the token expires or for at most
+`JWT_AUTH_SETTINGS["VERIFICATION_CACHE_MAX_TTL"]`. The expiration, the audience and the revocation are still checked on
+every verification, without verifying the signature again.
+
+The tokens verified with a key which leaves the key ring are forgotten when each process reloads the ring, every
+`JWT_AUTH_SETTINGS["KEY_RING_REFRESH_INTERVAL"]`.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class VerificationCache:
+    MAX_SIZE: int = settings.JWT_AUTH_SETTINGS["VERIFICATION_CACHE_SIZE"]
+    MAX_TTL: float = settings.JWT_AUTH_SETTINGS[
+        "VERIFICATION_CACHE_MAX_TTL"
+    ].total_seconds()
+
+    # Hash of the token -> (payload, expiration timestamp, kid of the verification key), the least recently used first.
+    _entries: OrderedDict = OrderedDict()
+    # jti -> hash of the token.
+    _jtis: dict = {}
+    _lock = threading.Lock()
+
+    hits = 0
+    misses = 0
+    evictions = 0
+
+    @staticmethod
+    def get_key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    @classmethod
+    def _remove(cls, key):
+        payload, _, _ = cls._entries.pop(key)
+        cls._jtis.pop(payload.get("jti"), None)
+
+    @classmethod
+    def get(cls, token: str):
+        """Return the payload of a verified token, or None if it is not in the cache or has expired."""
+
+        key = cls.get_key(token)
+
+        with cls._lock:
+            entry = cls._entries.get(key)
+
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    cls._remove(key)
+                cls.misses += 1
+                return None
+
+            cls._entries.move_to_end(key)
+            cls.hits += 1
+            return entry[0]
+
+    @classmethod
+    def set(cls, token: str, payload: dict, kid: str = None):
+        """Cache the payload of a token verified with the key `kid`, until its expiration."""
+
+        expires_at = min(payload.get("exp", 0), time.time() + cls.MAX_TTL)
+        if expires_at <= time.time():
+            return
+
+        key = cls.get_key(token)
+
+        with cls._lock:
+            cls._entries[key] = (payload, expires_at, kid)
+            cls._entries.move_to_end(key)
+            if payload.get("jti"):
+                cls._jtis[payload["jti"]] = key
+
+            while len(cls._entries) > cls.MAX_SIZE:
+                cls._remove(next(iter(cls._entries)))
+                cls.evictions += 1
+
+    @classmethod
+    def invalidate_jti(cls, jti: str):
+        with cls._lock:
+            key = cls._jtis.get(jti)
+            if key is not None:
+                cls._remove(key)
+
+    @classmethod
+    def forget_keys(cls, kids):
+        """Forget the tokens verified with the keys `kids`, e.g. retired."""
+
+        kids = set(kids)
+
+        with cls._lock:
+            for key in [key for key, entry in cls._entries.items() if entry[2] in kids]:
+                cls._remove(key)
+
+    @classmethod
+    def clear(cls):
+        """Forget the verified tokens and reset the statistics."""
+
+        with cls._lock:
+            cls._entries.clear()
+            cls._jtis.clear()
+            cls.hits = cls.misses = cls.evictions = 0
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        lookups = cls.hits + cls.misses
+
+        return {
+            "size": len(cls._entries),
+            "max_size": cls.MAX_SIZE,
+            "hits": cls.hits,
+            "misses": cls.misses,
+            "hit_rate": cls.hits / lookups if lookups else 0.0,
+            "evictions": cls.evictions,
+        }
@@ -1,18 +1,43 @@
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.core.validators import EmailValidator
+from django.db import transaction
+from django.utils.cache import patch_cache_control
 from rest_framework import views, status
 from rest_framework.response import Response
 
+from sso_server.admission import LoginOverloadedError
+from sso_server.keys import get_jwks, get_jwks_etag
 from sso_server.models import PasswordRecovery, User
+from sso_server.ratelimit import RateLimitedError, RateLimiter
+from sso_server.refresh import revoke_user_refresh_tokens
 from sso_server.serializers import (
+    BatchDecodeTokenSerializer,
     CreateTokenSerializer,
     DecodeTokenSerializer,
     RecoverPasswordSerializer,
     PasswordRecoverySerializer,
+    RefreshTokenSerializer,
+    SessionTokenSerializer,
 )
+from sso_server.sessions import (
+    create_session,
+    delete_session_cookie,
+    get_session_key,
+    revoke_session,
+    revoke_user_sessions,
+    set_session_cookie,
+)
+
+from sso_server.mail import EmailQueue, get_password_recovery_email
+
 
-from sso_server.mail import EmailSender
+def get_rate_limited_response(error: RateLimitedError):
+    return Response(
+        {"error": {"type": "RATE_LIMITED", "detail": ""}},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(error.retry_after)},
+    )
 
 
 class LoginView(views.APIView):
@@ -27,6 +52,13 @@ class LoginView(views.APIView):
             "audience": ""
         }
 
+        or, to log in to several audiences at once:
+        {
+            "username": "",
+            "password": "",
+            "audiences": ["", ...]
+        }
+
     Errors:
         Return 401 and:
         {
@@ -38,23 +70,54 @@ class LoginView(views.APIView):
 
         The type of the error can be:
             * INVALID_CREDENTIALS if username or password are missing or cannot authenticate an user.
-            * INVALID_AUDIENCE if audience is missing or the user is not allowed to access the audience.
+            * INVALID_AUDIENCE if audience is missing or the user is not allowed to access the audience, or to any of
+              the audiences.
             * UNKNOWN_ERROR for another error. In that case, detail will contain more information about the error.
 
+        Return 503, with the same body and the type LOGIN_OVERLOADED, if too many logins are in progress, and 429,
+        with the type RATE_LIMITED, if too many attempts were made from the client IP or for the username. The
+        `Retry-After` header tells when to try again.
+
     Success:
         Return 200 and:
          {
             "redirect": "https://…"
          }
+
+        The redirect URL carries the access token and a refresh code. The code only lasts `REFRESH_CODE_LIFETIME`: the
+        audience exchanges it from its backend at `token/refresh/`, as `refresh_token`, for a refresh token.
+
+        If `audiences` was provided, return 200 and the redirect URLs of the audiences the user is allowed to access:
+         {
+            "redirects": {"portail": "https://…", ...}
+         }
     """
 
     permission_classes = ()
     authentication_classes = ()
 
     def post(self, request, *args, **kwargs):
+        try:
+            RateLimiter.hit(
+                "login",
+                ip=RateLimiter.get_client_ip(request),
+                account=str(request.data.get("username", "")).lower(),
+            )
+        except RateLimitedError as e:
+            return get_rate_limited_response(e)
+
         serializer = CreateTokenSerializer(data=request.data)
 
-        if not serializer.is_valid():
+        try:
+            is_valid = serializer.is_valid()
+        except LoginOverloadedError as e:
+            return Response(
+                {"error": {"type": "LOGIN_OVERLOADED", "detail": ""}},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+
+        if not is_valid:
             print(serializer.errors)
             if "non_field_errors" in serializer.errors:
                 error_type = serializer.errors["non_field_errors"][0]
@@ -64,7 +127,7 @@ class LoginView(views.APIView):
                         {"error": {"type": error_type, "detail": ""}},
                         status=status.HTTP_401_UNAUTHORIZED,
                     )
-            elif "audience" in serializer.errors:
+            elif "audience" in serializer.errors or "audiences" in serializer.errors:
                 return Response(
                     {"error": {"type": "INVALID_AUDIENCE", "detail": ""}},
                     status=status.HTTP_401_UNAUTHORIZED,
@@ -80,19 +143,215 @@ class LoginView(views.APIView):
                 status=status.HTTP_401_UNAUTHORIZED,
             )
 
-        audience = serializer.validated_data["audience"]
-        token = serializer.validated_data["token"]  # The JWT token.
+        redirect_urls = {
+            audience: self.get_redirect_url(audience, token, refresh_code)
+            for audience, (token, refresh_code) in serializer.validated_data[
+                "tokens"
+            ].items()
+        }
+
+        if "audiences" in serializer.validated_data:
+            response = Response({"redirects": redirect_urls}, status=status.HTTP_200_OK)
+        else:
+            response = Response(
+                {"redirect": redirect_urls[serializer.validated_data["audience"]]},
+                status=status.HTTP_200_OK,
+            )
+
+        if settings.SSO_SESSION_SETTINGS["ENABLED"]:
+            set_session_cookie(
+                response, create_session(serializer.validated_data["user"])
+            )
+
+        return response
+
+    @staticmethod
+    def get_redirect_url(audience, token, refresh_code=None):
+        """Compute the redirect URL with the JWT token and the refresh code, if any, as GET parameters."""
 
-        # Compute the redirect URL with the JWT token as a GET parameter.
         base_url = settings.JWT_AUTH_SETTINGS["REDIRECT_URLS"][audience]
         parameter = f"?{settings.JWT_AUTH_SETTINGS['GET_PARAMETER']}={token}"
-        redirect_url = base_url + parameter
+        if refresh_code is not None:
+            parameter += f"&{settings.JWT_AUTH_SETTINGS['REFRESH_CODE_GET_PARAMETER']}={refresh_code}"
+
+        return base_url + parameter
+
+
+class SessionTokenView(views.APIView):
+    """
+    Create a JWT token for the user of the SSO session, set as a cookie by `login/`, without asking for the password.
+    Only accepts the POST method.
+
+    Request:
+        {
+            "audience": ""
+        }
+
+    Errors:
+        Return 401 and:
+        {
+            "error": {
+                "type": "",
+                "detail": ""
+            }
+        }
+
+        The type of the error can be:
+            * INVALID_SESSION if the SSO sessions are disabled, or if there is no session cookie or the session is
+              unknown, expired or revoked.
+            * INVALID_AUDIENCE if audience is missing or the user is not allowed to access the audience.
+
+    Success:
+        Return 200 and:
+         {
+            "redirect": "https://…"
+         }
 
-        return Response({"redirect": redirect_url}, status=status.HTTP_200_OK)
+        The redirect URL only carries the access token: when it expires, the audience sends the user back to the SSO.
+    """
+
+    permission_classes = ()
+    authentication_classes = ()
+
+    def post(self, request, *args, **kwargs):
+        if not settings.SSO_SESSION_SETTINGS["ENABLED"]:
+            return Response(
+                {"error": {"type": "INVALID_SESSION", "detail": ""}},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+
+        serializer = SessionTokenSerializer(
+            data=request.data, context={"request": request}
+        )
+
+        if not serializer.is_valid():
+            error_type = serializer.errors.get(
+                "non_field_errors", ["INVALID_AUDIENCE"]
+            )[0]
+            response = Response(
+                {"error": {"type": error_type, "detail": ""}},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+            if error_type == "INVALID_SESSION":
+                delete_session_cookie(response)
+            return response
+
+        audience = serializer.validated_data["audience"]
+        return Response(
+            {
+                "redirect": LoginView.get_redirect_url(
+                    audience, serializer.validated_data["token"]
+                )
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class LogoutView(views.APIView):
+    """
+    End the SSO session of the request, or every SSO session of its user if
+    `SSO_SESSION_SETTINGS["LOGOUT_ALL_SESSIONS"]`, and delete the session cookie. The tokens already issued are still
+    valid.
+    Only accepts the POST method.
+
+    Success:
+        Return 204.
+    """
+
+    permission_classes = ()
+    authentication_classes = ()
+
+    def post(self, request, *args, **kwargs):
+        key = get_session_key(request)
+        if key is not None:
+            revoke_session(key)
+
+        response = Response(status=status.HTTP_204_NO_CONTENT)
+        delete_session_cookie(response)
+
+        return response
+
+
+class RefreshTokenView(views.APIView):
+    """
+    Exchange a refresh token, or the refresh code of a login, for a new access token and a new refresh token. The refresh
+    token cannot be used again. Only accepts the POST method.
+
+    Request:
+        {
+            "refresh_token": ""
+        }
+
+    Errors:
+        Return 401 and:
+        {
+            "error": {
+                "type": "",
+                "detail": ""
+            }
+        }
+
+        The type of the error can be:
+            * INVALID_REFRESH_TOKEN if the refresh token is missing, unknown or revoked.
+            * REFRESH_TOKEN_EXPIRED
+            * REFRESH_TOKEN_REUSED if the refresh token was already used. All the refresh tokens obtained from the same
+              login are then revoked.
+            * INVALID_AUDIENCE if the user is not active or not allowed to access the audience anymore.
+
+    Success:
+        Return 200 and:
+        {
+            "access": "",
+            "refresh": ""
+        }
+    """
+
+    permission_classes = ()
+    authentication_classes = ()
+
+    def post(self, request, *args, **kwargs):
+        serializer = RefreshTokenSerializer(data=request.data)
+
+        if not serializer.is_valid():
+            error_type = serializer.errors.get(
+                "non_field_errors", ["INVALID_REFRESH_TOKEN"]
+            )[0]
+            return Response(
+                {"error": {"type": error_type, "detail": ""}},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+
+        return Response(
+            {
+                "access": serializer.validated_data["access"],
+                "refresh": serializer.validated_data["refresh"],
+            },
+            status=status.HTTP_200_OK,
+        )
 
 
 class DecodeView(views.APIView):
-    """Decode a JWT token."""
+    """
+    Verify a JWT token and return its payload.
+    Only accepts the POST method.
+
+    Request:
+        {
+            "token": ""
+        }
+
+    Errors:
+        Return 400 and:
+        {
+            "non_field_errors": [""]
+        }
+
+        The type of the error is one of those of `verify/batch/`, except INVALID_AUDIENCE: the audience is not
+        checked.
+
+    Success:
+        Return 200, the token and its claims.
+    """
 
     permission_classes = ()
     authentication_classes = ()
@@ -105,6 +364,86 @@ class DecodeView(views.APIView):
         return Response(serializer.validated_data, status=status.HTTP_200_OK)
 
 
+class BatchDecodeView(views.APIView):
+    """
+    Verify several JWT tokens in one request.
+    Only accepts the POST method.
+
+    Request:
+        {
+            "tokens": ["", ...],
+            "audience": ""  (optional, the audience is only checked if provided)
+        }
+
+    Errors:
+        Return 400 and the serializer errors if `tokens` is missing, empty or longer than
+        `JWT_AUTH_SETTINGS["VERIFY_BATCH_MAX_SIZE"]`, or if `audience` is unknown.
+
+    Success:
+        Return 200 and, in the order of `tokens`:
+        {
+            "results": [
+                {"claims": {...}},
+                {"error": {"type": "", "detail": ""}},
+                ...
+            ]
+        }
+
+        The type of an error can be:
+            * TOKEN_EXPIRED
+            * TOKEN_REVOKED if the token, or all the tokens of the user, were revoked before the expiration.
+            * INVALID_SIGNATURE
+            * INVALID_AUDIENCE
+            * INVALID_ISSUER
+            * INVALID_TOKEN if the token cannot be decoded.
+    """
+
+    permission_classes = ()
+    authentication_classes = ()
+
+    def post(self, request, *args, **kwargs):
+        serializer = BatchDecodeTokenSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(
+            {"results": serializer.validated_data["results"]},
+            status=status.HTTP_200_OK,
+        )
+
+
+class JWKSView(views.APIView):
+    """
+    Publish the public key as a JSON Web Key Set, so that the audiences can verify the tokens locally.
+    Only accepts the GET method.
+
+    The signing key comes first. `default_kid` names the key which verifies the tokens without a `kid` header.
+
+    The response carries a strong ETag and can be cached by the audiences for
+    `JWT_AUTH_SETTINGS["JWKS_MAX_AGE"]`. A request with a matching `If-None-Match` header gets a 304.
+    """
+
+    permission_classes = ()
+    authentication_classes = ()
+
+    def get(self, request, *args, **kwargs):
+        etag = get_jwks_etag()
+
+        if etag in request.META.get("HTTP_IF_NONE_MATCH", ""):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(get_jwks(), status=status.HTTP_200_OK)
+
+        response["ETag"] = etag
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=int(settings.JWT_AUTH_SETTINGS["JWKS_MAX_AGE"].total_seconds()),
+        )
+
+        return response
+
+
 class RequestPasswordRecoveryView(views.APIView):
     """
     Create a password recovery request.
@@ -127,6 +466,9 @@ class RequestPasswordRecoveryView(views.APIView):
             * INVALID_EMAIL: if email is missing or does not appear in the database (including if it is ill-formatted).
             * UNKNOWN_ERROR for another error. In that case, detail will contain more information about the error.
 
+        Return 429, with the type RATE_LIMITED, if too many requests were made from the client IP or for the email.
+        The `Retry-After` header tells when to try again.
+
     Success:
         Return 200 and that's all.
     """
@@ -142,6 +484,15 @@ class RequestPasswordRecoveryView(views.APIView):
     def post(self, request, *args, **kwargs):
         email = request.data.get("email", None)
 
+        try:
+            RateLimiter.hit(
+                "password_recovery",
+                ip=RateLimiter.get_client_ip(request),
+                account=str(email or "").lower(),
+            )
+        except RateLimitedError as e:
+            return get_rate_limited_response(e)
+
         # Validate the email address.
         try:
             EmailValidator(email)
@@ -165,15 +516,15 @@ class RequestPasswordRecoveryView(views.APIView):
 
         password_recovery = serializer.save(user=user)
 
-        # SEND THE EMAIL
-        email_server = EmailSender("Rezal")
-        email_server.connect()
-        email_server.send_password_recovery_link(
-            user.email,
-            user.first_name + " " + user.last_name,
-            str(password_recovery.id),
+        # QUEUE THE EMAIL. It is sent by the `send_queued_emails` command.
+        EmailQueue.enqueue(
+            "Rezal",
+            **get_password_recovery_email(
+                user.email,
+                user.first_name + " " + user.last_name,
+                str(password_recovery.id),
+            ),
         )
-        email_server.close()
 
         # Return nothing.
         return Response("", status=status.HTTP_200_OK)
@@ -234,11 +585,15 @@ class ResetPasswordView(views.APIView):
         password_recovery = PasswordRecovery.objects.get(
             id=serializer.validated_data["token"]
         )
-        password_recovery.user.set_password(serializer.validated_data["password"])
-        password_recovery.user.save()
-
-        # Set the password_recovery as `used`.
-        password_recovery.used = True
-        password_recovery.save()
+        with transaction.atomic():
+            password_recovery.user.set_password(serializer.validated_data["password"])
+            password_recovery.user.save()
+            # Whoever knew the previous password may have opened an SSO session, or kept a refresh token.
+            revoke_user_sessions(password_recovery.user)
+            revoke_user_refresh_tokens(password_recovery.user)
+
+            # Set the password_recovery as `used`.
+            password_recovery.used = True
+            password_recovery.save()
 
         return Response("", status=status.HTTP_200_OK)
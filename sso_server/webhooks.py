@@ -1,20 +1,228 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.forms.models import model_to_dict
-from requests import post
+from django.utils import timezone
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+
+from sso_server.models import IdentityWebhookDelivery
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request to an audience whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Fail fast when an audience is down.
+
+    The circuit opens after `failure_threshold` consecutive failures: the requests are then rejected without being
+    sent. After `recovery_timeout` seconds, the circuit becomes half-open and lets `half_open_max_calls` requests
+    through. It closes again if one of them succeeds, and opens again if one of them fails.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        recovery_timeout: float,
+        half_open_max_calls: int = 1,
+        clock=time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._half_open_calls = 0
+
+        self.opened_count = 0
+        self.closed_count = 0
+        self.rejected_count = 0
+
+    def _update_state(self):
+        if (
+            self._state == self.OPEN
+            and self.clock() - self._opened_at >= self.recovery_timeout
+        ):
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = self.clock()
+        self.opened_count += 1
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._update_state()
+            return self._state
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            self._update_state()
+
+            if self._state == self.CLOSED:
+                return True
+
+            if (
+                self._state == self.HALF_OPEN
+                and self._half_open_calls < self.half_open_max_calls
+            ):
+                self._half_open_calls += 1
+                return True
+
+            self.rejected_count += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                self._state = self.CLOSED
+                self.closed_count += 1
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._open()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            self._update_state()
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "opened": self.opened_count,
+                "closed": self.closed_count,
+                "rejected": self.rejected_count,
+            }
+
+
+class AudienceWebhookClient:
+    """
+    Send the requests to the webhook of one audience, through a keep-alive connection pool, with the timeouts and the
+    circuit breaker of the audience's policy.
+    """
+
+    def __init__(self, audience: str, api_key: str, policy: dict):
+        self.audience = audience
+        self.timeout = (policy["CONNECT_TIMEOUT"], policy["READ_TIMEOUT"])
+        self.breaker = CircuitBreaker(
+            failure_threshold=policy["FAILURE_THRESHOLD"],
+            recovery_timeout=policy["RECOVERY_TIMEOUT"].total_seconds(),
+            half_open_max_calls=policy["HALF_OPEN_MAX_CALLS"],
+        )
+
+        self.session = Session()
+        self.session.headers["X-Api-Key"] = api_key
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=policy["POOL_SIZE"])
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, url, **kwargs):
+        """
+        Post to the audience. Raise `CircuitOpenError` if the circuit is open.
+        Network errors and 5xx responses count as failures of the audience.
+        """
+
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(f"The circuit of {self.audience} is open.")
+
+        try:
+            response = self.session.post(url, timeout=self.timeout, **kwargs)
+        except RequestException:
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+        return response
+
+    def close(self):
+        self.session.close()
 
 
 class IdentityWebhookService:
     IDENTITY_WEBHOOK_URLS: dict = settings.IDENTITY_WEBHOOK_URLS
+    IDENTITY_BULK_WEBHOOK_URLS: dict = settings.IDENTITY_BULK_WEBHOOK_URLS
     IDENTITY_API_KEYS: dict = settings.IDENTITY_API_KEYS
+    SETTINGS: dict = settings.IDENTITY_WEBHOOK_SETTINGS
+
+    _clients: dict = {}
+    _clients_lock = threading.Lock()
 
     @classmethod
-    def post_identity(self, user, audience):
-        if (
-            audience not in self.IDENTITY_WEBHOOK_URLS.keys()
-            or audience not in self.IDENTITY_API_KEYS.keys()
-        ):
-            return
+    def get_policy(cls, audience) -> dict:
+        return {
+            **cls.SETTINGS["DEFAULT_POLICY"],
+            **cls.SETTINGS["AUDIENCE_POLICIES"].get(audience, {}),
+        }
+
+    @classmethod
+    def get_client(cls, audience) -> AudienceWebhookClient:
+        """Return the client of the audience, which is shared by the whole process."""
 
+        with cls._clients_lock:
+            if audience not in cls._clients:
+                cls._clients[audience] = AudienceWebhookClient(
+                    audience, cls.IDENTITY_API_KEYS[audience], cls.get_policy(audience)
+                )
+            return cls._clients[audience]
+
+    @classmethod
+    def reset_clients(cls):
+        with cls._clients_lock:
+            for client in cls._clients.values():
+                client.close()
+            cls._clients = {}
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """Return the state and the counters of the circuit breaker of each audience."""
+
+        with cls._clients_lock:
+            clients = list(cls._clients.values())
+
+        return {client.audience: client.breaker.get_stats() for client in clients}
+
+    @classmethod
+    def is_configured(cls, audience) -> bool:
+        return (
+            audience in cls.IDENTITY_WEBHOOK_URLS.keys()
+            and audience in cls.IDENTITY_API_KEYS.keys()
+        )
+
+    @classmethod
+    def supports_bulk(cls, audience) -> bool:
+        """An audience supports the bulk mode iff it declares a bulk webhook URL."""
+
+        return (
+            cls.is_configured(audience) and audience in cls.IDENTITY_BULK_WEBHOOK_URLS
+        )
+
+    @classmethod
+    def get_identity(cls, user) -> dict:
         minimal_identity = model_to_dict(
             user,
             fields=(
@@ -28,18 +236,299 @@ class IdentityWebhookService:
         )
         minimal_identity["id"] = minimal_identity["username"]
 
-        hook_url = self.IDENTITY_WEBHOOK_URLS[audience]
-        api_key = self.IDENTITY_API_KEYS[audience]
+        return minimal_identity
+
+    @classmethod
+    def post_identity(cls, user, audience) -> bool:
+        """Send the identity of the user to the audience. Return True iff the audience created it."""
+
+        if not cls.is_configured(audience):
+            return True
 
-        audience_response = post(
-            hook_url, json=minimal_identity, headers={"X-Api-Key": api_key}
+        hook_url = cls.IDENTITY_WEBHOOK_URLS[audience]
+
+        audience_response = cls.get_client(audience).post(
+            hook_url, json=cls.get_identity(user)
         )
 
         if audience_response.status_code == 201:
             print(
                 f"Minimal identity created. Audience: {audience}. Response: {audience_response.text}"
             )
+            return True
         else:
             print(
                 f"Failed: minimal identity creation. Audience: {audience}. Response: {audience_response.status_code} {audience_response.text}"
             )
+            return False
+
+    @classmethod
+    def post_identities(cls, users, audience) -> bool:
+        """
+        Send the identities of the users to the audience, as arrays of at most `BULK_BATCH_SIZE` identities posted to
+        its bulk webhook. Fall back to one request per user if the audience does not support the bulk mode.
+        Return True iff the audience created all of them.
+        """
+
+        if not cls.supports_bulk(audience):
+            return all([cls.post_identity(user, audience) for user in users])
+
+        hook_url = cls.IDENTITY_BULK_WEBHOOK_URLS[audience]
+        batch_size = cls.get_policy(audience)["BULK_BATCH_SIZE"]
+        client = cls.get_client(audience)
+        created = True
+
+        for start in range(0, len(users), batch_size):
+            identities = [
+                cls.get_identity(user) for user in users[start : start + batch_size]
+            ]
+            audience_response = client.post(hook_url, json=identities)
+
+            if audience_response.status_code in (200, 201):
+                print(
+                    f"{len(identities)} minimal identities created. Audience: {audience}."
+                )
+            else:
+                print(
+                    f"Failed: bulk minimal identity creation. Audience: {audience}. Response: {audience_response.status_code} {audience_response.text}"
+                )
+                created = False
+
+        return created
+
+
+class IdentityWebhookOutbox:
+    """
+    The identities are not sent when an access is created: an `IdentityWebhookDelivery` is written in the same
+    transaction, and the `process_identity_webhooks` command sends it later, retrying with an exponential backoff.
+    """
+
+    SETTINGS: dict = settings.IDENTITY_WEBHOOK_SETTINGS
+
+    @classmethod
+    def enqueue(cls, user, audience):
+        if not IdentityWebhookService.is_configured(audience):
+            return
+
+        IdentityWebhookDelivery.objects.create(user=user, audience=audience)
+
+    @classmethod
+    def enqueue_many(cls, accesses):
+        """Write the deliveries of several accesses with one query. Used when the accesses are bulk created."""
+
+        IdentityWebhookDelivery.objects.bulk_create(
+            IdentityWebhookDelivery(user_id=access.user_id, audience=access.audience)
+            for access in accesses
+            if IdentityWebhookService.is_configured(access.audience)
+        )
+
+    @classmethod
+    def get_due(cls, audience):
+        return IdentityWebhookDelivery.objects.filter(
+            audience=audience,
+            status=IdentityWebhookDelivery.PENDING,
+            next_attempt_at__lte=timezone.now(),
+        )
+
+    @classmethod
+    def is_batch_ready(cls, audience) -> bool:
+        """
+        Tell whether the due deliveries of a bulk audience should be sent: either they fill a batch, or the oldest
+        one has been waiting for more than `BULK_FLUSH_INTERVAL`.
+        """
+
+        policy = IdentityWebhookService.get_policy(audience)
+        due = cls.get_due(audience)
+
+        if due[: policy["BULK_BATCH_SIZE"]].count() >= policy["BULK_BATCH_SIZE"]:
+            return True
+
+        return due.filter(
+            next_attempt_at__lte=timezone.now() - policy["BULK_FLUSH_INTERVAL"]
+        ).exists()
+
+    @classmethod
+    def claim(cls, audience, limit) -> list:
+        """
+        Return up to `limit` deliveries which are due for the audience. They are leased to the caller for
+        `CLAIM_LEASE`: if the caller dies before recording the outcome, they will be claimed again afterwards.
+        """
+
+        now = timezone.now()
+
+        with transaction.atomic():
+            deliveries = list(
+                IdentityWebhookDelivery.objects.select_for_update(
+                    skip_locked=True, of=("self",)
+                )
+                .select_related("user")
+                .filter(
+                    audience=audience,
+                    status=IdentityWebhookDelivery.PENDING,
+                    next_attempt_at__lte=now,
+                )
+                .order_by("next_attempt_at")[:limit]
+            )
+            IdentityWebhookDelivery.objects.filter(
+                pk__in=[delivery.pk for delivery in deliveries]
+            ).update(next_attempt_at=now + cls.SETTINGS["CLAIM_LEASE"])
+
+        return deliveries
+
+    @classmethod
+    def get_retry_delay(cls, attempts):
+        return min(
+            cls.SETTINGS["RETRY_BACKOFF"] * 2 ** (attempts - 1),
+            cls.SETTINGS["MAX_RETRY_BACKOFF"],
+        )
+
+    @classmethod
+    def record_success(cls, deliveries):
+        IdentityWebhookDelivery.objects.filter(
+            pk__in=[delivery.pk for delivery in deliveries]
+        ).update(
+            attempts=F("attempts") + 1,
+            status=IdentityWebhookDelivery.DELIVERED,
+            delivered_at=timezone.now(),
+            last_error="",
+        )
+
+    @classmethod
+    def record_failure(cls, delivery, error: str):
+        delivery.attempts += 1
+        delivery.last_error = error
+
+        if delivery.attempts >= cls.SETTINGS["MAX_ATTEMPTS"]:
+            delivery.status = IdentityWebhookDelivery.FAILED
+        else:
+            delivery.next_attempt_at = timezone.now() + cls.get_retry_delay(
+                delivery.attempts
+            )
+
+        delivery.save(
+            update_fields=("attempts", "status", "next_attempt_at", "last_error")
+        )
+
+    @classmethod
+    def release(cls, deliveries):
+        """Make claimed deliveries due again, without counting an attempt."""
+
+        IdentityWebhookDelivery.objects.filter(
+            pk__in=[delivery.pk for delivery in deliveries]
+        ).update(next_attempt_at=timezone.now())
+
+    @classmethod
+    def send(cls, audience, deliveries):
+        """
+        Send deliveries of the audience, in one request if it supports the bulk mode, and return the error, or None
+        if it succeeded. Does not touch the database.
+        Raise `CircuitOpenError` if the deliveries were not sent because the audience is down.
+        """
+
+        users = [delivery.user for delivery in deliveries]
+
+        try:
+            if IdentityWebhookService.post_identities(users, audience):
+                return None
+            return "The audience did not create the identity."
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            return f"{e.__class__.__name__}: {e}"
+
+
+class IdentityWebhookWorker:
+    """
+    Drain the outbox. Each audience has its own thread pool of `concurrency` threads, so that a slow audience does
+    not delay the others. The threads only make the HTTP requests; the database is only used by the calling thread.
+
+    The deliveries of an audience which supports the bulk mode are sent in batches of `BULK_BATCH_SIZE`, once a batch
+    is full or `BULK_FLUSH_INTERVAL` has elapsed.
+    """
+
+    def __init__(self, batch_size=100, concurrency=4):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.executors = {
+            audience: ThreadPoolExecutor(
+                max_workers=concurrency, thread_name_prefix=f"webhook-{audience}"
+            )
+            for audience in IdentityWebhookService.IDENTITY_WEBHOOK_URLS.keys()
+            if IdentityWebhookService.is_configured(audience)
+        }
+
+    def get_request_limit(self, audience) -> int:
+        """Do not send anything to an audience whose circuit is open, and only probe it when it is half-open."""
+
+        breaker = IdentityWebhookService.get_client(audience).breaker
+        state = breaker.state
+
+        if state == CircuitBreaker.OPEN:
+            return 0
+        if state == CircuitBreaker.HALF_OPEN:
+            return breaker.half_open_max_calls
+        if IdentityWebhookService.supports_bulk(audience):
+            return self.concurrency
+        return self.batch_size
+
+    def get_batches(self, audience, request_limit) -> list:
+        """Claim the due deliveries of the audience, grouped by request."""
+
+        if not IdentityWebhookService.supports_bulk(audience):
+            return [
+                [delivery]
+                for delivery in IdentityWebhookOutbox.claim(audience, request_limit)
+            ]
+
+        if not IdentityWebhookOutbox.is_batch_ready(audience):
+            return []
+
+        size = IdentityWebhookService.get_policy(audience)["BULK_BATCH_SIZE"]
+        deliveries = IdentityWebhookOutbox.claim(audience, request_limit * size)
+        return [deliveries[i : i + size] for i in range(0, len(deliveries), size)]
+
+    def run_once(self) -> dict:
+        """
+        Send the due deliveries: up to `batch_size` requests per audience, or `concurrency` batches for an audience
+        supporting the bulk mode. Return the number of deliveries which succeeded, failed, or were postponed because
+        the circuit of their audience opened.
+        """
+
+        futures = []
+        for audience, executor in self.executors.items():
+            request_limit = self.get_request_limit(audience)
+            if request_limit == 0:
+                continue
+
+            for deliveries in self.get_batches(audience, request_limit):
+                futures.append(
+                    (
+                        deliveries,
+                        executor.submit(
+                            IdentityWebhookOutbox.send, audience, deliveries
+                        ),
+                    )
+                )
+
+        counts = {"delivered": 0, "failed": 0, "postponed": 0}
+        for deliveries, future in futures:
+            try:
+                error = future.result()
+            except CircuitOpenError:
+                IdentityWebhookOutbox.release(deliveries)
+                counts["postponed"] += len(deliveries)
+                continue
+
+            if error is None:
+                IdentityWebhookOutbox.record_success(deliveries)
+                counts["delivered"] += len(deliveries)
+            else:
+                for delivery in deliveries:
+                    IdentityWebhookOutbox.record_failure(delivery, error)
+                counts["failed"] += len(deliveries)
+
+        return counts
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown()